@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Drone, Medication, DroneBatteryLogHistory
+from .models import Drone, Medication, DroneBatteryLogHistory, DroneBatteryLogRollup, DroneBatterySweep
 
 
 @admin.register(Drone)
@@ -17,3 +17,15 @@ class MedicationModelAdmin(admin.ModelAdmin):
 class DroneBatteryLogHistoryModelAdmin(admin.ModelAdmin):
     list_display = ['drone', 'battery_capacity', 'created_at']
     search_fields = ['drone__id', 'drone__serial_number']
+
+
+@admin.register(DroneBatteryLogRollup)
+class DroneBatteryLogRollupModelAdmin(admin.ModelAdmin):
+    list_display = ['drone', 'period', 'bucket_start', 'min_battery', 'avg_battery', 'max_battery', 'sample_count']
+    list_filter = ['period']
+    search_fields = ['drone__id', 'drone__serial_number']
+
+
+@admin.register(DroneBatterySweep)
+class DroneBatterySweepModelAdmin(admin.ModelAdmin):
+    list_display = ['id', 'started_at', 'finished_at', 'shard_count', 'drones', 'history_rows', 'duration_seconds']
@@ -0,0 +1,134 @@
+"""
+Async versions of the read-heavy drone endpoints, served under /async/.
+
+They return the same responses as the matching DroneViewset actions, but run
+on the event loop of an ASGI server (see src/project/asgi.py) instead of
+holding a worker thread for the whole request. DRF views can not be async, so
+these are plain Django views rendering with the configured JSON renderer.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from src.drone import cache as drone_cache
+from src.drone.api.renderers import json_renderer
+from src.drone.api.serialiazers import AvailableDronesQuerySerializer, FastDroneSerializer, FastMedicationSerializer
+from src.drone.api.views import AVAILABLE_DRONES_CHUNK_SIZE, available_drones, ndjson_drones
+from src.drone.models import Medication
+
+
+def _response(data, status=200):
+    return HttpResponse(json_renderer().render(data), status=status, content_type='application/json')
+
+
+def _not_found(error):
+    # the body DRF returns for an Http404
+    return _response({'detail': str(error)}, status=404)
+
+
+def _on_own_connection(query):
+    def run():
+        try:
+            return query()
+        finally:
+            connections.close_all()
+    return run
+
+
+async def run_query(query):
+    """
+    Run a sync ORM callable from async code.
+
+    With DRONE_ASYNC_CONCURRENT_QUERIES (the default on PostgreSQL) it runs on a
+    pooled thread with its own database connection, so queries awaited together
+    run concurrently. Otherwise (the default on SQLite) it goes through Django's
+    single async ORM thread, like `afirst()` and friends, and queries awaited
+    together run one after the other.
+    """
+    if settings.DRONE_ASYNC_CONCURRENT_QUERIES:
+        return await sync_to_async(_on_own_connection(query), thread_sensitive=False)()
+    return await sync_to_async(query)()
+
+
+@require_GET
+async def check_battery_level(request, pk):
+    try:
+        drone = await drone_cache.aget_drone(pk)
+    except Http404 as error:
+        return _not_found(error)
+
+    return _response({
+        'drone': {
+            'id': drone.id,
+            'serial_number': drone.serial_number,
+            'battery_capacity': round(drone.projected_battery(), 0),
+        },
+    })
+
+
+@require_GET
+async def check_loaded_medications(request, pk):
+    def load_medications():
+        return FastMedicationSerializer(Medication.objects.filter(drone_id=pk)).data
+
+    # the drone and its medications are independent lookups, fetched at the same time
+    # when DRONE_ASYNC_CONCURRENT_QUERIES is on, one after the other otherwise
+    try:
+        drone, medications = await asyncio.gather(
+            drone_cache.aget_drone(pk),
+            drone_cache.aget_loaded_medications(pk, lambda: run_query(load_medications)),
+        )
+    except Http404 as error:
+        return _not_found(error)
+
+    return _response({
+        'drone': {
+            'id': drone.id,
+            'serial_number': drone.serial_number,
+        },
+        'loaded_medications': medications,
+    })
+
+
+async def _stream_available_drones(drones):
+    # values_list().aiterator() would start its query on the event loop, so the
+    # drones are paged by id instead, one async query per chunk
+    rows = drones.values_list(*FastDroneSerializer.fields)
+    while True:
+        chunk = [row async for row in rows[:AVAILABLE_DRONES_CHUNK_SIZE]]
+        if chunk:
+            yield ndjson_drones(chunk)
+        if len(chunk) < AVAILABLE_DRONES_CHUNK_SIZE:
+            return
+        rows = rows.filter(id__gt=chunk[-1][0])
+
+
+@require_GET
+async def check_available_drones(request):
+    """
+    Takes the query parameters of the available-drones endpoint.
+    """
+    params = AvailableDronesQuerySerializer(data=request.GET)
+    if not params.is_valid():
+        return _response(params.errors, status=400)
+    params = params.validated_data
+    drones = available_drones(params)
+
+    if params['stream']:
+        return StreamingHttpResponse(_stream_available_drones(drones), content_type='application/x-ndjson')
+
+    rows = drones.values_list(*FastDroneSerializer.fields)
+    if 'limit' not in params:
+        return _response({
+            'available_drones': FastDroneSerializer([row async for row in rows]).data,
+        })
+
+    page = [row async for row in rows[:params['limit']]]
+    return _response({
+        'available_drones': FastDroneSerializer(page).data,
+        'next_cursor': page[-1][0] if len(page) == params['limit'] else None,
+    })
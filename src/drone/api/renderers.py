@@ -0,0 +1,120 @@
+"""
+JSON renderer and parser backed by orjson, with DRF's stdlib json classes as the fallback.
+
+orjson serializes dicts, lists, strings, numbers, datetimes and UUIDs natively.
+Everything else goes through the same `default` hook as DRF's JSONEncoder, so
+the output is byte-identical to the stdlib renderer. Decimals are rendered as
+floats like DRF does, enums (DroneState, DroneModel...) as their value like
+orjson does, which for the drone enums is also their label. orjson writes
+exponents and floats below 1e-4 differently and renders NaN and infinity as
+null, where the stdlib raises ValueError; responses holding any of them are
+rendered by the stdlib renderer instead. Without orjson installed, or for
+indented or ASCII-only output, both classes behave like their DRF parents.
+Enabled with DRONE_FAST_JSON, see settings.
+"""
+import codecs
+import math
+import re
+from decimal import Decimal
+from enum import Enum
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON is valid with them, but they end lines in JavaScript, DRF escapes them too
+_LINE_SEPARATORS = ((b'\xe2\x80\xa8', b'\\u2028'), (b'\xe2\x80\xa9', b'\\u2029'))
+
+# floats orjson writes unlike repr(): 1e16 for 1e+16, 1e-7 for 1e-07 and 0.00001 for 1e-05,
+# a match inside a string only costs a fallback
+_DIFFERENT_FLOATS = re.compile(rb'(?:^|[:,\[])-?(?:\d+(?:\.\d+)?[eE]|0\.0000)')
+
+
+class JSONEncoder(encoders.JSONEncoder):
+    """
+    DRF's JSONEncoder, also rendering enums as their value.
+    """
+
+    def default(self, obj):
+        if isinstance(obj, Enum):
+            return obj.value
+        return super().default(obj)
+
+
+_encoder = JSONEncoder()
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        if not obj.is_finite():
+            # orjson would render it as null, the stdlib renderer raises
+            raise TypeError('Out of range decimal values are not JSON compliant')
+        return float(obj)
+    return _encoder.default(obj)
+
+
+def _has_non_finite(data):
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, dict):
+        return any(_has_non_finite(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(_has_non_finite(value) for value in data)
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    encoder_class = JSONEncoder
+
+    def _uses_orjson(self, accepted_media_type, renderer_context):
+        return (
+            orjson is not None
+            and self.compact
+            and not self.ensure_ascii
+            and self.get_indent(accepted_media_type, renderer_context or {}) is None
+        )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or not self._uses_orjson(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+        except orjson.JSONEncodeError:
+            # integers beyond 64 bits and other values orjson refuses
+            return super().render(data, accepted_media_type, renderer_context)
+        if _DIFFERENT_FLOATS.search(ret) or (b'null' in ret and _has_non_finite(data)):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        for separator, escaped in _LINE_SEPARATORS:
+            if separator in ret:
+                ret = ret.replace(separator, escaped)
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+def json_renderer():
+    """
+    The JSON renderer selected by DRONE_FAST_JSON, for responses rendered outside DRF views.
+    """
+    return FastJSONRenderer() if settings.DRONE_FAST_JSON else JSONRenderer()
@@ -1,6 +1,14 @@
+from collections import defaultdict
+from datetime import timedelta
 from decimal import Decimal
+from django.conf import settings
+from django.db.models import F, QuerySet
+from django.utils.timezone import get_current_timezone, now
 from rest_framework import serializers
-from src.drone.enums import DroneState
+from src.drone import cache as drone_cache
+from src.drone.battery import rebase_battery, unloaded_battery_expression
+from src.drone.enums import DroneModel, DroneState
+from src.drone.transitions import TRANSITIONS
 from src.drone.models import Drone, Medication
 
 
@@ -24,7 +32,144 @@ class DroneSerializer(serializers.ModelSerializer):
         return data
 
 
+class BulkDroneSerializer(DroneSerializer):
+    """
+    DroneSerializer for bulk registration, serial numbers are checked against a
+    prefetch (see src.drone.registration) instead of one query per row.
+    """
+    class Meta(DroneSerializer.Meta):
+        extra_kwargs = {'serial_number': {'validators': []}}
+
+
+# The fast serializers build the representation of a ModelSerializer straight
+# from `.values_list(*fields)` rows, for the hot read endpoints. Every field is
+# converted the way its DRF field would, so the JSON is byte-identical.
+_TENTH = Decimal('0.1')
+_DRONE_MODEL_LABELS = {model: str(model) for model in DroneModel}
+_DRONE_STATE_LABELS = {state: str(state) for state in DroneState}
+
+
+def _decimal(value):
+    # DRF DecimalField with COERCE_DECIMAL_TO_STRING, the models store one decimal place
+    return '{:f}'.format(value.quantize(_TENTH))
+
+
+def _datetime_converter():
+    # DRF DateTimeField: ISO 8601 in the current time zone, UTC as 'Z'
+    tz = get_current_timezone() if settings.USE_TZ else None
+
+    def convert(value):
+        if value is None:
+            return None
+        value = (value.astimezone(tz) if tz else value).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+class FastSerializer:
+    """
+    Read-only, many=True only. `rows` is a queryset or rows of `.values_list(*fields)`.
+    """
+    fields = ()
+
+    def __init__(self, rows):
+        if isinstance(rows, QuerySet):
+            rows = rows.values_list(*self.fields)
+        self.rows = rows
+
+    @property
+    def data(self):
+        return self.represent(self.rows)
+
+    def represent(self, rows):
+        raise NotImplementedError
+
+
+class FastDroneSerializer(FastSerializer):
+    fields = DroneSerializer.Meta.fields
+
+    def represent(self, rows):
+        iso_datetime = _datetime_converter()
+        return [
+            {
+                'id': drone_id,
+                'serial_number': serial_number,
+                'drone_model': _DRONE_MODEL_LABELS[drone_model],
+                'weight_limit': _decimal(weight_limit),
+                'battery_capacity': _decimal(battery_capacity),
+                'state': _DRONE_STATE_LABELS[state],
+                'created_at': iso_datetime(created_at),
+            }
+            for drone_id, serial_number, drone_model, weight_limit, battery_capacity, state, created_at in rows
+        ]
+
+
+class BulkTransitionSerializer(serializers.Serializer):
+    drone_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=10000)
+    state = serializers.ChoiceField(choices=[state.value for state in TRANSITIONS])
+
+    def validate_state(self, value):
+        return DroneState(value)
+
+
+class DispatchPlanSerializer(serializers.Serializer):
+    """
+    Dispatch plan request, the whole backlog and every available drone by default.
+    """
+    apply = serializers.BooleanField(default=False)
+    medication_ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=100000)
+    drone_ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=100000)
+
+
+class AvailableDronesQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the available-drones endpoint.
+    """
+    limit = serializers.IntegerField(min_value=1, max_value=1000, required=False)
+    cursor = serializers.IntegerField(min_value=0, required=False)
+    stream = serializers.BooleanField(default=False)
+    drone_model = serializers.ChoiceField(choices=[model.value for model in DroneModel], required=False)
+    min_weight_limit = serializers.DecimalField(max_digits=20, decimal_places=1, required=False)
+
+    def validate(self, attrs):
+        if attrs['stream'] and 'limit' in attrs:
+            raise serializers.ValidationError("stream returns every available drone and can not take a limit.")
+        return attrs
+
+
+class BatteryHistoryQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the battery-history endpoints, the range defaults to the last day.
+    """
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    points = serializers.IntegerField(min_value=1, max_value=2000, default=300)
+    drone_ids = serializers.CharField(required=False)
+
+    def validate_drone_ids(self, value):
+        try:
+            return [int(drone_id) for drone_id in value.split(',')]
+        except ValueError:
+            raise serializers.ValidationError("Must be a comma separated list of drone ids.")
+
+    def validate(self, attrs):
+        attrs.setdefault('end', now())
+        attrs.setdefault('start', attrs['end'] - timedelta(days=1))
+        if attrs['start'] >= attrs['end']:
+            raise serializers.ValidationError("start must be before end.")
+        return attrs
+
+
+def _variant_urls(variants):
+    url = Medication._meta.get_field('image').storage.url
+    return {variant: url(name) for variant, name in variants.items()}
+
+
 class MedicationSerializer(serializers.ModelSerializer):
+    # URLs of the resized copies of `image`, empty until the upload is processed
+    thumbnail = serializers.SerializerMethodField()
+    images = serializers.SerializerMethodField()
+
     class Meta:
         model = Medication
         fields = (
@@ -33,34 +178,136 @@ class MedicationSerializer(serializers.ModelSerializer):
             'weight',
             'code',
             'image',
+            'thumbnail',
+            'images',
             'created_at',
         )
 
+    def get_thumbnail(self, medication):
+        return self.get_images(medication).get('thumbnail')
+
+    def get_images(self, medication):
+        return _variant_urls(medication.image_variants)
+
+
+class FastMedicationSerializer(FastSerializer):
+    fields = ('id', 'name', 'weight', 'code', 'image', 'image_variants', 'created_at')
+
+    def represent(self, rows):
+        iso_datetime = _datetime_converter()
+        image_url = Medication._meta.get_field('image').storage.url
+        data = []
+        for medication_id, name, weight, code, image, image_variants, created_at in rows:
+            images = _variant_urls(image_variants)
+            data.append({
+                'id': medication_id,
+                'name': name,
+                'weight': _decimal(weight),
+                'code': code,
+                'image': image_url(image) if image else None,
+                'thumbnail': images.get('thumbnail'),
+                'images': images,
+                'created_at': iso_datetime(created_at),
+            })
+        return data
+
 
 class LoadMedicationSerializer(serializers.Serializer):
+    """
+    Validates and loads a set of medications onto the drone passed in the context.
+    Must be used inside a transaction, the medications are locked with select_for_update.
+    """
     medication_ids = serializers.ListField(child=serializers.IntegerField())
 
-    def _total_weight(self, medications: Medication) -> float:
+    def _new_medications(self, drone: Drone, medications):
+        """
+        helper function returning the medications not yet loaded on the drone
+        """
+        return [med for med in medications if med.drone_id != drone.id]
+
+    def _total_weight(self, drone: Drone, medications) -> Decimal:
         """
-        helper function to calculate total medication weight
+        helper function to calculate the drone's total weight once the medications are loaded
         """
-        total_weight = Decimal(0.0)
-        for med in medications:
-            total_weight += med.weight
-        return total_weight
+        return drone.loaded_weight + sum(med.weight for med in self._new_medications(drone, medications))
 
     def validate(self, attrs):
         drone: Drone = self.context['drone']
-        medications = Medication.objects.filter(id__in=attrs['medication_ids'])
-        med_total_weight = self._total_weight(medications)
+        medication_ids = set(attrs['medication_ids'])
+        medications = list(
+            Medication.objects.select_for_update().filter(id__in=medication_ids).only('id', 'weight', 'drone_id')
+        )
 
-        if drone.battery_capacity < 25:
+        if drone.projected_battery() < 25:
             raise serializers.ValidationError("Can not load medication, battery capacity is low")
 
         if drone.state != DroneState.LOADING:
             raise serializers.ValidationError("Not valid state to load medication.")
 
-        if med_total_weight > drone.weight_limit:
+        missing_ids = sorted(medication_ids - {med.id for med in medications})
+        if missing_ids:
+            raise serializers.ValidationError({
+                'medication_ids': f"Medications not found: {', '.join(map(str, missing_ids))}",
+            })
+
+        if self._total_weight(drone, medications) > drone.weight_limit:
             raise serializers.ValidationError("Medication weight exceeds the drone's weight limit")
 
+        attrs['medications'] = medications
         return attrs
+
+    def create(self, validated_data):
+        drone: Drone = self.context['drone']
+        new_medications = self._new_medications(drone, validated_data['medications'])
+
+        if new_medications:
+            Medication.objects.filter(id__in=[med.id for med in new_medications]).update(drone=drone)
+
+            # medications moved from another drone are taken off its load counters
+            previous_loads = defaultdict(lambda: [Decimal(0), 0])
+            for med in new_medications:
+                if med.drone_id:
+                    previous_loads[med.drone_id][0] += med.weight
+                    previous_loads[med.drone_id][1] += 1
+            for drone_id, (weight, count) in previous_loads.items():
+                Drone.objects.filter(pk=drone_id).update(
+                    loaded_weight=F('loaded_weight') - weight,
+                    loaded_count=F('loaded_count') - count,
+                    battery_capacity=unloaded_battery_expression(weight),
+                )
+            drone_cache.invalidate_drones(previous_loads)
+
+            drone.loaded_weight += sum(med.weight for med in new_medications)
+            drone.loaded_count += len(new_medications)
+
+        # update drone state if meds are loaded, the load is charged by the battery projection
+        if drone.loaded_count > 0:
+            loaded_at = now()
+            drone.state = DroneState.LOADED
+            drone.battery_capacity = rebase_battery(drone.battery_capacity, drone.last_time_updated, loaded_at)
+            drone.last_time_updated = loaded_at
+            drone.save(update_fields=[
+                'state', 'last_time_updated', 'battery_capacity', 'loaded_weight', 'loaded_count',
+            ])
+
+        return drone
+
+
+class DroneLoadSerializer(serializers.Serializer):
+    drone_id = serializers.IntegerField()
+    medication_ids = serializers.ListField(child=serializers.IntegerField())
+
+
+class BulkLoadMedicationSerializer(serializers.Serializer):
+    loads = DroneLoadSerializer(many=True)
+
+    def validate_loads(self, loads):
+        drone_ids = [load['drone_id'] for load in loads]
+        if len(drone_ids) != len(set(drone_ids)):
+            raise serializers.ValidationError("Each drone can only appear once.")
+
+        medication_ids = [med_id for load in loads for med_id in set(load['medication_ids'])]
+        if len(medication_ids) != len(set(medication_ids)):
+            raise serializers.ValidationError("A medication can only be loaded onto one drone.")
+
+        return loads
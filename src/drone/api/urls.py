@@ -1,6 +1,7 @@
 from django.urls import path, include
 
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import DroneViewset
 
 
@@ -9,6 +10,23 @@ router = DefaultRouter()
 # router.register('register-drone', RegisterDroneViewset, basename='register-drone')
 router.register('drones', DroneViewset, basename='drones')
 
+# async versions of the read-heavy endpoints, for ASGI servers
+async_urlpatterns = [
+    path(
+        'drones/available-drones/', async_views.check_available_drones,
+        name='async-drones-check-available-drones',
+    ),
+    path(
+        'drones/<int:pk>/battery-level/', async_views.check_battery_level,
+        name='async-drones-check-battery-level',
+    ),
+    path(
+        'drones/<int:pk>/loaded-medications/', async_views.check_loaded_medications,
+        name='async-drones-check-loaded-medictions',
+    ),
+]
+
 urlpatterns = [
+    path('async/', include(async_urlpatterns)),
     path('', include(router.urls)),
 ]
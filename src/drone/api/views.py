@@ -1,48 +1,84 @@
-from decimal import Decimal
+from itertools import islice
 from rest_framework import viewsets, mixins
-from src.drone.enums import DroneState
-from src.drone.models import Drone, Medication
-from src.drone.api.serialiazers import DroneSerializer, LoadMedicationSerializer, MedicationSerializer
+from src.drone.enums import DroneModel, DroneState
+from src.drone.models import Drone
+from src.drone.api.renderers import json_renderer
+from src.drone.api.serialiazers import (
+    AvailableDronesQuerySerializer,
+    BatteryHistoryQuerySerializer,
+    BulkLoadMedicationSerializer,
+    BulkTransitionSerializer,
+    DispatchPlanSerializer,
+    DroneSerializer,
+    FastDroneSerializer,
+    FastMedicationSerializer,
+    LoadMedicationSerializer,
+    MedicationSerializer,
+)
+from src.drone import cache as drone_cache
+from src.drone.battery import projected_battery_expression
+from src.drone.dispatch import apply_dispatch, plan_dispatch
+from src.drone.history import downsampled_battery_history
+from src.drone.registration import payload_rows, register_drones
+from src.drone.transitions import TRANSITIONS, TransitionError, transition_drone, transition_drones
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.viewsets import ViewSet
 from rest_framework.decorators import action
-from django.utils.timezone import now
-from django.db.models import Q
+from django.db import transaction
 from rest_framework import status
 
+# drones fetched and projected per database round trip by available-drones
+AVAILABLE_DRONES_CHUNK_SIZE = 500
 
-def calculate_battery_depletion(drone: Drone):
+
+def available_drones(params):
     """
-    Battery drain is calculated based on two metrics; time and weight,
-    We assume that 0.005% battery depletin per 1 gram and 0.002% battery depletion per minute
+    The available drones matching validated AvailableDronesQuerySerializer params, in id order.
     """
-    total_loaded_weight = sum(med.weight for med in drone.medications.all())
-
-    battery_capacity_depletion_per_g = Decimal(0.005) # 0.005% battery depletion 1gr
-    depletion_per_minutes = Decimal(0.002)  # 0.002% battery depletion per minute
-
-    # get time between now and last update
-    btw_time_in_minutes = 0
-    if drone.last_time_updated:
-        btw_time = now() - drone.last_time_updated
-        btw_time_in_minutes =  Decimal(btw_time.total_seconds()) / Decimal(60) 
-
-    return (total_loaded_weight * battery_capacity_depletion_per_g) + (depletion_per_minutes * btw_time_in_minutes)
+    # the stored battery bounds the projected one, so it narrows the scan through the index
+    drones = (
+        Drone.objects
+        .alias(projected_battery=projected_battery_expression())
+        .filter(state=DroneState.IDLE, battery_capacity__gte=25, projected_battery__gte=25)
+        .order_by('id')
+    )
+    if 'drone_model' in params:
+        drones = drones.filter(drone_model=DroneModel(params['drone_model']))
+    if 'min_weight_limit' in params:
+        drones = drones.filter(weight_limit__gte=params['min_weight_limit'])
+    if 'cursor' in params:
+        drones = drones.filter(id__gt=params['cursor'])
+    return drones
+
+
+def ndjson_drones(rows):
+    """
+    A chunk of FastDroneSerializer rows as newline delimited JSON.
+    """
+    render = json_renderer().render
+    return b''.join(render(drone) + b'\n' for drone in FastDroneSerializer(rows).data)
 
 
 class DroneViewset(ViewSet):
     """
     A Viewset for managing drone services, consisting of the following endpoint:
     - register-drone [POST]
+    - bulk-register [POST]
     - loading [PUT]
     - loading-medications [POST]
+    - bulk-load [POST]
     - loaded-medications [GET]
     - available-drones [GET]
     - battery-level [GET]
+    - battery-history [GET]
     - delivering [PUT]
     - delivered [PUT]
     - returning [PUT]
+    - bulk-transition [POST]
+    - dispatch-plan [POST]
+    - cache-stats [GET]
     """
 
     @action(detail=False, methods=["post"], url_path="register-drone")
@@ -52,53 +88,39 @@ class DroneViewset(ViewSet):
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    @action(detail=True, methods=["put"], url_path="loading")
-    def set_drone_to_loading(self, request, pk):
-        drone = get_object_or_404(Drone, pk=pk)
-
-        if drone.state != DroneState.IDLE:
-            return Response({'error': f'Drone unable to be set to loading, needs to be set to Idle state.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        if drone.battery_capacity < 25:
-            return Response({'error': 'Can not load medication, battery capacity is low.'}, status=status.HTTP_400_BAD_REQUEST)
+    @action(detail=False, methods=["post"], url_path="bulk-register")
+    def bulk_register_drones(self, request):
+        """
+        Register the drones of a JSON array, NDJSON or CSV body (or multipart `file`
+        upload), each row succeeds or fails on its own.
+        """
+        return Response(register_drones(payload_rows(request)))
 
-        drone.state = DroneState.LOADING
-        drone.save()
+    def _transition_response(self, pk, target):
+        try:
+            drone = transition_drone(pk, target)
+        except TransitionError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({
-            'message': 'Drone is loading',
+            'message': TRANSITIONS[target].message,
             'drone': {
-                'id': drone.id,
-                'state': drone.state.value,
+                'id': drone['id'],
+                'state': drone['state'].value,
             },
         })
 
+    @action(detail=True, methods=["put"], url_path="loading")
+    def set_drone_to_loading(self, request, pk):
+        return self._transition_response(pk, DroneState.LOADING)
+
     @action(detail=True, methods=["post"], url_path="load-medications")
     def load_medications(self, request, pk):
-        drone = get_object_or_404(Drone, pk=pk)
-        med_data = request.data
-        serializer = LoadMedicationSerializer(data=med_data, context={'drone': drone})
-        serializer.is_valid(raise_exception=True)
-
-        medication_ids = med_data.get("medication_ids", [])
-
-        # we set drone state to Loading when meds are in process to be loaded
-        if medication_ids:
-            drone.state = DroneState.LOADING
-            drone.save()
-
-        for med_id in medication_ids:
-            medication = get_object_or_404(Medication, pk=med_id)
-            medication.drone = drone
-            medication.save()
-
-        # update drone state if meds are loaded
-        loaded_medications = drone.medications.all()
-        if loaded_medications.count() > 0:
-            drone.state = DroneState.LOADED
-            drone.last_time_updated = now()
-            drone.battery_capacity -= calculate_battery_depletion(drone)
-            drone.save()
+        with transaction.atomic():
+            drone = get_object_or_404(Drone.objects.select_for_update(), pk=pk)
+            serializer = LoadMedicationSerializer(data=request.data, context={'drone': drone})
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
 
         return Response(
             {
@@ -108,34 +130,99 @@ class DroneViewset(ViewSet):
                     "battery_capacity": drone.battery_capacity,
                     "state": drone.state.value,
                 },
-                "medications": MedicationSerializer(loaded_medications, many=True).data,
+                "medications": MedicationSerializer(drone.medications.all(), many=True).data,
             },
         )
 
+    @action(detail=False, methods=["post"], url_path="bulk-load")
+    def bulk_load_medications(self, request):
+        """
+        Load medications onto several drones in one call, each drone's load
+        succeeds or fails on its own.
+        """
+        serializer = BulkLoadMedicationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        loads = serializer.validated_data['loads']
+
+        results = []
+        with transaction.atomic():
+            drones = Drone.objects.select_for_update().in_bulk([load['drone_id'] for load in loads])
+            for load in loads:
+                drone = drones.get(load['drone_id'])
+                if drone is None:
+                    results.append({'drone_id': load['drone_id'], 'loaded': False, 'errors': {'drone_id': ['Drone not found.']}})
+                    continue
+
+                load_serializer = LoadMedicationSerializer(data=load, context={'drone': drone})
+                if not load_serializer.is_valid():
+                    results.append({'drone_id': drone.id, 'loaded': False, 'errors': load_serializer.errors})
+                    continue
+
+                load_serializer.save()
+                results.append({
+                    'drone_id': drone.id,
+                    'loaded': True,
+                    'state': drone.state.value,
+                    'battery_capacity': drone.battery_capacity,
+                    'medication_ids': sorted(set(load['medication_ids'])),
+                })
+
+        return Response({'results': results})
+
     @action(detail=True, methods=["get"], url_path="loaded-medications")
     def check_loaded_medictions(self, request, pk):
-        drone = get_object_or_404(Drone, pk=pk)
+        drone = drone_cache.get_drone(pk)
 
         return Response({
             'drone': {
                 'id': drone.id,
                 'serial_number': drone.serial_number,
             },
-            'loaded_medications': MedicationSerializer(drone.medications.all(), many=True).data
+            'loaded_medications': drone_cache.get_loaded_medications(
+                drone.id, lambda: FastMedicationSerializer(drone.medications.all()).data,
+            ),
         })
 
+    def _stream_available_drones(self, drones):
+        rows = drones.values_list(*FastDroneSerializer.fields).iterator(chunk_size=AVAILABLE_DRONES_CHUNK_SIZE)
+        while True:
+            chunk = list(islice(rows, AVAILABLE_DRONES_CHUNK_SIZE))
+            if not chunk:
+                return
+            yield ndjson_drones(chunk)
+
     @action(detail=False, methods=["get"], url_path="available-drones")
     def check_available_drones(self, request):
-        drones = Drone.objects.filter(state=DroneState.IDLE, battery_capacity__gte=25)
-
-        return Response ({
-            'available_drones': DroneSerializer(drones, many=True).data,
+        """
+        Optional query parameters:
+        - drone_model, min_weight_limit: only return matching drones
+        - limit, cursor: return at most `limit` drones after the drone id `cursor`,
+          the response's `next_cursor` gives the cursor of the next page
+        - stream: return every available drone as newline delimited JSON, can not be combined with limit
+        """
+        params = AvailableDronesQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        params = params.validated_data
+        drones = available_drones(params)
+
+        if params['stream']:
+            return StreamingHttpResponse(self._stream_available_drones(drones), content_type='application/x-ndjson')
+
+        if 'limit' not in params:
+            return Response ({
+                'available_drones': FastDroneSerializer(drones).data,
+            })
+
+        page = list(drones.values_list(*FastDroneSerializer.fields)[:params['limit']])
+        return Response({
+            'available_drones': FastDroneSerializer(page).data,
+            'next_cursor': page[-1][0] if len(page) == params['limit'] else None,
         })
 
     @action(detail=True, methods=["get"], url_path="battery-level")
     def check_battery_level(self, request, pk):
-        drone = get_object_or_404(Drone, pk=pk)
-        battery_capacity = drone.battery_capacity - calculate_battery_depletion(drone)
+        drone = drone_cache.get_drone(pk)
+        battery_capacity = drone.projected_battery()
 
         return Response({
             'drone': {
@@ -145,57 +232,100 @@ class DroneViewset(ViewSet):
             },
         })
 
-    @action(detail=True, methods=["put"], url_path="delivering")
-    def set_drone_as_delivering(self, request, pk):
-        drone = get_object_or_404(Drone, pk=pk)
-
-        if drone.state != DroneState.LOADED:
-            return Response({'error': 'Drone needs to be loaded before starting deliveries'}, status=status.HTTP_400_BAD_REQUEST)
-
-        drone.state = DroneState.DELIVERING
-        drone.save()
+    def _battery_history_response(self, request, drone_ids=None, extra=None):
+        params = BatteryHistoryQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        params = params.validated_data
 
+        if drone_ids is None:
+            drone_ids = params.get('drone_ids')
         return Response({
-            'message': 'Drone set to delivering',
+            **(extra or {}),
+            'start': params['start'],
+            'end': params['end'],
+            'points': downsampled_battery_history(drone_ids, params['start'], params['end'], params['points']),
+        })
+
+    @action(detail=True, methods=["get"], url_path="battery-history")
+    def drone_battery_history(self, request, pk):
+        """
+        Battery level of a drone between `start` and `end`, downsampled to at most `points` buckets.
+        """
+        drone = get_object_or_404(Drone.objects.only('id', 'serial_number'), pk=pk)
+        return self._battery_history_response(request, [drone.id], {
             'drone': {
                 'id': drone.id,
-                'state': drone.state.value,
+                'serial_number': drone.serial_number,
             },
         })
 
+    @action(detail=False, methods=["get"], url_path="battery-history")
+    def fleet_battery_history(self, request):
+        """
+        Battery level of the fleet, or of the comma separated `drone_ids`, between
+        `start` and `end`, downsampled to at most `points` buckets.
+        """
+        return self._battery_history_response(request)
+
+    @action(detail=True, methods=["put"], url_path="delivering")
+    def set_drone_as_delivering(self, request, pk):
+        return self._transition_response(pk, DroneState.DELIVERING)
+
     @action(detail=True, methods=["put"], url_path="delivered")
     def set_drone_as_delivered(self, request, pk):
-        drone = get_object_or_404(Drone, pk=pk)
+        return self._transition_response(pk, DroneState.DELIVERED)
 
-        if drone.state != DroneState.DELIVERING:
-            return Response({'error': 'Drone is not delivering any medications'}, status=status.HTTP_400_BAD_REQUEST)
+    @action(detail=True, methods=["put"], url_path="returning")
+    def set_drone_as_returning(self, request, pk):
+        return self._transition_response(pk, DroneState.RETURNING)
+
+    @action(detail=False, methods=["post"], url_path="bulk-transition")
+    def bulk_transition(self, request):
+        """
+        Move a list of drones to a state in one call, reporting per drone whether it moved.
+        """
+        serializer = BulkTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        target = serializer.validated_data['state']
 
-        drone.state = DroneState.DELIVERED
-        drone.medications.update(drone=None)
-        drone.save()
+        results = transition_drones(serializer.validated_data['drone_ids'], target)
 
         return Response({
-            'message': 'Drone delivered medication',
-            'drone': {
-                'id': drone.id,
-                'state': drone.state.value,
-            },
+            'state': target.value,
+            'results': [
+                {'drone_id': drone_id, 'success': error is None, **({'error': error} if error else {})}
+                for drone_id, error in sorted(results.items())
+            ],
         })
 
-    @action(detail=True, methods=["put"], url_path="returning")
-    def set_drone_as_returning(self, request, pk):
-        drone = get_object_or_404(Drone, pk=pk)
-
-        if drone.state != DroneState.DELIVERED:
-            return Response({'error': 'Drone has not delivered any medications yet'}, status=status.HTTP_400_BAD_REQUEST)
+    @action(detail=False, methods=["post"], url_path="dispatch-plan")
+    def dispatch_plan(self, request):
+        """
+        Pack the unassigned medications onto the available drones, a dry run unless `apply` is set.
+        """
+        serializer = DispatchPlanSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
 
-        drone.state = DroneState.RETURNING
-        drone.save()
+        dispatch = apply_dispatch if data['apply'] else plan_dispatch
+        plan = dispatch(data.get('medication_ids'), data.get('drone_ids'))
 
         return Response({
-            'message': 'Drone set to returning',
-            'drone': {
-                'id': drone.id,
-                'state': drone.state.value,
-            },
+            'applied': data['apply'],
+            'drones_used': len(plan.assignments),
+            'projected_drain': plan.projected_drain,
+            'assignments': [
+                {
+                    'drone_id': assignment.drone_id,
+                    'medication_ids': assignment.medication_ids,
+                    'load_weight': assignment.load_weight,
+                    'projected_battery': assignment.projected_battery,
+                }
+                for assignment in plan.assignments
+            ],
+            'unassigned_medication_ids': plan.unassigned_medication_ids,
         })
+
+    @action(detail=False, methods=["get"], url_path="cache-stats")
+    def cache_stats(self, request):
+        return Response(drone_cache.cache_stats())
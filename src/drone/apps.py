@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DroneConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'src.drone'
+
+    def ready(self):
+        # connects the query instrumentation, the Celery task hooks and the image processing
+        from src.drone import profiling, tasks  # noqa: F401
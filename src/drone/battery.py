@@ -0,0 +1,118 @@
+"""
+Battery model of the drones.
+
+A drone's battery is stored as a baseline, `battery_capacity` at
+`last_time_updated`, plus its current load, `loaded_weight`. The level at any
+later time is projected in closed form, in Python with `project_battery` and in
+the database with `projected_battery_expression`:
+
+    baseline - loaded_weight * 0.005 - minutes since last_time_updated * 0.002
+
+floored at zero. Nothing is decremented as time passes. Only unloading writes
+the baseline, to keep the charge of the weight that was carried.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import NotSupportedError
+from django.db.models import DateTimeField, DecimalField, F, Func, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, Round
+from django.utils.timezone import now
+
+BATTERY_DEPLETION_PER_G = Decimal('0.005')  # 0.005% battery depletion 1gr
+BATTERY_DEPLETION_PER_MINUTE = Decimal('0.002')  # 0.002% battery depletion per minute
+BATTERY_PRECISION = Decimal('0.1')
+
+
+def battery_depletion(total_loaded_weight, last_time_updated, at=None):
+    """
+    Battery depletion for a drone carrying `total_loaded_weight` grams
+    and last updated at `last_time_updated`.
+    """
+    # get time between now and last update
+    btw_time_in_minutes = 0
+    if last_time_updated:
+        btw_time = (at or now()) - last_time_updated
+        btw_time_in_minutes = Decimal(btw_time.total_seconds()) / Decimal(60)
+
+    return (total_loaded_weight * BATTERY_DEPLETION_PER_G) + (BATTERY_DEPLETION_PER_MINUTE * btw_time_in_minutes)
+
+
+def project_battery(battery_capacity, loaded_weight, last_time_updated, at=None):
+    """
+    Battery level at `at` (default now) of a drone with the given baseline and load,
+    rounded half up like the database's ROUND.
+    """
+    remaining = battery_capacity - battery_depletion(loaded_weight, last_time_updated, at)
+    return max(remaining, Decimal(0)).quantize(BATTERY_PRECISION, rounding=ROUND_HALF_UP)
+
+
+def rebase_battery(battery_capacity, last_time_updated, at):
+    """
+    The baseline to store with `last_time_updated=at`: the depletion over time up to `at` folded in.
+    """
+    return project_battery(battery_capacity, 0, last_time_updated, at)
+
+
+def unloaded_battery(battery_capacity, unloaded_weight):
+    """
+    The baseline once `unloaded_weight` grams are taken off, keeping the charge of carrying them.
+    """
+    return max(battery_capacity - unloaded_weight * BATTERY_DEPLETION_PER_G, Decimal(0))
+
+
+def unloaded_battery_expression(unloaded_weight):
+    """
+    `unloaded_battery` as a database expression, `unloaded_weight` can be a number or an expression.
+    """
+    return Greatest(
+        F('battery_capacity') - unloaded_weight * Value(BATTERY_DEPLETION_PER_G),
+        Value(Decimal(0)),
+    )
+
+
+class SecondsSince(Func):
+    """
+    Seconds from a datetime column to `at`, NULL when the column is.
+    """
+    output_field = DecimalField()
+
+    def __init__(self, expression, at, **extra):
+        super().__init__(expression, Value(at, output_field=DateTimeField()), **extra)
+
+    def _compile(self, compiler):
+        (column, column_params), (at, at_params) = (
+            compiler.compile(expression) for expression in self.get_source_expressions()
+        )
+        return column, column_params, at, at_params
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(f'SecondsSince is not implemented for {connection.vendor}.')
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        column, column_params, at, at_params = self._compile(compiler)
+        return f'((julianday({at}) - julianday({column})) * 86400)', (*at_params, *column_params)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        column, column_params, at, at_params = self._compile(compiler)
+        return f'EXTRACT(EPOCH FROM ({at} - {column}))', (*at_params, *column_params)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        column, column_params, at, at_params = self._compile(compiler)
+        return f'(TIMESTAMPDIFF(MICROSECOND, {column}, {at}) / 1000000)', (*column_params, *at_params)
+
+
+def projected_battery_expression(at=None):
+    """
+    `project_battery` as a database expression over the drone's columns, for annotate() and filter().
+    """
+    seconds = Coalesce(SecondsSince('last_time_updated', at or now()), Value(Decimal(0)))
+    remaining = (
+        F('battery_capacity')
+        - F('loaded_weight') * Value(BATTERY_DEPLETION_PER_G)
+        - seconds * Value(BATTERY_DEPLETION_PER_MINUTE / 60)
+    )
+    return Round(
+        Cast(Greatest(remaining, Value(Decimal(0))), DecimalField(max_digits=20, decimal_places=1)),
+        1,
+        output_field=DecimalField(max_digits=20, decimal_places=1),
+    )
@@ -0,0 +1,326 @@
+"""
+Query count, latency and memory benchmarks for the drone API and the battery sweep.
+
+Scenarios run against whatever database is active, seeded with a synthetic fleet,
+so they are meant to be run inside a throwaway test database (see the
+`benchmark_drone_api` management command and `src.drone.tests`).
+"""
+import json
+import time
+from itertools import cycle, islice
+import tracemalloc
+from pathlib import Path
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from src.drone import cache as drone_cache
+from src.drone.api.serialiazers import DroneSerializer, FastDroneSerializer
+from src.drone.enums import DroneState
+from src.drone.models import Drone, Medication
+from src.drone.sweep import sweep_drone_battery_levels
+
+BASELINES_PATH = Path(__file__).resolve().parent / 'benchmark_baselines.json'
+DEFAULT_FLEET_SIZES = (10, 1000, 100000)
+SEED_BATCH_SIZE = 5000
+# drones registered per run of the bulk-register scenario
+BULK_REGISTER_ROWS = 1000
+# drones per run of the serializer scenarios, the fleet is repeated up to it on small sizes
+SERIALIZATION_BATCH = 10000
+
+# transaction control statements are not counted as queries, so the counts are
+# the same inside a test case (savepoints) and against a real database
+TRANSACTION_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', 'BEGIN', 'COMMIT', 'ROLLBACK')
+
+
+def seed_fleet(size):
+    """
+    Create `size` idle drones and `size` unassigned medications.
+    """
+    # bulk_create skips the models' cache invalidation
+    drone_cache.clear()
+    Drone.objects.bulk_create(
+        (
+            Drone(serial_number=f'BENCH{i:07d}', weight_limit=500, battery_capacity=100)
+            for i in range(size)
+        ),
+        batch_size=SEED_BATCH_SIZE,
+    )
+    Medication.objects.bulk_create(
+        (
+            Medication(name=f'BenchMed{i}', weight=10, code=f'BENCH_{i:07d}')
+            for i in range(size)
+        ),
+        batch_size=SEED_BATCH_SIZE,
+    )
+
+
+class BenchmarkContext:
+    """
+    Shared state for the scenarios: an API client and the seeded drone and medication ids.
+    """
+
+    def __init__(self):
+        self.client = APIClient()
+        self.drone_ids = list(Drone.objects.order_by('id').values_list('id', flat=True)[:10])
+        self.medication_ids = list(Medication.objects.order_by('id').values_list('id', flat=True)[:10])
+        self.registered = 0
+
+    def set_drone(self, drone_id, state, medication_ids=()):
+        """
+        Put a drone in the given state with exactly the given medications attached.
+        """
+        Medication.objects.filter(drone_id=drone_id).update(drone=None)
+        Medication.objects.filter(id__in=medication_ids).update(drone=drone_id)
+        Drone.objects.filter(pk=drone_id).update(
+            state=state,
+            battery_capacity=100,
+            loaded_weight=10 * len(medication_ids),
+            loaded_count=len(medication_ids),
+        )
+        drone_cache.invalidate_drone(drone_id)
+
+
+def _register_drone(ctx):
+    ctx.registered += 1
+    data = {'serial_number': f'BENCH_NEW_{ctx.registered}', 'weight_limit': 250, 'battery_capacity': 80}
+    return lambda: ctx.client.post(reverse('drones-register-drone'), data, format='json')
+
+
+def _bulk_register(ctx):
+    ctx.registered += 1
+    body = '\n'.join(
+        json.dumps({'serial_number': f'BENCH_BULK_{ctx.registered}_{i}', 'weight_limit': 250, 'battery_capacity': 80})
+        for i in range(BULK_REGISTER_ROWS)
+    )
+    return lambda: ctx.client.post(reverse('drones-bulk-register-drones'), body, content_type='application/x-ndjson')
+
+
+def _loading(ctx):
+    drone_id = ctx.drone_ids[0]
+    ctx.set_drone(drone_id, DroneState.IDLE)
+    return lambda: ctx.client.put(reverse('drones-set-drone-to-loading', kwargs={'pk': drone_id}))
+
+
+def _load_medications(ctx):
+    drone_id = ctx.drone_ids[0]
+    ctx.set_drone(drone_id, DroneState.LOADING)
+    data = {'medication_ids': ctx.medication_ids[:5]}
+    return lambda: ctx.client.post(reverse('drones-load-medications', kwargs={'pk': drone_id}), data, format='json')
+
+
+def _bulk_load(ctx):
+    loads = []
+    for i, drone_id in enumerate(ctx.drone_ids[:5]):
+        medication_ids = ctx.medication_ids[2 * i:2 * i + 2]
+        ctx.set_drone(drone_id, DroneState.LOADING)
+        loads.append({'drone_id': drone_id, 'medication_ids': medication_ids})
+    return lambda: ctx.client.post(reverse('drones-bulk-load-medications'), {'loads': loads}, format='json')
+
+
+def _loaded_medications(ctx):
+    drone_id = ctx.drone_ids[0]
+    ctx.set_drone(drone_id, DroneState.LOADED, ctx.medication_ids[:5])
+    return lambda: ctx.client.get(reverse('drones-check-loaded-medictions', kwargs={'pk': drone_id}))
+
+
+def _available_drones(ctx):
+    return lambda: ctx.client.get(reverse('drones-check-available-drones'))
+
+
+def _battery_level(ctx):
+    drone_id = ctx.drone_ids[0]
+    ctx.set_drone(drone_id, DroneState.LOADED, ctx.medication_ids[:5])
+    return lambda: ctx.client.get(reverse('drones-check-battery-level', kwargs={'pk': drone_id}))
+
+
+def _delivering(ctx):
+    drone_id = ctx.drone_ids[0]
+    ctx.set_drone(drone_id, DroneState.LOADED, ctx.medication_ids[:5])
+    return lambda: ctx.client.put(reverse('drones-set-drone-as-delivering', kwargs={'pk': drone_id}))
+
+
+def _delivered(ctx):
+    drone_id = ctx.drone_ids[0]
+    ctx.set_drone(drone_id, DroneState.DELIVERING, ctx.medication_ids[:5])
+    return lambda: ctx.client.put(reverse('drones-set-drone-as-delivered', kwargs={'pk': drone_id}))
+
+
+def _returning(ctx):
+    drone_id = ctx.drone_ids[0]
+    ctx.set_drone(drone_id, DroneState.DELIVERED)
+    return lambda: ctx.client.put(reverse('drones-set-drone-as-returning', kwargs={'pk': drone_id}))
+
+
+def _bulk_transition(ctx):
+    for drone_id in ctx.drone_ids:
+        ctx.set_drone(drone_id, DroneState.IDLE)
+    data = {'drone_ids': ctx.drone_ids, 'state': DroneState.LOADING.value}
+    return lambda: ctx.client.post(reverse('drones-bulk-transition'), data, format='json')
+
+
+def _dispatch_plan(ctx):
+    # a dry run over the whole backlog and every available drone
+    return lambda: ctx.client.post(reverse('drones-dispatch-plan'), {}, format='json')
+
+
+def _serialization_batch(rows):
+    return list(islice(cycle(rows), SERIALIZATION_BATCH))
+
+
+def _drone_serializer(ctx):
+    drones = _serialization_batch(Drone.objects.order_by('id')[:SERIALIZATION_BATCH])
+    return lambda: DroneSerializer(drones, many=True).data
+
+
+def _fast_drone_serializer(ctx):
+    rows = _serialization_batch(
+        Drone.objects.order_by('id').values_list(*FastDroneSerializer.fields)[:SERIALIZATION_BATCH]
+    )
+    return lambda: FastDroneSerializer(rows).data
+
+
+def _battery_sweep(ctx):
+    # every shard in this process, no broker or workers needed
+    return lambda: sweep_drone_battery_levels()
+
+
+def _battery_history(ctx):
+    drone_id = ctx.drone_ids[0]
+    return lambda: ctx.client.get(reverse('drones-drone-battery-history', kwargs={'pk': drone_id}))
+
+
+def _fleet_battery_history(ctx):
+    return lambda: ctx.client.get(reverse('drones-fleet-battery-history'))
+
+
+def _cache_stats(ctx):
+    return lambda: ctx.client.get(reverse('drones-cache-stats'))
+
+
+SCENARIOS = {
+    'register-drone': _register_drone,
+    'loading': _loading,
+    'load-medications': _load_medications,
+    'bulk-load': _bulk_load,
+    'loaded-medications': _loaded_medications,
+    'available-drones': _available_drones,
+    'battery-level': _battery_level,
+    'delivering': _delivering,
+    'delivered': _delivered,
+    'returning': _returning,
+    'bulk-transition': _bulk_transition,
+    'dispatch-plan': _dispatch_plan,
+    'log_drone_battery_levels': _battery_sweep,
+    # the last day of the log written by the sweeps above
+    'battery-history': _battery_history,
+    'fleet-battery-history': _fleet_battery_history,
+    'cache-stats': _cache_stats,
+    # serialization only, 10k drones fetched beforehand
+    'serialize-drones': _drone_serializer,
+    'serialize-drones-fast': _fast_drone_serializer,
+    # last, the drones it registers would grow the fleet of the scenarios after it
+    'bulk-register': _bulk_register,
+}
+
+
+def _percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1, round(percent / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def _counted_queries(captured):
+    return sum(
+        1 for query in captured.captured_queries
+        if not query['sql'].upper().startswith(TRANSACTION_STATEMENTS)
+    )
+
+
+def run_scenario(ctx, name, repeat=10):
+    """
+    Run a scenario `repeat` times and return its query count, latency
+    percentiles (ms) and peak Python memory (KiB).
+    """
+    setup = SCENARIOS[name]
+    timings = []
+    queries = 0
+
+    for _ in range(repeat):
+        run = setup(ctx)
+        # the log only keeps the last 9000 queries, once full it would hide the scenario's
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = run()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        status_code = getattr(response, 'status_code', 200)
+        if status_code >= 400:
+            raise AssertionError(f'Scenario {name} failed with status {status_code}: {response.data}')
+        queries = max(queries, _counted_queries(captured))
+
+    # memory is traced on a separate run, tracing slows down the timed ones
+    run = setup(ctx)
+    tracemalloc.start()
+    run()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'queries': queries,
+        'p50_ms': round(_percentile(timings, 50), 3),
+        'p95_ms': round(_percentile(timings, 95), 3),
+        'p99_ms': round(_percentile(timings, 99), 3),
+        'peak_memory_kb': round(peak_memory / 1024, 1),
+    }
+
+
+def run_benchmarks(size, repeat=10, scenarios=None):
+    """
+    Seed a fleet of `size` drones and run every scenario against it.
+    """
+    seed_fleet(size)
+    ctx = BenchmarkContext()
+    results = {name: run_scenario(ctx, name, repeat) for name in (scenarios or SCENARIOS)}
+
+    # leave the database as we found it for the next fleet size
+    Medication.objects.all().delete()
+    Drone.objects.all().delete()
+    return results
+
+
+def load_baselines(path=BASELINES_PATH):
+    if not Path(path).exists():
+        return {}
+    with open(path) as baselines_file:
+        return json.load(baselines_file)
+
+
+def save_baselines(baselines, path=BASELINES_PATH):
+    with open(path, 'w') as baselines_file:
+        json.dump(baselines, baselines_file, indent=2, sort_keys=True)
+        baselines_file.write('\n')
+
+
+def find_regressions(results, baseline, tolerance=2.0):
+    """
+    Compare one fleet size's results with its baseline.
+
+    Query counts must not grow at all, latency and memory may grow up to `tolerance` times.
+    A scenario without a baseline is a regression too, it has to be recorded with --update-baselines.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            regressions.append(f'{name}: no baseline')
+            continue
+        if result['queries'] > expected['queries']:
+            regressions.append(f"{name}: {result['queries']} queries, baseline {expected['queries']}")
+        for metric in ('p95_ms', 'peak_memory_kb'):
+            if result[metric] > expected[metric] * tolerance:
+                regressions.append(f'{name}: {metric} {result[metric]}, baseline {expected[metric]}')
+    return regressions
@@ -0,0 +1,132 @@
+"""
+Read-through cache of drones and their loaded medications for the polled read endpoints.
+
+Entries live in the `drones` cache alias, an in-process LRU by default or the
+Celery broker's Redis (see DRONE_CACHE_BACKEND). They are invalidated whenever
+a drone is saved or medications are attached to or detached from it.
+"""
+import threading
+from collections import Counter
+
+from django.core.cache import caches
+from django.db import transaction
+from django.http import Http404
+
+CACHE_ALIAS = 'drones'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _drone_key(drone_id):
+    return f'drone:{drone_id}'
+
+
+def _medications_key(drone_id):
+    return f'drone:{drone_id}:medications'
+
+
+def _count(name, key):
+    with _stats_lock:
+        _stats[f'{key}_{name}'] += 1
+
+
+def _get_or_set(kind, key, load):
+    value = _cache().get(key)
+    if value is not None:
+        _count('hits', kind)
+        return value
+    _count('misses', kind)
+    value = load()
+    if value is not None:
+        _cache().set(key, value)
+    return value
+
+
+async def _aget_or_set(kind, key, load):
+    value = await _cache().aget(key)
+    if value is not None:
+        _count('hits', kind)
+        return value
+    _count('misses', kind)
+    value = await load()
+    if value is not None:
+        await _cache().aset(key, value)
+    return value
+
+
+def get_drone(drone_id):
+    """
+    The drone with this id, from the cache when possible. Raises Http404 like get_object_or_404.
+    """
+    from src.drone.models import Drone
+
+    drone = _get_or_set('drone', _drone_key(drone_id), lambda: Drone.objects.filter(pk=drone_id).first())
+    if drone is None:
+        raise Http404('No Drone matches the given query.')
+    return drone
+
+
+def get_loaded_medications(drone_id, load):
+    """
+    The cached representation of the drone's loaded medications, built by `load()` on a miss.
+    """
+    return _get_or_set('medications', _medications_key(drone_id), load)
+
+
+async def aget_drone(drone_id):
+    """
+    Async get_drone, for the async views.
+    """
+    from src.drone.models import Drone
+
+    drone = await _aget_or_set('drone', _drone_key(drone_id), Drone.objects.filter(pk=drone_id).afirst)
+    if drone is None:
+        raise Http404('No Drone matches the given query.')
+    return drone
+
+
+async def aget_loaded_medications(drone_id, load):
+    """
+    Async get_loaded_medications, `load` is a coroutine function.
+    """
+    return await _aget_or_set('medications', _medications_key(drone_id), load)
+
+
+def invalidate_drones(drone_ids):
+    """
+    Drop the cached entries of the drones, now and again once the current transaction commits
+    so a concurrent read can not cache rows that are about to change.
+    """
+    keys = [key for drone_id in drone_ids if drone_id for key in (_drone_key(drone_id), _medications_key(drone_id))]
+    if not keys:
+        return
+    _cache().delete_many(keys)
+    transaction.on_commit(lambda: _cache().delete_many(keys))
+
+
+def invalidate_drone(drone_id):
+    invalidate_drones([drone_id])
+
+
+def clear():
+    """
+    Drop every cached drone and reset the hit/miss counters.
+    """
+    _cache().clear()
+    with _stats_lock:
+        _stats.clear()
+
+
+def cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    return {
+        'backend': _cache().__class__.__name__,
+        **{f'{kind}_{name}': stats.get(f'{kind}_{name}', 0)
+           for kind in ('drone', 'medications') for name in ('hits', 'misses')},
+    }
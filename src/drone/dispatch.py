@@ -0,0 +1,189 @@
+"""
+Dispatch planner: packs the backlog of unassigned medications onto available drones.
+
+Medications are placed heaviest first (best-fit decreasing). Open drones are
+kept in a list sorted by remaining capacity, so each medication goes to the
+tightest drone it fits with a binary search, and a new drone is only opened
+when none fits. Drones are opened largest capacity first, then highest
+projected battery first, which keeps the number of drones used low. Battery
+drain grows linearly with the loaded weight, so the total drain of a set of
+placed medications does not depend on how they are split; opening the fully
+charged drones first keeps the per-drone projected levels highest. Loaded
+drones are rebased like the load-medications endpoint does, the load itself is
+charged by the battery projection (see `src.drone.battery`).
+
+Applying a plan moves the drones from IDLE straight to LOADED in one bulk
+update, without stopping in LOADING. Only drones that meet the IDLE to LOADING
+transition (see `src.drone.transitions.TRANSITIONS`) are planned, and they are
+locked until they are loaded, so the skipped state is never observable.
+"""
+from bisect import bisect_left, insort
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils.timezone import now
+
+from src.drone import cache as drone_cache
+from src.drone.battery import project_battery, projected_battery_expression, rebase_battery
+from src.drone.enums import DroneState
+from src.drone.models import Drone, Medication
+from src.drone.transitions import TRANSITIONS
+
+# weights have one decimal place, packing works on integer tenths of a gram
+_SCALE = 10
+
+
+@dataclass
+class DroneAssignment:
+    drone_id: int
+    battery_capacity: Decimal
+    loaded_weight: Decimal
+    loaded_count: int
+    last_time_updated: datetime
+    medication_ids: list = field(default_factory=list)
+    load_weight: Decimal = Decimal(0)
+
+    @property
+    def projected_battery(self):
+        """
+        Battery left once the drone is loaded.
+        """
+        return project_battery(self.battery_capacity, self.loaded_weight + self.load_weight, self.last_time_updated)
+
+
+@dataclass
+class DispatchPlan:
+    assignments: list
+    unassigned_medication_ids: list
+
+    @property
+    def projected_drain(self):
+        """
+        Battery charge the planned loads take, summed over the drones.
+        """
+        return sum(
+            (
+                project_battery(assignment.battery_capacity, assignment.loaded_weight, assignment.last_time_updated)
+                - assignment.projected_battery
+                for assignment in self.assignments
+            ),
+            Decimal(0),
+        )
+
+
+def _available_drones(drone_ids=None, lock=False):
+    loading = TRANSITIONS[DroneState.LOADING]
+    # the stored battery bounds the projected one, so it narrows the scan through the index
+    drones = (
+        Drone.objects
+        .annotate(projected_battery=projected_battery_expression())
+        .filter(loading.condition, state=loading.source, battery_capacity__gte=25)
+    )
+    if drone_ids is not None:
+        drones = drones.filter(pk__in=drone_ids)
+    if lock:
+        drones = drones.select_for_update()
+    return list(drones.values_list(
+        'id', 'weight_limit', 'battery_capacity', 'loaded_weight', 'loaded_count', 'last_time_updated',
+        'projected_battery',
+    ))
+
+
+def _backlog(medication_ids=None, lock=False):
+    medications = Medication.objects.filter(drone__isnull=True)
+    if medication_ids is not None:
+        medications = medications.filter(pk__in=medication_ids)
+    if lock:
+        medications = medications.select_for_update()
+    return list(medications.values_list('id', 'weight'))
+
+
+def pack(medications, drones):
+    """
+    Assign `medications`, (id, weight) pairs, to `drones`, (id, weight_limit, battery_capacity,
+    loaded_weight, loaded_count, last_time_updated, projected_battery) tuples.
+    """
+    # heaviest first, id breaks ties so plans are reproducible
+    items = sorted(medications, key=lambda med: (-med[1], med[0]))
+    # largest free capacity first, then the fullest battery
+    candidates = sorted(drones, key=lambda drone: (-(drone[1] - drone[3]), -drone[6], drone[0]))
+
+    assignments = []
+    # (remaining capacity in tenths, assignment index), sorted by remaining capacity
+    open_drones = []
+    next_candidate = 0
+    unassigned = []
+
+    for medication_id, weight in items:
+        needed = int(weight * _SCALE)
+        position = bisect_left(open_drones, (needed, -1))
+        if position < len(open_drones):
+            remaining, index = open_drones.pop(position)
+        elif next_candidate < len(candidates) and int(
+            (candidates[next_candidate][1] - candidates[next_candidate][3]) * _SCALE
+        ) >= needed:
+            drone_id, weight_limit, battery_capacity, loaded_weight, loaded_count, last_time_updated, _ = (
+                candidates[next_candidate]
+            )
+            next_candidate += 1
+            index = len(assignments)
+            assignments.append(
+                DroneAssignment(drone_id, battery_capacity, loaded_weight, loaded_count, last_time_updated)
+            )
+            remaining = int((weight_limit - loaded_weight) * _SCALE)
+        else:
+            # heavier than the free capacity of every drone left
+            unassigned.append(medication_id)
+            continue
+
+        assignment = assignments[index]
+        assignment.medication_ids.append(medication_id)
+        assignment.load_weight += weight
+        insort(open_drones, (remaining - needed, index))
+
+    return DispatchPlan(assignments, sorted(unassigned))
+
+
+def plan_dispatch(medication_ids=None, drone_ids=None):
+    """
+    Dry run: the plan for the backlog (or the given medications) over the available drones.
+    """
+    return pack(_backlog(medication_ids), _available_drones(drone_ids))
+
+
+def apply_dispatch(medication_ids=None, drone_ids=None):
+    """
+    Plan under row locks and load every planned drone, leaving them LOADED
+    without passing through LOADING (see the module docstring).
+    """
+    with transaction.atomic():
+        plan = pack(_backlog(medication_ids, lock=True), _available_drones(drone_ids, lock=True))
+        loaded_at = now()
+
+        medications = [
+            Medication(id=medication_id, drone_id=assignment.drone_id)
+            for assignment in plan.assignments
+            for medication_id in assignment.medication_ids
+        ]
+        drones = [
+            Drone(
+                id=assignment.drone_id,
+                state=DroneState.LOADED,
+                last_time_updated=loaded_at,
+                battery_capacity=rebase_battery(assignment.battery_capacity, assignment.last_time_updated, loaded_at),
+                loaded_weight=assignment.loaded_weight + assignment.load_weight,
+                loaded_count=assignment.loaded_count + len(assignment.medication_ids),
+            )
+            for assignment in plan.assignments
+        ]
+        Medication.objects.bulk_update(medications, ['drone'], batch_size=1000)
+        Drone.objects.bulk_update(
+            drones,
+            ['state', 'last_time_updated', 'battery_capacity', 'loaded_weight', 'loaded_count'],
+            batch_size=1000,
+        )
+
+    drone_cache.invalidate_drones([assignment.drone_id for assignment in plan.assignments])
+    return plan
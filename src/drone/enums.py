@@ -15,3 +15,8 @@ class DroneModel(Enum):
     MIDDLEWEIGHT = 'Middleweight'
     CRUISERWEIGHT = 'Cruiserweight'
     HEAVYWEIGHT = 'Heavyweight'
+
+
+class BatteryRollupPeriod(Enum):
+    HOUR = 'Hour'
+    DAY = 'Day'
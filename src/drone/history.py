@@ -0,0 +1,335 @@
+"""
+Retention and rollup of the drones' battery log.
+
+Raw DroneBatteryLogHistory rows are rolled up into hourly DroneBatteryLogRollup
+rows, hourly rows into daily ones, and rows past their retention horizon are
+purged in bounded batches so no single statement holds the table for long.
+"""
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import NotSupportedError, transaction
+from django.db.models import (
+    Avg, Count, DecimalField, ExpressionWrapper, F, FloatField, Func, IntegerField, Max, Min, Q, Sum, Value,
+)
+from django.db.models.functions import Cast, Floor, Least, TruncDay, TruncHour
+from django.utils.timezone import localtime, now
+
+from src.drone.battery import BATTERY_PRECISION
+from src.drone.enums import BatteryRollupPeriod
+from src.drone.models import DroneBatteryLogHistory, DroneBatteryLogRollup, DroneBatterySweep
+
+logger = logging.getLogger(__name__)
+
+# longest time range served from the raw log and from the hourly rollups,
+# longer ranges are read from the daily rollups
+RAW_HISTORY_MAX_RANGE = timedelta(days=2)
+HOURLY_HISTORY_MAX_RANGE = timedelta(days=60)
+
+ROLLUP_FIELDS = ['min_battery', 'avg_battery', 'max_battery', 'sample_count']
+
+
+def _save_rollups(period, buckets):
+    rollups = [
+        DroneBatteryLogRollup(
+            drone_id=bucket['drone_id'],
+            period=period,
+            bucket_start=bucket['bucket'],
+            min_battery=bucket['min_battery'],
+            avg_battery=Decimal(bucket['avg_battery']).quantize(BATTERY_PRECISION),
+            max_battery=bucket['max_battery'],
+            sample_count=bucket['sample_count'],
+        )
+        for bucket in buckets
+    ]
+    DroneBatteryLogRollup.objects.bulk_create(
+        rollups,
+        batch_size=settings.DRONE_BATTERY_HISTORY_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['drone', 'period', 'bucket_start'],
+        update_fields=ROLLUP_FIELDS,
+    )
+    return len(rollups)
+
+
+def _watermark(period, fallback):
+    """
+    Start of the latest bucket already rolled up. It is rolled up again, so
+    a run is idempotent and picks up samples logged after the previous run.
+    """
+    latest = (
+        DroneBatteryLogRollup.objects
+        .filter(period=period)
+        .aggregate(latest=Max('bucket_start'))['latest']
+    )
+    return latest or fallback
+
+
+def rollup_hourly(until):
+    """
+    Roll up the raw log of every complete hour before `until`.
+    """
+    until = localtime(until).replace(minute=0, second=0, microsecond=0)
+    first_sample = DroneBatteryLogHistory.objects.aggregate(first=Min('created_at'))['first']
+    if first_sample is None:
+        return 0
+    since = _watermark(BatteryRollupPeriod.HOUR, first_sample)
+
+    buckets = (
+        DroneBatteryLogHistory.objects
+        .filter(created_at__gte=since, created_at__lt=until)
+        .annotate(bucket=TruncHour('created_at'))
+        .values('drone_id', 'bucket')
+        .annotate(
+            min_battery=Min('battery_capacity'),
+            avg_battery=Avg('battery_capacity'),
+            max_battery=Max('battery_capacity'),
+            sample_count=Count('id'),
+        )
+        .order_by()
+    )
+    return _save_rollups(BatteryRollupPeriod.HOUR, buckets)
+
+
+def rollup_daily(until):
+    """
+    Roll up the hourly rollups of every complete day before `until`.
+    """
+    until = localtime(until).replace(hour=0, minute=0, second=0, microsecond=0)
+    hourly = DroneBatteryLogRollup.objects.filter(period=BatteryRollupPeriod.HOUR)
+    first_bucket = hourly.aggregate(first=Min('bucket_start'))['first']
+    if first_bucket is None:
+        return 0
+    since = _watermark(BatteryRollupPeriod.DAY, first_bucket)
+
+    buckets = (
+        hourly
+        .filter(bucket_start__gte=since, bucket_start__lt=until)
+        .annotate(bucket=TruncDay('bucket_start'))
+        .values('drone_id', 'bucket')
+        .annotate(
+            min_battery=Min('min_battery'),
+            weighted_battery=Sum(ExpressionWrapper(F('avg_battery') * F('sample_count'), output_field=DecimalField())),
+            max_battery=Max('max_battery'),
+            sample_count=Sum('sample_count'),
+        )
+        .order_by()
+    )
+    return _save_rollups(BatteryRollupPeriod.DAY, [
+        {**bucket, 'avg_battery': Decimal(bucket['weighted_battery']) / bucket['sample_count']}
+        for bucket in buckets
+    ])
+
+
+def purge_in_batches(queryset, batch_size):
+    """
+    Delete the queryset's rows a batch of primary keys at a time, each batch in its own transaction.
+    """
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += queryset.model.objects.filter(id__in=ids).delete()[0]
+
+
+def compact_battery_history(at=None):
+    """
+    Roll up the battery log and purge raw and hourly rows past their retention horizon.
+    """
+    at = at or now()
+    batch_size = settings.DRONE_BATTERY_HISTORY_BATCH_SIZE
+    stats = {
+        'hourly_rollups': rollup_hourly(at),
+        'daily_rollups': rollup_daily(at),
+    }
+
+    # never purge samples that have not been rolled up yet
+    hourly_watermark = _watermark(BatteryRollupPeriod.HOUR, at)
+    raw_horizon = min(at - timedelta(days=settings.DRONE_BATTERY_HISTORY_RAW_RETENTION_DAYS), hourly_watermark)
+    stats['raw_purged'] = purge_in_batches(
+        DroneBatteryLogHistory.objects.filter(created_at__lt=raw_horizon), batch_size,
+    )
+
+    daily_watermark = _watermark(BatteryRollupPeriod.DAY, at)
+    hourly_horizon = min(at - timedelta(days=settings.DRONE_BATTERY_HISTORY_HOURLY_RETENTION_DAYS), daily_watermark)
+    stats['hourly_purged'] = purge_in_batches(
+        DroneBatteryLogRollup.objects.filter(period=BatteryRollupPeriod.HOUR, bucket_start__lt=hourly_horizon),
+        batch_size,
+    )
+    # sweep records (and their shard idempotency keys) only matter while a sweep may still be retried
+    stats['sweeps_purged'] = purge_in_batches(
+        DroneBatterySweep.objects.filter(
+            started_at__lt=at - timedelta(days=settings.DRONE_BATTERY_HISTORY_RAW_RETENTION_DAYS),
+        ),
+        batch_size,
+    )
+
+    logger.info('Battery history compaction finished: %s', stats)
+    return stats
+
+
+def history_period(start, end, at=None):
+    """
+    The tier a time range is read from: None for the raw log, otherwise a rollup period.
+    """
+    at = at or now()
+    span = end - start
+    if span <= RAW_HISTORY_MAX_RANGE and start >= at - timedelta(days=settings.DRONE_BATTERY_HISTORY_RAW_RETENTION_DAYS):
+        return None
+    if span <= HOURLY_HISTORY_MAX_RANGE and start >= at - timedelta(days=settings.DRONE_BATTERY_HISTORY_HOURLY_RETENTION_DAYS):
+        return BatteryRollupPeriod.HOUR
+    return BatteryRollupPeriod.DAY
+
+
+def _rolled_up_until():
+    """
+    The end of the time each rollup period covers, None for a period not rolled up yet.
+    The latest bucket of a period is complete (see rollup_hourly and rollup_daily),
+    the samples after it are only in the finer tiers and the raw log.
+    """
+    latest = DroneBatteryLogRollup.objects.aggregate(
+        hour=Max('bucket_start', filter=Q(period=BatteryRollupPeriod.HOUR)),
+        day=Max('bucket_start', filter=Q(period=BatteryRollupPeriod.DAY)),
+    )
+    return {
+        BatteryRollupPeriod.HOUR: latest['hour'] and localtime(latest['hour']) + timedelta(hours=1),
+        BatteryRollupPeriod.DAY: latest['day'] and localtime(latest['day']) + timedelta(days=1),
+    }
+
+
+def _history_segments(drone_ids, start, end):
+    """
+    (period, rows) pairs covering the range in time order, period None for the raw log.
+    The tier history_period picks is read as far as it is rolled up, the rest of the
+    range from the finer tiers down to the raw log, which holds everything after the
+    hourly rollups.
+    """
+    period = history_period(start, end)
+    tiers = {
+        None: [],
+        BatteryRollupPeriod.HOUR: [BatteryRollupPeriod.HOUR],
+        BatteryRollupPeriod.DAY: [BatteryRollupPeriod.DAY, BatteryRollupPeriod.HOUR],
+    }[period]
+    rolled_up = _rolled_up_until() if tiers else {}
+
+    segments = []
+    for tier in tiers:
+        until = min(end, rolled_up[tier] or start)
+        if until > start:
+            segments.append((tier, DroneBatteryLogRollup.objects.filter(
+                period=tier, bucket_start__gte=start, bucket_start__lt=until,
+            )))
+            start = until
+    if start < end:
+        segments.append((None, DroneBatteryLogHistory.objects.filter(created_at__gte=start, created_at__lt=end)))
+
+    if drone_ids is not None:
+        segments = [(tier, rows.filter(drone_id__in=drone_ids)) for tier, rows in segments]
+    return segments
+
+
+def battery_history(drone_ids, start, end):
+    """
+    Battery samples between `start` and `end` as (drone_id, time, min, avg, max)
+    rows in time order, for the given drones or, with `drone_ids=None`, the whole
+    fleet. Read from the raw log for short recent ranges and from the rollups otherwise,
+    the time after the last compaction from the raw log.
+    """
+    for period, rows in _history_segments(drone_ids, start, end):
+        if period is None:
+            yield from (
+                (drone_id, created_at, battery, battery, battery)
+                for drone_id, created_at, battery in (
+                    rows
+                    .order_by('created_at')
+                    .values_list('drone_id', 'created_at', 'battery_capacity')
+                    .iterator(chunk_size=settings.DRONE_BATTERY_HISTORY_BATCH_SIZE)
+                )
+            )
+        else:
+            yield from (
+                rows
+                .order_by('bucket_start')
+                .values_list('drone_id', 'bucket_start', 'min_battery', 'avg_battery', 'max_battery')
+                .iterator(chunk_size=settings.DRONE_BATTERY_HISTORY_BATCH_SIZE)
+            )
+
+
+class Epoch(Func):
+    """
+    Seconds from the Unix epoch to a datetime expression.
+    """
+    output_field = FloatField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(f'Epoch is not implemented for {connection.vendor}.')
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.get_source_expressions()[0])
+        # strftime('%s') only has whole seconds, '%f' - '%S' is their fraction
+        return (
+            f"(CAST(strftime('%%s', {sql}) AS REAL) + strftime('%%f', {sql}) - strftime('%%S', {sql}))",
+            (*params, *params, *params),
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, template='EXTRACT(EPOCH FROM %(expressions)s)', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, template='UNIX_TIMESTAMP(%(expressions)s)', **extra_context)
+
+
+def downsampled_battery_history(drone_ids, start, end, points):
+    """
+    Battery history (see battery_history) reduced to at most `points` equal-width
+    time buckets of min/avg/max. The buckets are aggregated by the database, only
+    they are fetched, and merged where the range changes tiers within a bucket.
+    """
+    start_ts = start.timestamp()
+    width = max((end.timestamp() - start_ts) / points, 1e-6)
+
+    merged = {}
+    for period, rows in _history_segments(drone_ids, start, end):
+        if period is None:
+            time = 'created_at'
+            aggregates = {
+                'minimum': Min('battery_capacity'),
+                'average': Avg('battery_capacity'),
+                'maximum': Max('battery_capacity'),
+                'samples': Count('id'),
+            }
+        else:
+            time = 'bucket_start'
+            aggregates = {
+                'minimum': Min('min_battery'),
+                # a rollup's average weighs as much as the samples behind it
+                'average': Cast(Sum(F('avg_battery') * F('sample_count')), FloatField()) / Sum('sample_count'),
+                'maximum': Max('max_battery'),
+                'samples': Sum('sample_count'),
+            }
+
+        index = Least(Cast(Floor((Epoch(time) - Value(start_ts)) / Value(width)), IntegerField()), Value(points - 1))
+        for bucket in rows.annotate(index=index).values('index').annotate(**aggregates).order_by():
+            minimum, average, maximum = float(bucket['minimum']), float(bucket['average']), float(bucket['maximum'])
+            samples = bucket['samples']
+            if bucket['index'] in merged:
+                other_minimum, other_average, other_maximum, other_samples = merged[bucket['index']]
+                minimum, maximum = min(minimum, other_minimum), max(maximum, other_maximum)
+                average = (average * samples + other_average * other_samples) / (samples + other_samples)
+                samples += other_samples
+            merged[bucket['index']] = (minimum, average, maximum, samples)
+
+    return [
+        {
+            'time': datetime.fromtimestamp(start_ts + index * width, tz=start.tzinfo),
+            'min': round(minimum, 1),
+            'avg': round(average, 1),
+            'max': round(maximum, 1),
+            'samples': samples,
+        }
+        for index, (minimum, average, maximum, samples) in sorted(merged.items())
+    ]
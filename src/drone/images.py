@@ -0,0 +1,92 @@
+"""
+Medication image processing, run by the process_medication_image task after an upload.
+
+The upload is turned upright from its EXIF orientation and re-encoded without
+its metadata (EXIF, GPS position, ICC profile, comments), then a copy of it is
+made for every DRONE_IMAGE_VARIANTS size. The files are named after the SHA-256
+of their content: an image uploaded twice is stored once and a URL never changes
+content, so it can be cached forever. The medication's `image` then points to
+the stripped original, which replaces the upload, and `image_variants` to the copies.
+"""
+import hashlib
+import logging
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from src.drone import cache as drone_cache
+from src.drone.models import Medication
+
+logger = logging.getLogger(__name__)
+
+IMAGES_DIR = 'med_images'
+
+
+def _encode(image):
+    """
+    The image as (bytes, extension), PNG when it has transparency, JPEG otherwise.
+    """
+    buffer = BytesIO()
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        image = image.convert('RGBA')
+        image.info = {}
+        image.save(buffer, 'PNG', optimize=True)
+        return buffer.getvalue(), 'png'
+    image = image.convert('RGB')
+    image.info = {}
+    image.save(buffer, 'JPEG', quality=settings.DRONE_IMAGE_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue(), 'jpg'
+
+
+def _store(storage, content, extension):
+    name = f'{IMAGES_DIR}/{hashlib.sha256(content).hexdigest()}.{extension}'
+    if storage.exists(name):
+        return name
+    return storage.save(name, ContentFile(content))
+
+
+def process_image(file, storage):
+    """
+    Store the stripped original and the size variants of an image file, returning
+    their names by variant, the original under 'original'.
+    """
+    with Image.open(file) as upload:
+        image = ImageOps.exif_transpose(upload)
+        names = {'original': _store(storage, *_encode(image))}
+        for variant, size in settings.DRONE_IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+            names[variant] = _store(storage, *_encode(resized))
+    return names
+
+
+def process_medication_image(medication_id):
+    """
+    Process the medication's uploaded image, returning the stored names or None
+    when there is nothing (left) to process.
+    """
+    medication = Medication.objects.filter(pk=medication_id).only('id', 'image', 'drone_id').first()
+    if medication is None or not medication.image:
+        return None
+    uploaded = medication.image.name
+    storage = medication.image.storage
+
+    try:
+        with medication.image.open('rb') as file:
+            names = process_image(file, storage)
+    except (OSError, Image.DecompressionBombError) as error:
+        # Pillow raises UnidentifiedImageError, an OSError, for files that are not images
+        logger.warning('Could not process the image of medication %s: %s', medication_id, error)
+        return None
+
+    original = names.pop('original')
+    # a newer upload, processed by its own task, wins
+    updated = Medication.objects.filter(pk=medication_id, image=uploaded).update(image=original, image_variants=names)
+    if not updated:
+        return None
+    if uploaded != original and not Medication.objects.filter(image=uploaded).exists():
+        storage.delete(uploaded)
+    drone_cache.invalidate_drone(medication.drone_id)
+    return {'original': original, **names}
@@ -0,0 +1,118 @@
+"""
+In-process load test of the ASGI application: the sync drone endpoints against their async versions.
+
+Requests are handed straight to the ASGI callable, the way uvicorn or daphne
+call it, by `concurrency` clients sharing one event loop. The results are the
+requests per second of a single server process, without network overhead.
+Like the benchmarks it is meant to run against a throwaway test database (see
+the `loadtest_drone_api` management command).
+"""
+import asyncio
+import time
+
+from django.core.asgi import get_asgi_application
+from django.urls import reverse
+
+from src.drone.benchmarks import BenchmarkContext, _percentile, seed_fleet
+from src.drone.enums import DroneState
+from src.drone.models import Drone, Medication
+
+# endpoint: (sync url name, async url name, whether the url takes the drone id)
+ENDPOINTS = {
+    'battery-level': ('drones-check-battery-level', 'async-drones-check-battery-level', True),
+    'loaded-medications': ('drones-check-loaded-medictions', 'async-drones-check-loaded-medictions', True),
+    'available-drones': ('drones-check-available-drones', 'async-drones-check-available-drones', False),
+}
+
+
+def _scope(path):
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', b'testserver')],
+        'client': ('127.0.0.1', 50000),
+        'server': ('127.0.0.1', 80),
+    }
+
+
+async def _request(application, path):
+    """
+    Send one GET request through the ASGI application and return the response status.
+    """
+    request_sent = False
+    disconnected = asyncio.Event()
+    status = None
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Django listens for a client disconnect until the response is sent
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(_scope(path), receive, send)
+    return status
+
+
+async def _load(application, path, concurrency, requests):
+    latencies = []
+    remaining = requests
+
+    async def client():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            status = await _request(application, path)
+            if status != 200:
+                raise AssertionError(f'{path} answered {status}')
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'rps': round(requests / elapsed, 1),
+        'p50_ms': round(_percentile(latencies, 50), 3),
+        'p95_ms': round(_percentile(latencies, 95), 3),
+    }
+
+
+def run_load_test(size, concurrency=50, requests=1000, endpoints=None):
+    """
+    Seed a fleet of `size` drones and load test the sync and async version of every endpoint.
+    """
+    seed_fleet(size)
+    ctx = BenchmarkContext()
+    drone_id = ctx.drone_ids[0]
+    ctx.set_drone(drone_id, DroneState.LOADED, ctx.medication_ids[:5])
+    application = get_asgi_application()
+
+    results = {}
+    for name in endpoints or ENDPOINTS:
+        sync_name, async_name, takes_drone = ENDPOINTS[name]
+        kwargs = {'pk': drone_id} if takes_drone else {}
+        results[name] = {
+            mode: asyncio.run(_load(application, reverse(url_name, kwargs=kwargs), concurrency, requests))
+            for mode, url_name in (('sync', sync_name), ('async', async_name))
+        }
+
+    Medication.objects.all().delete()
+    Drone.objects.all().delete()
+    return results
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from src.drone import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark query counts, latency and memory of the drone API and battery sweep '
+        'against a throwaway test database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', type=int, action='append', dest='sizes',
+            help=f'Fleet size to seed, can be repeated (default: {benchmarks.DEFAULT_FLEET_SIZES})',
+        )
+        parser.add_argument('--repeat', type=int, default=10, help='Runs per scenario')
+        parser.add_argument('--scenario', action='append', dest='scenarios', choices=sorted(benchmarks.SCENARIOS))
+        parser.add_argument('--tolerance', type=float, default=2.0, help='Allowed latency/memory growth factor')
+        parser.add_argument('--check', action='store_true', help='Fail when results regress past the baselines')
+        parser.add_argument('--update-baselines', action='store_true', help='Store the results as the new baselines')
+
+    def handle(self, *args, **options):
+        sizes = options['sizes'] or benchmarks.DEFAULT_FLEET_SIZES
+        baselines = benchmarks.load_baselines()
+        regressions = []
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for size in sizes:
+                results = benchmarks.run_benchmarks(size, options['repeat'], options['scenarios'])
+                self._print_results(size, results)
+
+                if options['check']:
+                    regressions += [
+                        f'[{size}] {regression}'
+                        for regression in benchmarks.find_regressions(
+                            results, baselines.get(str(size), {}), options['tolerance'],
+                        )
+                    ]
+                if options['update_baselines']:
+                    baselines.setdefault(str(size), {}).update(results)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['update_baselines']:
+            benchmarks.save_baselines(baselines)
+            self.stdout.write(self.style.SUCCESS(f'Baselines written to {benchmarks.BASELINES_PATH}'))
+
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(regression)
+            raise CommandError(f'{len(regressions)} benchmark regressions')
+
+    def _print_results(self, size, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Fleet size {size}'))
+        self.stdout.write(f"{'scenario':<28}{'queries':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak KiB':>12}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<28}{result['queries']:>8}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+                f"{result['p99_ms']:>10}{result['peak_memory_kb']:>12}"
+            )
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from src.drone.battery import projected_battery_expression
+from src.drone.enums import DroneModel, DroneState
+from src.drone.models import Drone, DroneBatteryLogHistory, Medication
+
+
+def hot_queries():
+    """
+    The queries issued by the API, the battery sweep and the admin on every request or tick.
+    """
+    available = (
+        Drone.objects
+        .alias(projected_battery=projected_battery_expression())
+        .filter(state=DroneState.IDLE, battery_capacity__gte=25, projected_battery__gte=25)
+        .order_by('id')
+    )
+    return {
+        'available drones': available,
+        'available drones by model': available.filter(drone_model=DroneModel.LIGHTWEIGHT),
+        'drones in state': Drone.objects.filter(state=DroneState.LOADED),
+        'drone by id': Drone.objects.filter(pk=1),
+        'loaded medications': Medication.objects.filter(drone_id=1),
+        'battery sweep chunk': (
+            Drone.objects
+            .filter(id__gt=0, id__lte=10000)
+            .annotate(projected_battery=projected_battery_expression())
+            .order_by('id')
+            .values_list('id', 'projected_battery')[:1000]
+        ),
+        'battery history of a drone': DroneBatteryLogHistory.objects.filter(drone_id=1).order_by('-created_at'),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Print the database query plans of the hot drone queries to verify index use'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Execute the queries and report actual timings (PostgreSQL only)',
+        )
+
+    def handle(self, *args, **options):
+        explain_options = {'analyze': True} if options['analyze'] and connection.vendor == 'postgresql' else {}
+        for name, queryset in hot_queries().items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
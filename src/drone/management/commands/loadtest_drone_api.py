@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from src.drone import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the sync and async versions of the read endpoints through the ASGI application '
+        'against a throwaway test database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1000, help='Fleet size to seed')
+        parser.add_argument('--concurrency', type=int, default=50, help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per endpoint and mode')
+        parser.add_argument('--endpoint', action='append', dest='endpoints', choices=sorted(loadtest.ENDPOINTS))
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = loadtest.run_load_test(
+                options['size'], options['concurrency'], options['requests'], options['endpoints'],
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"Fleet size {options['size']}, {options['concurrency']} concurrent clients"
+        ))
+        self.stdout.write(f"{'endpoint':<22}{'mode':<7}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for name, modes in results.items():
+            for mode, result in modes.items():
+                self.stdout.write(
+                    f"{name:<22}{mode:<7}{result['rps']:>10}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+                )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from src.drone.images import process_medication_image
+from src.drone.models import Medication
+from src.drone.tasks import process_medication_image as process_medication_image_task
+
+
+class Command(BaseCommand):
+    help = 'Strip and resize the images of the medications that have no image variants yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='store_true', help='Queue a Celery task per image instead')
+
+    def handle(self, *args, **options):
+        medication_ids = (
+            Medication.objects.exclude(image='').exclude(image=None).filter(image_variants={})
+            .values_list('id', flat=True).iterator()
+        )
+        processed = 0
+        for medication_id in medication_ids:
+            if options['queue']:
+                process_medication_image_task.delay(medication_id)
+                processed += 1
+            elif process_medication_image(medication_id) is not None:
+                processed += 1
+        action = 'Queued' if options['queue'] else 'Processed'
+        self.stdout.write(self.style.SUCCESS(f'{action} {processed} medication images'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+
+from src.drone import cache as drone_cache
+from src.drone.models import Drone, actual_loads
+
+
+class Command(BaseCommand):
+    help = "Rebuild (or with --check, verify) the drones' loaded_weight and loaded_count counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report drones whose counters are out of date')
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            loads = actual_loads()
+            updated = Drone.objects.update(loaded_weight=loads['actual_weight'], loaded_count=loads['actual_count'])
+            # the cached drones still carry the old counters
+            drone_cache.clear()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt load counters for {updated} drones'))
+            return
+
+        mismatches = (
+            Drone.objects
+            .annotate(**actual_loads())
+            .exclude(Q(loaded_weight=F('actual_weight')) & Q(loaded_count=F('actual_count')))
+            .values_list('id', 'loaded_weight', 'actual_weight', 'loaded_count', 'actual_count')
+        )
+        found = 0
+        for drone_id, loaded_weight, actual_weight, loaded_count, actual_count in mismatches:
+            found += 1
+            self.stdout.write(
+                f'Drone-{drone_id}: weight {loaded_weight} != {actual_weight}, count {loaded_count} != {actual_count}'
+            )
+
+        if found:
+            raise CommandError(f'{found} drones have out of date load counters')
+        self.stdout.write(self.style.SUCCESS('All load counters are up to date'))
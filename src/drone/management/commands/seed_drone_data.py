@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.base import DeserializationError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError
+
+from src.drone import seeding
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed the database fast: stream JSON fixtures into per-model bulk inserts '
+        'and/or generate a synthetic fleet of drones and medications'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixtures', nargs='*', help='JSON fixture files, optionally .gz or .bz2 compressed')
+        parser.add_argument(
+            '--model', action='append', dest='models', default=[],
+            help='Only load this app label or app_label.ModelName, can be repeated',
+        )
+        parser.add_argument(
+            '-e', '--exclude', action='append', default=[],
+            help='Skip this app label or app_label.ModelName (e.g. admin.logentry), can be repeated',
+        )
+        parser.add_argument('--drones', type=int, default=0, help='Synthetic drones to generate')
+        parser.add_argument('--medications', type=int, default=0, help='Synthetic medications to generate')
+        parser.add_argument('--prefix', default='SEED', help='Serial number and code prefix of the synthetic rows')
+        parser.add_argument('--seed', type=int, help='Random seed of the synthetic rows')
+        parser.add_argument('--batch-size', type=int, default=seeding.SEED_BATCH_SIZE, help='Rows per insert')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database to seed')
+
+    def handle(self, *args, **options):
+        if not options['fixtures'] and not (options['drones'] or options['medications']):
+            raise CommandError('Give fixture files to load and/or --drones/--medications to generate.')
+
+        selected = seeding.model_filter(options['models'], options['exclude'])
+        for path in options['fixtures']:
+            started = time.perf_counter()
+            try:
+                with seeding.open_fixture(path) as stream:
+                    counts = seeding.load_fixture(stream, selected, options['database'], options['batch_size'])
+            except (OSError, DeserializationError, DatabaseError) as error:
+                raise CommandError(f'Could not load {path}: {error}')
+
+            for label, count in sorted(counts.items()):
+                self.stdout.write(f'  {label}: {count}')
+            self.stdout.write(self.style.SUCCESS(
+                f'Loaded {sum(counts.values())} objects from {path} in {time.perf_counter() - started:.2f}s'
+            ))
+
+        if options['drones'] or options['medications']:
+            started = time.perf_counter()
+            try:
+                created = seeding.generate_fleet(
+                    options['drones'], options['medications'], options['prefix'],
+                    options['database'], options['batch_size'], options['seed'],
+                )
+            except IntegrityError as error:
+                raise CommandError(f'Could not generate the fleet: {error}')
+            self.stdout.write(self.style.SUCCESS(
+                f"Generated {created['drones']} drones and {created['medications']} medications "
+                f'in {time.perf_counter() - started:.2f}s'
+            ))
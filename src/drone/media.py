@@ -0,0 +1,157 @@
+"""
+Media files (MEDIA_ROOT) served with conditional and range request support.
+
+Every file gets an ETag made of its modification time and size. A matching
+If-None-Match, or an If-Modified-Since not older than the file, is answered
+with 304, the other preconditions are checked too. A single byte range is
+answered with 206 (unless an If-Range does not match), an unsatisfiable one
+with 416 and several ranges with the whole file.
+
+The open file is handed to the server in the response, so a WSGI server with
+`wsgi.file_wrapper` (gunicorn, uWSGI) sends it, or the requested range of it,
+with sendfile() instead of copying it through Python. Files named after a
+SHA-256 of their content (see src.drone.images) never change and are cached
+by clients for a year. With DRONE_MEDIA_ACCEL_REDIRECT set, the whole
+transfer is left to nginx: the response only carries an X-Accel-Redirect to
+that internal location.
+"""
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+_BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_CONTENT_HASHED = re.compile(r'(^|/)[0-9a-f]{64}\.\w+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class Unsatisfiable(Exception):
+    """
+    The requested range starts after the end of the file.
+    """
+
+
+class FileRange:
+    """
+    `length` bytes of an open file, from `start`. It keeps the file's fileno(),
+    so the server can still sendfile() the range, from the file's position.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def byte_range(header, size):
+    """
+    The (first, last) byte positions of a single byte range `header` for a file
+    of `size` bytes, or None when the whole file should be sent.
+    """
+    match = _BYTE_RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        # not a single byte range, which the server may ignore
+        return None
+    first, last = match.groups()
+    if not first:
+        # the last `last` bytes
+        if int(last) == 0 or size == 0:
+            raise Unsatisfiable
+        return max(size - int(last), 0), size - 1
+    if last and int(last) < int(first):
+        return None
+    if int(first) >= size:
+        raise Unsatisfiable
+    return int(first), min(int(last), size - 1) if last else size - 1
+
+
+def _if_range_passes(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # a weak ETag never matches
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _file_response(request, path, size, etag, last_modified):
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    requested = request.headers.get('Range')
+    try:
+        positions = byte_range(requested, size) if requested and _if_range_passes(request, etag, last_modified) else None
+    except Unsatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    file = open(path, 'rb')
+    if positions is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        first, last = positions
+        response = FileResponse(FileRange(file, first, last - first + 1), content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+        response['Content-Length'] = last - first + 1
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serve the media file at `path` under MEDIA_ROOT.
+    """
+    try:
+        full_path = default_storage.path(path)
+    except (SuspiciousFileOperation, NotImplementedError):
+        raise Http404('Media file not found.')
+
+    if settings.DRONE_MEDIA_ACCEL_REDIRECT:
+        response = HttpResponse(content_type=mimetypes.guess_type(full_path)[0] or 'application/octet-stream')
+        response['X-Accel-Redirect'] = settings.DRONE_MEDIA_ACCEL_REDIRECT.rstrip('/') + '/' + quote(path)
+        return response
+
+    try:
+        stats = os.stat(full_path)
+    except OSError:
+        raise Http404('Media file not found.')
+    if not stat.S_ISREG(stats.st_mode):
+        raise Http404('Media file not found.')
+
+    etag = quote_etag(f'{stats.st_mtime_ns:x}-{stats.st_size:x}')
+    last_modified = int(stats.st_mtime)
+    response = get_conditional_response(request, etag, last_modified)
+    if response is None:
+        response = _file_response(request, full_path, stats.st_size, etag, last_modified)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if _CONTENT_HASHED.search(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        # clients keep the file but check it is current, which costs a 304
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:26
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_load_counters(apps, schema_editor):
+    Drone = apps.get_model('drone', 'Drone')
+    Medication = apps.get_model('drone', 'Medication')
+
+    loads = Medication.objects.filter(drone=OuterRef('pk')).order_by().values('drone')
+    Drone.objects.update(
+        loaded_weight=Coalesce(Subquery(loads.annotate(total=Sum('weight')).values('total')), Value(0), output_field=models.DecimalField()),
+        loaded_count=Coalesce(Subquery(loads.annotate(total=Count('id')).values('total')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drone', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drone',
+            name='loaded_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='drone',
+            name='loaded_weight',
+            field=models.DecimalField(decimal_places=1, default=0.0, max_digits=20),
+        ),
+        migrations.RunPython(populate_load_counters, migrations.RunPython.noop),
+    ]
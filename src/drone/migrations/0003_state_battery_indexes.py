@@ -0,0 +1,26 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:31
+
+import src.drone.enums
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drone', '0002_drone_load_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(fields=['state', 'battery_capacity'], name='drone_state_battery_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(condition=models.Q(('state', src.drone.enums.DroneState['IDLE'])), fields=['id', 'battery_capacity'], name='drone_idle_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dronebatteryloghistory',
+            index=models.Index(fields=['drone', 'created_at'], name='battery_log_drone_created_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:32
+
+import django.db.models.deletion
+import enumfields.fields
+import src.drone.enums
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drone', '0003_state_battery_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DroneBatteryLogRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', enumfields.fields.EnumField(enum=src.drone.enums.BatteryRollupPeriod, max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('min_battery', models.DecimalField(decimal_places=1, default=0.0, max_digits=20)),
+                ('avg_battery', models.DecimalField(decimal_places=1, default=0.0, max_digits=20)),
+                ('max_battery', models.DecimalField(decimal_places=1, default=0.0, max_digits=20)),
+                ('sample_count', models.PositiveIntegerField(default=0)),
+                ('drone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='drone.drone')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket_start'], name='battery_rollup_period_idx')],
+                'constraints': [models.UniqueConstraint(fields=('drone', 'period', 'bucket_start'), name='battery_rollup_bucket_unique')],
+            },
+        ),
+    ]
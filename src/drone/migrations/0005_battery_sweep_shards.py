@@ -0,0 +1,42 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drone', '0004_battery_log_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DroneBatterySweep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('shard_size', models.PositiveIntegerField()),
+                ('shard_count', models.PositiveIntegerField(default=0)),
+                ('drones', models.PositiveIntegerField(default=0)),
+                ('history_rows', models.PositiveIntegerField(default=0)),
+                ('duration_seconds', models.FloatField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DroneBatterySweepShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_id', models.PositiveBigIntegerField()),
+                ('last_id', models.PositiveBigIntegerField()),
+                ('drones', models.PositiveIntegerField(default=0)),
+                ('history_rows', models.PositiveIntegerField(default=0)),
+                ('applied_at', models.DateTimeField(auto_now_add=True)),
+                ('sweep', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='drone.dronebatterysweep')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('sweep', 'first_id'), name='battery_sweep_shard_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drone', '0005_battery_sweep_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drone',
+            name='battery_dirty',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='dronebatterysweep',
+            name='incremental',
+            field=models.BooleanField(default=False),
+        ),
+    ]
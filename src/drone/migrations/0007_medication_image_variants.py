@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drone', '0006_incremental_battery_sweep'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medication',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+COMPACTION_TASK = 'Compact drone battery history'
+
+
+def schedule_compaction(apps, schema_editor):
+    IntervalSchedule = apps.get_model('django_celery_beat', 'IntervalSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    hourly, _ = IntervalSchedule.objects.get_or_create(every=1, period='hours')
+    PeriodicTask.objects.get_or_create(
+        name=COMPACTION_TASK,
+        defaults={'task': 'src.drone.tasks.compact_drone_battery_history', 'interval': hourly},
+    )
+
+
+def unschedule_compaction(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name=COMPACTION_TASK).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drone', '0007_medication_image_variants'),
+        ('django_celery_beat', '0019_alter_periodictasks_options'),
+    ]
+
+    operations = [
+        migrations.RunPython(schedule_compaction, unschedule_compaction),
+    ]
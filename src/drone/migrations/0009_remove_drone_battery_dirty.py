@@ -0,0 +1,17 @@
+# Generated by Django 5.1.5 on 2026-10-18 19:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drone', '0008_schedule_battery_history_compaction'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='drone',
+            name='battery_dirty',
+        ),
+    ]
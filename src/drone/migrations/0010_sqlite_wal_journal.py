@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def set_journal_mode(mode):
+    # the journal mode is stored in the SQLite file, so it is set once here rather than on every connection
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'sqlite':
+            with schema_editor.connection.cursor() as cursor:
+                cursor.execute(f'PRAGMA journal_mode={mode}')
+    return run
+
+
+class Migration(migrations.Migration):
+    # the journal mode can not be changed inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('drone', '0009_remove_drone_battery_dirty'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_journal_mode('WAL'), set_journal_mode('DELETE')),
+    ]
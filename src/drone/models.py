@@ -1,6 +1,13 @@
-from django.db import models
+from decimal import Decimal
+from functools import partial
+from django.db import models, transaction
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
 from django.core.validators import MaxValueValidator, MinValueValidator, RegexValidator
-from .enums import DroneModel, DroneState
+from . import cache as drone_cache
+from .battery import project_battery, unloaded_battery, unloaded_battery_expression
+from .enums import BatteryRollupPeriod, DroneModel, DroneState
 from enumfields import EnumField
 
 OPTIONAL = {'null': True, 'blank': True}
@@ -14,10 +21,41 @@ class Drone(models.Model):
     state = EnumField(DroneState, default=DroneState.IDLE, max_length=20)
     created_at = models.DateTimeField(auto_now=True)
     last_time_updated = models.DateTimeField(**OPTIONAL)
+    # denormalized totals of the medications currently attached to the drone
+    loaded_weight = models.DecimalField(**{**DECIMAL_FIELD_PARAM, 'default': Decimal('0.0')})
+    loaded_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'battery_capacity'], name='drone_state_battery_idx'),
+            # available-drones scans idle drones in id order, checking the battery from the index
+            models.Index(
+                fields=['id', 'battery_capacity'],
+                condition=models.Q(state=DroneState.IDLE),
+                name='drone_idle_idx',
+            ),
+        ]
 
     def __str__(self):
         return f'Drone-{self.id} - {self.serial_number}'
 
+    def projected_battery(self, at=None):
+        return project_battery(self.battery_capacity, self.loaded_weight, self.last_time_updated, at)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        drone_cache.invalidate_drone(self.pk)
+
+    def delete(self, *args, **kwargs):
+        drone_id = self.pk
+        result = super().delete(*args, **kwargs)
+        drone_cache.invalidate_drone(drone_id)
+        return result
+
+
+# sent once the transaction saving a medication with a new image commits, with `medication_id`
+image_uploaded = Signal()
+
 
 class Medication(models.Model):
 
@@ -36,10 +74,157 @@ class Medication(models.Model):
         )
     ], unique=True)
     image = models.ImageField(upload_to='med_images/', **OPTIONAL)
+    # variant name -> stored name of the resized copies of `image`, see src.drone.images
+    image_variants = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now=True)
 
+    # (drone_id, weight) as last persisted, used to keep the drone's load counters in sync,
+    # None when either was deferred and the stored values have to be read before a change
+    _attached = (None, 0)
+    # image name as last persisted (None when it was deferred), a new upload is processed once committed
+    _image = ''
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'drone_id' in instance.__dict__ and 'weight' in instance.__dict__:
+            instance._attached = (instance.drone_id, instance.weight)
+        else:
+            instance._attached = None
+        instance._image = str(instance.__dict__['image'] or '') if 'image' in instance.__dict__ else None
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        if fields is None or 'image' in fields:
+            self._image = self.image.name or ''
+
+    def _persisted_attachment(self):
+        if self._attached is not None:
+            return self._attached
+        stored = Medication.objects.filter(pk=self.pk).values_list('drone_id', 'weight').first()
+        return stored or (None, 0)
+
+    def _adjust_drone_load(self, drone_id, weight, count):
+        updates = {'loaded_weight': F('loaded_weight') + weight, 'loaded_count': F('loaded_count') + count}
+        # a medication taken off keeps the charge of carrying it, a reweigh changes the load only
+        unloaded = count < 0
+        if unloaded:
+            updates['battery_capacity'] = unloaded_battery_expression(-weight)
+        Drone.objects.filter(pk=drone_id).update(**updates)
+        # keep an already fetched drone instance consistent with the database
+        if self._meta.get_field('drone').is_cached(self) and drone_id == self.drone_id:
+            if unloaded:
+                self.drone.battery_capacity = unloaded_battery(self.drone.battery_capacity, -weight)
+            self.drone.loaded_weight += weight
+            self.drone.loaded_count += count
+
+    def save(self, *args, **kwargs):
+        weight = self._meta.get_field('weight').to_python(self.weight)
+        with transaction.atomic():
+            previous_drone_id, previous_weight = self._persisted_attachment()
+            super().save(*args, **kwargs)
+            if previous_drone_id == self.drone_id:
+                # reweighed on the same drone, a single delta
+                if self.drone_id and weight != previous_weight:
+                    self._adjust_drone_load(self.drone_id, weight - previous_weight, 0)
+            else:
+                if previous_drone_id:
+                    self._adjust_drone_load(previous_drone_id, -previous_weight, -1)
+                if self.drone_id:
+                    self._adjust_drone_load(self.drone_id, weight, 1)
+        drone_cache.invalidate_drones({previous_drone_id, self.drone_id})
+        self._attached = (self.drone_id, weight)
+        if 'image' in self.__dict__:
+            if self._image is not None and self.image and self.image.name != self._image:
+                transaction.on_commit(partial(image_uploaded.send, sender=Medication, medication_id=self.pk))
+            self._image = self.image.name or ''
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            previous_drone_id, previous_weight = self._persisted_attachment()
+            result = super().delete(*args, **kwargs)
+            if previous_drone_id:
+                self._adjust_drone_load(previous_drone_id, -previous_weight, -1)
+        drone_cache.invalidate_drone(previous_drone_id)
+        self._attached = (None, 0)
+        return result
+
+
+def actual_loads():
+    """
+    Subquery expressions computing each drone's loaded weight and count from its medications.
+    """
+    loads = Medication.objects.filter(drone=OuterRef('pk')).order_by().values('drone')
+    return {
+        'actual_weight': Coalesce(
+            Subquery(loads.annotate(total=Sum('weight')).values('total')), Value(0), output_field=DecimalField(),
+        ),
+        'actual_count': Coalesce(Subquery(loads.annotate(total=Count('id')).values('total')), Value(0)),
+    }
+
 
 class DroneBatteryLogHistory(models.Model):
     drone = models.ForeignKey(Drone, on_delete=models.CASCADE)
     battery_capacity = models.DecimalField(validators=[MinValueValidator(0.0), MaxValueValidator(100.0)], **DECIMAL_FIELD_PARAM)
     created_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['drone', 'created_at'], name='battery_log_drone_created_idx'),
+        ]
+
+
+class DroneBatteryLogRollup(models.Model):
+    """
+    Hourly or daily min/avg/max of a drone's battery log, kept after the raw rows are purged.
+    """
+    drone = models.ForeignKey(Drone, on_delete=models.CASCADE)
+    period = EnumField(BatteryRollupPeriod, max_length=10)
+    bucket_start = models.DateTimeField()
+    min_battery = models.DecimalField(**DECIMAL_FIELD_PARAM)
+    avg_battery = models.DecimalField(**DECIMAL_FIELD_PARAM)
+    max_battery = models.DecimalField(**DECIMAL_FIELD_PARAM)
+    sample_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['drone', 'period', 'bucket_start'], name='battery_rollup_bucket_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'bucket_start'], name='battery_rollup_period_idx'),
+        ]
+
+
+class DroneBatterySweep(models.Model):
+    """
+    One run of the battery sweep, fanned out over shards of the drone id range.
+    """
+    # every shard projects the batteries at this time
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(**OPTIONAL)
+    shard_size = models.PositiveIntegerField()
+    incremental = models.BooleanField(default=False)
+    shard_count = models.PositiveIntegerField(default=0)
+    drones = models.PositiveIntegerField(default=0)
+    history_rows = models.PositiveIntegerField(default=0)
+    duration_seconds = models.FloatField(**OPTIONAL)
+
+
+class DroneBatterySweepShard(models.Model):
+    """
+    A shard of a sweep that has been applied. The (sweep, first_id) pair is the
+    shard's idempotency key: it is written in the shard's transaction, so a
+    retried shard finds it and does not deplete the same drones twice.
+    """
+    sweep = models.ForeignKey(DroneBatterySweep, on_delete=models.CASCADE, related_name='shards')
+    first_id = models.PositiveBigIntegerField()
+    last_id = models.PositiveBigIntegerField()
+    drones = models.PositiveIntegerField(default=0)
+    history_rows = models.PositiveIntegerField(default=0)
+    applied_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sweep', 'first_id'], name='battery_sweep_shard_unique'),
+        ]
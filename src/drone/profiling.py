@@ -0,0 +1,254 @@
+"""
+Sampled profiling of requests and Celery tasks.
+
+A sampled request (ProfilingMiddleware) or task (the task_prerun/task_postrun
+handlers below) records its wall time, the number and total time of its
+database queries and its DRONE_PROFILING_TOP_QUERIES slowest statements. Each
+profile is logged as one JSON line on this module's logger and added to the
+in-process totals that `prometheus_metrics` exposes on /metrics/. A profile
+slower than DRONE_PROFILING_CPROFILE_THRESHOLD_MS also leaves a cProfile dump
+in DRONE_PROFILING_CPROFILE_DIR, when it is set.
+
+Queries are attributed through a context variable, so concurrent requests on
+one event loop and the threads of sync_to_async are profiled separately.
+"""
+import cProfile
+import heapq
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# wall time histogram buckets, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_current = ContextVar('drone_profile', default=None)
+
+
+def _empty_totals():
+    return {'count': 0, 'wall': 0.0, 'queries': 0, 'query_time': 0.0, 'buckets': [0] * len(BUCKETS)}
+
+
+# (kind, name) -> totals of the sampled profiles
+_metrics = defaultdict(_empty_totals)
+_metrics_lock = threading.Lock()
+
+# cProfile can only run one profiler per thread, concurrent requests skip the dump
+_cprofile_lock = threading.Lock()
+
+# task id -> profile of the running task
+_task_profiles = {}
+
+
+class Profile:
+    def __init__(self, kind):
+        self.kind = kind
+        self.queries = 0
+        self.query_time = 0.0
+        # min-heap of (duration, sql), the slowest statements
+        self.slowest = []
+        self.profiler = None
+        self._lock = threading.Lock()
+        self._token = _current.set(self)
+
+        if settings.DRONE_PROFILING_CPROFILE_DIR and _cprofile_lock.acquire(blocking=False):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.started = time.perf_counter()
+
+    def record_query(self, sql, duration):
+        with self._lock:
+            self.queries += 1
+            self.query_time += duration
+            if len(self.slowest) < settings.DRONE_PROFILING_TOP_QUERIES:
+                heapq.heappush(self.slowest, (duration, sql))
+            else:
+                heapq.heappushpop(self.slowest, (duration, sql))
+
+    def finish(self, name, **labels):
+        """
+        Stop profiling, then log and count the profile under `name`.
+        """
+        wall = time.perf_counter() - self.started
+        _current.reset(self._token)
+
+        dump = None
+        if self.profiler is not None:
+            self.profiler.disable()
+            _cprofile_lock.release()
+            if wall * 1000 >= settings.DRONE_PROFILING_CPROFILE_THRESHOLD_MS:
+                dump = _dump(self.profiler, self.kind, name)
+
+        with _metrics_lock:
+            totals = _metrics[(self.kind, name)]
+            totals['count'] += 1
+            totals['wall'] += wall
+            totals['queries'] += self.queries
+            totals['query_time'] += self.query_time
+            for index, bound in enumerate(BUCKETS):
+                if wall <= bound:
+                    totals['buckets'][index] += 1
+
+        record = {
+            'kind': self.kind,
+            'name': name,
+            **labels,
+            'wall_ms': round(wall * 1000, 3),
+            'queries': self.queries,
+            'query_ms': round(self.query_time * 1000, 3),
+            'slowest_queries': [
+                {'ms': round(duration * 1000, 3), 'sql': sql}
+                for duration, sql in sorted(self.slowest, reverse=True)
+            ],
+        }
+        if dump:
+            record['cprofile'] = dump
+        logger.info(json.dumps(record), extra={'profile': record})
+        return record
+
+
+def start_profile(kind):
+    """
+    Profile the current request or task when it is sampled, returning the Profile or None.
+    """
+    if random.random() >= settings.DRONE_PROFILING_SAMPLE_RATE:
+        return None
+    return Profile(kind)
+
+
+def _dump(profiler, kind, name):
+    os.makedirs(settings.DRONE_PROFILING_CPROFILE_DIR, exist_ok=True)
+    name = re.sub(r'[^\w.-]', '_', name)
+    path = os.path.join(settings.DRONE_PROFILING_CPROFILE_DIR, f'{kind}-{name}-{time.time_ns()}.prof')
+    profiler.dump_stats(path)
+    return path
+
+
+def _record_query(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record_query(sql, time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+class ProfilingMiddleware:
+    """
+    Profile a DRONE_PROFILING_SAMPLE_RATE share of the requests, sync or async.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._is_async = iscoroutinefunction(get_response)
+        if self._is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._is_async:
+            return self.__acall__(request)
+        profile = start_profile('request')
+        if profile is None:
+            return self.get_response(request)
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            self._finish(profile, request, response)
+
+    async def __acall__(self, request):
+        profile = start_profile('request')
+        if profile is None:
+            return await self.get_response(request)
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            self._finish(profile, request, response)
+
+    def _finish(self, profile, request, response):
+        match = request.resolver_match
+        # unresolved paths share one name, so the metrics' label values stay bounded
+        profile.finish(
+            match.view_name if match else 'unresolved',
+            method=request.method,
+            status=response.status_code if response is not None else 500,
+        )
+
+
+@task_prerun.connect
+def _start_task_profile(task_id=None, **kwargs):
+    profile = start_profile('task')
+    if profile is not None:
+        _task_profiles[task_id] = profile
+
+
+@task_postrun.connect
+def _finish_task_profile(task_id=None, task=None, state=None, **kwargs):
+    profile = _task_profiles.pop(task_id, None)
+    if profile is not None:
+        profile.finish(task.name, state=state)
+
+
+def _labels(kind, name):
+    escaped = name.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'kind="{kind}",name="{escaped}"'
+
+
+def prometheus_metrics():
+    """
+    The totals of the profiles sampled by this process, in the Prometheus text format.
+    """
+    with _metrics_lock:
+        metrics = {key: {**totals, 'buckets': list(totals['buckets'])} for key, totals in _metrics.items()}
+
+    lines = [
+        '# HELP drone_profile_wall_seconds Wall time of the sampled requests and tasks.',
+        '# TYPE drone_profile_wall_seconds histogram',
+    ]
+    for (kind, name), totals in sorted(metrics.items()):
+        labels = _labels(kind, name)
+        for bound, count in zip(BUCKETS, totals['buckets']):
+            lines.append(f'drone_profile_wall_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'drone_profile_wall_seconds_bucket{{{labels},le="+Inf"}} {totals["count"]}')
+        lines.append(f'drone_profile_wall_seconds_sum{{{labels}}} {totals["wall"]:g}')
+        lines.append(f'drone_profile_wall_seconds_count{{{labels}}} {totals["count"]}')
+
+    for metric, key, help_text in (
+        ('drone_profile_queries_total', 'queries', 'Database queries of the sampled requests and tasks.'),
+        ('drone_profile_query_seconds_total', 'query_time', 'Database time of the sampled requests and tasks.'),
+    ):
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+        for (kind, name), totals in sorted(metrics.items()):
+            lines.append(f'{metric}{{{_labels(kind, name)}}} {totals[key]:g}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    with _metrics_lock:
+        _metrics.clear()
@@ -0,0 +1,232 @@
+"""
+Bulk drone registration from a JSON array, NDJSON or CSV payload.
+
+Rows are read and validated one at a time straight from the request stream (or
+the uploaded file), so the payload is never held in memory. Valid drones are
+inserted with one bulk_create per BULK_REGISTER_CHUNK_SIZE rows and only the
+rows that failed are reported. Serial numbers are checked against a single
+prefetch of the registered ones, which also catches duplicates in the payload.
+"""
+import codecs
+import csv
+import json
+from io import BytesIO
+
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import UnsupportedMediaType, ValidationError
+
+from src.drone.api.serialiazers import BulkDroneSerializer
+from src.drone.models import Drone
+
+BULK_REGISTER_CHUNK_SIZE = 1000
+READ_SIZE = 64 * 1024
+# a JSON array row that does not parse within this many characters is reported as malformed
+MAX_ROW_SIZE = 1024 * 1024
+
+
+class PayloadError(Exception):
+    """
+    The payload is malformed and can not be read any further.
+    """
+
+
+class MalformedRow(str):
+    """
+    A row that could not be parsed, the rows after it can still be read.
+    """
+
+
+def json_array_rows(stream):
+    """
+    The items of a JSON array, decoded incrementally from a binary stream.
+    """
+    decoder = json.JSONDecoder()
+    decode = codecs.getincrementaldecoder('utf-8-sig')().decode
+    buffer = ''
+    position = 0
+    eof = False
+
+    def read_more():
+        nonlocal buffer, position, eof
+        data = stream.read(READ_SIZE)
+        eof = not data
+        buffer = buffer[position:] + decode(data, final=eof)
+        position = 0
+
+    def next_char():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if eof:
+                return ''
+            read_more()
+
+    if next_char() != '[':
+        raise PayloadError('Expected a JSON array.')
+    position += 1
+    if next_char() == ']':
+        return
+
+    while True:
+        next_char()
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                if eof or len(buffer) - position > MAX_ROW_SIZE:
+                    raise PayloadError(f'Malformed JSON: {error.msg}.')
+                read_more()
+                continue
+            # a number at the end of the buffer may go on in the next read
+            if end == len(buffer) and not eof:
+                read_more()
+                continue
+            break
+        position = end
+        yield item
+
+        separator = next_char()
+        if separator == ']':
+            return
+        if separator != ',':
+            raise PayloadError('Malformed JSON: expected "," or "]" after a row.')
+        position += 1
+
+
+def ndjson_rows(stream):
+    """
+    One row per non-empty line of newline delimited JSON.
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            yield MalformedRow(f'Malformed JSON: {error}.')
+
+
+def csv_rows(stream):
+    """
+    One row per CSV record, keyed by the header. Empty cells are left out, like missing keys.
+    """
+    reader = csv.DictReader(codecs.iterdecode(stream, 'utf-8-sig'))
+    try:
+        for record in reader:
+            yield {key: value for key, value in record.items() if key is not None and value not in ('', None)}
+    except (csv.Error, UnicodeDecodeError) as error:
+        raise PayloadError(f'Malformed CSV: {error}.')
+
+
+READERS = {
+    'application/json': json_array_rows,
+    'application/x-ndjson': ndjson_rows,
+    'application/jsonl': ndjson_rows,
+    'text/csv': csv_rows,
+}
+EXTENSIONS = {
+    '.json': json_array_rows,
+    '.ndjson': ndjson_rows,
+    '.jsonl': ndjson_rows,
+    '.csv': csv_rows,
+}
+
+
+def payload_rows(request):
+    """
+    The rows of the request body, or of its multipart `file` upload, picked by content type.
+    """
+    media_type = request.content_type.split(';')[0].strip().lower()
+    if media_type != 'multipart/form-data':
+        if media_type not in READERS:
+            raise UnsupportedMediaType(media_type)
+        return READERS[media_type](request.stream or BytesIO())
+
+    upload = request.FILES.get('file')
+    if upload is None:
+        raise ValidationError({'file': ['No file was submitted.']})
+    reader = READERS.get(upload.content_type) or EXTENSIONS.get(
+        '.' + upload.name.rsplit('.', 1)[-1].lower() if '.' in upload.name else '',
+    )
+    if reader is None:
+        raise UnsupportedMediaType(upload.content_type)
+    return reader(upload)
+
+
+def _serial_number_taken_error():
+    field = Drone._meta.get_field('serial_number')
+    return field.error_messages['unique'] % {
+        'model_name': Drone._meta.verbose_name,
+        'field_label': field.verbose_name,
+    }
+
+
+def _insert(pending, errors):
+    """
+    Insert the pending (row number, drone) pairs, reporting the serial numbers
+    registered by a concurrent request since the prefetch. Returns the number inserted.
+    """
+    while pending:
+        try:
+            with transaction.atomic():
+                Drone.objects.bulk_create([drone for _, drone in pending])
+            return len(pending)
+        except IntegrityError:
+            taken = set(
+                Drone.objects
+                .filter(serial_number__in=[drone.serial_number for _, drone in pending])
+                .values_list('serial_number', flat=True)
+            )
+            if not taken:
+                raise
+            errors.extend(
+                {'row': number, 'errors': {'serial_number': [_serial_number_taken_error()]}}
+                for number, drone in pending if drone.serial_number in taken
+            )
+            pending = [(number, drone) for number, drone in pending if drone.serial_number not in taken]
+    return 0
+
+
+def register_drones(rows, chunk_size=None):
+    """
+    Validate and insert the drones of `rows`, returning the number created and the failed rows.
+    """
+    chunk_size = chunk_size or BULK_REGISTER_CHUNK_SIZE
+    serializer = BulkDroneSerializer()
+    registered = set(Drone.objects.values_list('serial_number', flat=True).iterator())
+    created = 0
+    errors = []
+    pending = []
+    number = 0
+
+    try:
+        for number, row in enumerate(rows, start=1):
+            if isinstance(row, MalformedRow):
+                errors.append({'row': number, 'errors': {'non_field_errors': [str(row)]}})
+                continue
+            try:
+                data = serializer.run_validation(row)
+            except ValidationError as error:
+                errors.append({'row': number, 'errors': error.detail})
+                continue
+
+            if data['serial_number'] in registered:
+                errors.append({'row': number, 'errors': {'serial_number': [_serial_number_taken_error()]}})
+                continue
+            registered.add(data['serial_number'])
+
+            pending.append((number, Drone(**data)))
+            if len(pending) >= chunk_size:
+                created += _insert(pending, errors)
+                pending = []
+    except PayloadError as error:
+        # the rows before the malformed one are still registered
+        errors.append({'row': number + 1, 'errors': {'non_field_errors': [str(error)]}})
+
+    created += _insert(pending, errors)
+    errors.sort(key=lambda error: error['row'])
+    return {'created': created, 'failed': len(errors), 'errors': errors}
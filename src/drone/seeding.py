@@ -0,0 +1,282 @@
+"""
+Fast seeding of the database, from fixtures or with a synthetic fleet.
+
+`load_fixture` streams a dumpdata style JSON fixture: objects are decoded one at
+a time (registration.json_array_rows), optionally filtered by model, and
+inserted with one bulk_create per `batch_size` objects of a model. A model's
+rows are only inserted after the buffered rows of the models it references, so
+the inserts run in dependency order. Like loaddata, an object whose primary key
+is taken updates the existing row, everything runs in one transaction and the
+constraints are checked at the end. Unlike loaddata no signals are sent and
+`save()` is not called, so auto_now fields are set to the seeding time; the
+drones' load counters are rebuilt for the drones the loaded medications were
+on and are now on.
+
+`generate_fleet` inserts a synthetic fleet of drones and medications.
+"""
+import bz2
+import gzip
+import random
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+
+from django.apps import apps
+from django.core import serializers
+from django.core.management.color import no_style
+from django.core.serializers.base import DeserializationError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.constants import OnConflict
+
+from src.drone import cache as drone_cache
+from src.drone.enums import DroneModel, DroneState
+from src.drone.models import Drone, Medication, actual_loads
+from src.drone.registration import PayloadError, json_array_rows
+
+SEED_BATCH_SIZE = 1000
+
+_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open}
+
+
+def open_fixture(path):
+    """
+    Open a fixture for binary reading, decompressing .gz and .bz2 files.
+    """
+    for extension, opener in _OPENERS.items():
+        if path.endswith(extension):
+            return opener(path, 'rb')
+    return open(path, 'rb')
+
+
+def model_filter(models=(), exclude=()):
+    """
+    A predicate on fixture model labels ("app_label.modelname"), selecting the
+    `models` and leaving out the `exclude`d ones. Both take app labels or model labels.
+    """
+    def matches(label, patterns):
+        app_label = label.split('.', 1)[0]
+        return label in patterns or app_label in patterns
+
+    models = {pattern.lower() for pattern in models}
+    exclude = {pattern.lower() for pattern in exclude}
+    return lambda label: (not models or matches(label, models)) and not matches(label, exclude)
+
+
+def _dependencies(model):
+    return {
+        field.related_model._meta.concrete_model
+        for field in model._meta.concrete_fields
+        if field.is_relation and field.related_model is not None
+        and field.related_model._meta.concrete_model is not model
+    }
+
+
+class _Loader:
+    """
+    Buffers the deserialized objects per model and bulk inserts them.
+    """
+
+    def __init__(self, using, batch_size):
+        self.using = using
+        self.batch_size = batch_size
+        self.pending = defaultdict(list)
+        self.counts = defaultdict(int)
+        self.loaded_drone_ids = set()
+
+    def add(self, deserialized):
+        instance = deserialized.object
+        model = instance._meta.concrete_model
+        self.pending[model].append(deserialized)
+        if len(self.pending[model]) >= self.batch_size:
+            self.flush(model)
+
+    def flush(self, model, flushing=()):
+        """
+        Insert the buffered rows of `model`, after those of the models it references.
+        """
+        flushing = {*flushing, model}
+        for dependency in _dependencies(model) - flushing:
+            if self.pending.get(dependency):
+                self.flush(dependency, flushing)
+
+        objects = self.pending.pop(model, [])
+        if not objects:
+            return
+        if model is Medication:
+            # an updated medication may leave the drone it was on
+            pks = [deserialized.object.pk for deserialized in objects if deserialized.object.pk is not None]
+            if pks:
+                self.loaded_drone_ids.update(
+                    model._base_manager.using(self.using)
+                    .filter(pk__in=pks, drone__isnull=False)
+                    .values_list('drone_id', flat=True)
+                )
+        if model._meta.parents:
+            # bulk_create can not insert multi-table inherited models
+            for deserialized in objects:
+                deserialized.save(using=self.using)
+        else:
+            self._bulk_insert(model, objects)
+
+        if model is Medication:
+            self.loaded_drone_ids.update(
+                deserialized.object.drone_id for deserialized in objects if deserialized.object.drone_id
+            )
+        self.counts[model._meta.label_lower] += len(objects)
+
+    def flush_all(self):
+        while self.pending:
+            self.flush(next(iter(self.pending)))
+
+    def _bulk_insert(self, model, objects):
+        manager = model._base_manager.using(self.using)
+        with_pk = [deserialized.object for deserialized in objects if deserialized.object.pk is not None]
+        without_pk = [deserialized.object for deserialized in objects if deserialized.object.pk is None]
+
+        if with_pk:
+            update_fields = [
+                field.name for field in model._meta.concrete_fields if not field.primary_key
+            ]
+            if update_fields and connections[self.using].features.supports_update_conflicts_with_target:
+                manager.bulk_create(
+                    with_pk, update_conflicts=True, unique_fields=[model._meta.pk.name], update_fields=update_fields,
+                )
+            else:
+                manager.bulk_create(with_pk, ignore_conflicts=True)
+        if without_pk:
+            manager.bulk_create(without_pk)
+
+        for deserialized in objects:
+            for name, values in (deserialized.m2m_data or {}).items():
+                if values:
+                    getattr(deserialized.object, name).set(values)
+
+
+def load_fixture(stream, selected=None, using=DEFAULT_DB_ALIAS, batch_size=None):
+    """
+    Load a JSON fixture from a binary stream, returning the number of objects loaded per model label.
+    """
+    loader = _Loader(using, batch_size or SEED_BATCH_SIZE)
+    rows = json_array_rows(stream)
+    if selected is not None:
+        rows = (row for row in rows if selected(str(row.get('model', '')).lower()))
+
+    connection = connections[using]
+    with transaction.atomic(using=using):
+        with connection.constraint_checks_disabled():
+            try:
+                for deserialized in serializers.deserialize('python', rows, using=using, ignorenonexistent=True):
+                    loader.add(deserialized)
+            except PayloadError as error:
+                raise DeserializationError(str(error))
+            loader.flush_all()
+
+        models = [apps.get_model(label) for label in loader.counts]
+        if models:
+            connection.check_constraints(table_names=[model._meta.db_table for model in models])
+            with connection.cursor() as cursor:
+                for statement in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(statement)
+        if loader.loaded_drone_ids:
+            _rebuild_load_counters(loader.loaded_drone_ids, using)
+
+    drone_cache.clear()
+    return dict(loader.counts)
+
+
+def _rebuild_load_counters(drone_ids, using):
+    loads = actual_loads()
+    Drone.objects.using(using).filter(pk__in=drone_ids).update(
+        loaded_weight=loads['actual_weight'], loaded_count=loads['actual_count'],
+    )
+
+
+def _insert_generated(model, rows, using, batch_size):
+    """
+    Insert the {field name: value} `rows` with executemany, skipping the rows
+    whose unique values already exist. Missing fields take their default.
+    Non-unique values are prepared for the database once per distinct value, the
+    generated ones mostly repeat, which makes this several times faster than bulk_create.
+    """
+    connection = connections[using]
+    ops = connection.ops
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    template = model()
+    defaults = [field.get_db_prep_save(field.pre_save(template, add=True), connection) for field in fields]
+    prepared = {field.name: {} for field in fields if not field.unique}
+
+    def prepare(field, value):
+        cache = prepared.get(field.name)
+        if cache is None:
+            return field.get_db_prep_save(value, connection)
+        if value not in cache:
+            cache[value] = field.get_db_prep_save(value, connection)
+        return cache[value]
+
+    sql = ' '.join(filter(None, (
+        ops.insert_statement(on_conflict=OnConflict.IGNORE),
+        f'{ops.quote_name(model._meta.db_table)} ({", ".join(ops.quote_name(field.column) for field in fields)})',
+        f'VALUES ({", ".join(["%s"] * len(fields))})',
+        ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None),
+    )))
+    rows = iter(rows)
+    with connection.cursor() as cursor:
+        while batch := list(islice(rows, batch_size)):
+            cursor.executemany(sql, [
+                [
+                    prepare(field, row[field.name]) if field.name in row else default
+                    for field, default in zip(fields, defaults)
+                ]
+                for row in batch
+            ])
+
+
+def generate_fleet(drones, medications, prefix='SEED', using=DEFAULT_DB_ALIAS, batch_size=None, seed=None):
+    """
+    Insert `drones` idle drones and `medications` unassigned medications with
+    random models, limits and weights. Serial numbers and codes start with
+    `prefix`, rows that already exist are skipped. Returns the number created of each.
+    """
+    batch_size = batch_size or SEED_BATCH_SIZE
+    rng = random.Random(seed)
+    drone_models = list(DroneModel)
+    drone_manager = Drone.objects.using(using)
+    medication_manager = Medication.objects.using(using)
+
+    drones_before = drone_manager.count()
+    medications_before = medication_manager.count()
+    with transaction.atomic(using=using):
+        _insert_generated(
+            Drone,
+            (
+                {
+                    'serial_number': f'{prefix}{i:08d}',
+                    'drone_model': rng.choice(drone_models),
+                    'weight_limit': Decimal(rng.randrange(100, 501, 50)),
+                    'battery_capacity': Decimal(rng.randrange(250, 1001)) / 10,
+                    'state': DroneState.IDLE,
+                }
+                for i in range(drones)
+            ),
+            using,
+            batch_size,
+        )
+        _insert_generated(
+            Medication,
+            (
+                {
+                    'name': f'{prefix}-Medication-{i}',
+                    'weight': Decimal(rng.randrange(10, 201, 5)),
+                    'code': f'{prefix}_{i:08d}',
+                }
+                for i in range(medications)
+            ),
+            using,
+            batch_size,
+        )
+
+    drone_cache.clear()
+    return {
+        'drones': drone_manager.count() - drones_before,
+        'medications': medication_manager.count() - medications_before,
+    }
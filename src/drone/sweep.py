@@ -0,0 +1,139 @@
+"""
+Battery sweep: log every drone's projected battery level.
+
+A sweep is split into shards of consecutive drone ids. Each shard is applied
+in one transaction together with its DroneBatterySweepShard row, so shards can
+run in parallel on separate Celery workers and a retried shard is a no-op. Once
+every shard is applied the sweep's totals are recorded on its DroneBatterySweep.
+
+Levels are projected in the database (see `src.drone.battery`), so a sweep
+never writes to the drones. A full sweep logs every drone, an incremental one
+(DRONE_BATTERY_SWEEP_INCREMENTAL) only logs a level that moved by at least
+DRONE_BATTERY_LOG_DELTA since the drone's last logged level.
+"""
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Min, OuterRef, Subquery, Sum
+from django.utils.timezone import now
+
+from src.drone.battery import projected_battery_expression
+from src.drone.models import Drone, DroneBatteryLogHistory, DroneBatterySweep, DroneBatterySweepShard
+
+logger = logging.getLogger(__name__)
+
+
+def start_sweep(shard_size=None, incremental=None):
+    """
+    Record a new sweep and return it with its (first_id, last_id) shards.
+    """
+    shard_size = shard_size or settings.DRONE_BATTERY_SWEEP_SHARD_SIZE
+    if incremental is None:
+        incremental = settings.DRONE_BATTERY_SWEEP_INCREMENTAL
+    bounds = Drone.objects.aggregate(first=Min('id'), last=Max('id'))
+    shards = []
+    if bounds['first'] is not None:
+        shards = [
+            (first_id, min(first_id + shard_size - 1, bounds['last']))
+            for first_id in range(bounds['first'], bounds['last'] + 1, shard_size)
+        ]
+    sweep = DroneBatterySweep.objects.create(
+        started_at=now(), shard_size=shard_size, shard_count=len(shards), incremental=incremental,
+    )
+    return sweep, shards
+
+
+def sweep_shard(sweep_id, first_id, last_id, chunk_size=None):
+    """
+    Log the battery of the drones with ids in [first_id, last_id] as projected
+    at the sweep's start, one chunk of drones per query and insert.
+    """
+    chunk_size = chunk_size or settings.DRONE_BATTERY_SWEEP_CHUNK_SIZE
+    swept_at, incremental = (
+        DroneBatterySweep.objects.values_list('started_at', 'incremental').get(pk=sweep_id)
+    )
+    drones = (
+        Drone.objects
+        .filter(id__lte=last_id)
+        .annotate(projected_battery=projected_battery_expression(swept_at))
+        .order_by('id')
+    )
+    fields = ['id', 'projected_battery']
+    if incremental:
+        drones = drones.annotate(last_logged_battery=Subquery(
+            DroneBatteryLogHistory.objects
+            .filter(drone=OuterRef('pk'))
+            .order_by('-created_at')
+            .values('battery_capacity')[:1]
+        ))
+        fields.append('last_logged_battery')
+    delta = settings.DRONE_BATTERY_LOG_DELTA
+    swept = 0
+    history_rows = 0
+
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                shard = DroneBatterySweepShard.objects.create(sweep_id=sweep_id, first_id=first_id, last_id=last_id)
+        except IntegrityError:
+            logger.info('Battery sweep %s shard %s-%s already applied', sweep_id, first_id, last_id)
+            return {'drones': 0, 'history_rows': 0, 'skipped': True}
+
+        last_id_seen = first_id - 1
+        while True:
+            chunk = list(drones.filter(id__gt=last_id_seen).values_list(*fields)[:chunk_size])
+            if not chunk:
+                break
+
+            logs = [
+                DroneBatteryLogHistory(drone_id=row[0], battery_capacity=row[1])
+                for row in chunk
+                if not incremental or row[2] is None or abs(row[1] - row[2]) >= delta
+            ]
+            if logs:
+                DroneBatteryLogHistory.objects.bulk_create(logs)
+            swept += len(chunk)
+            history_rows += len(logs)
+            last_id_seen = chunk[-1][0]
+
+        shard.drones = swept
+        shard.history_rows = history_rows
+        shard.save(update_fields=['drones', 'history_rows'])
+
+    return {'drones': shard.drones, 'history_rows': shard.history_rows, 'skipped': False}
+
+
+def finish_sweep(sweep_id):
+    """
+    Record the totals of the sweep's applied shards and return them.
+    """
+    totals = DroneBatterySweepShard.objects.filter(sweep_id=sweep_id).aggregate(
+        drones=Sum('drones'), history_rows=Sum('history_rows'),
+    )
+    sweep = DroneBatterySweep.objects.get(pk=sweep_id)
+    sweep.finished_at = now()
+    sweep.drones = totals['drones'] or 0
+    sweep.history_rows = totals['history_rows'] or 0
+    sweep.duration_seconds = round((sweep.finished_at - sweep.started_at).total_seconds(), 3)
+    sweep.save(update_fields=['finished_at', 'drones', 'history_rows', 'duration_seconds'])
+
+    stats = {
+        'sweep': sweep.id,
+        'shards': sweep.shard_count,
+        'drones': sweep.drones,
+        'history_rows': sweep.history_rows,
+        'duration_seconds': sweep.duration_seconds,
+    }
+    logger.info('Battery sweep finished: %s', stats)
+    return stats
+
+
+def sweep_drone_battery_levels(chunk_size=None, shard_size=None, incremental=None):
+    """
+    Run a whole sweep in this process, one shard after the other.
+    """
+    sweep, shards = start_sweep(shard_size, incremental)
+    for first_id, last_id in shards:
+        sweep_shard(sweep.id, first_id, last_id, chunk_size)
+    return finish_sweep(sweep.id)
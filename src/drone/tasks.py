@@ -1,24 +1,52 @@
-from celery import shared_task
+from celery import chord, shared_task
+from django.db import OperationalError
+from django.dispatch import receiver
 
-from src.drone.api.views import calculate_battery_depletion
-from .models import Drone, DroneBatteryLogHistory
+from src.drone import images
+from src.drone.history import compact_battery_history
+from src.drone.models import image_uploaded
+from src.drone.sweep import finish_sweep, start_sweep, sweep_shard
 
 
 @shared_task
-def log_drone_battery_levels():
-    drones = Drone.objects.all()
-    for drone in drones:
-        if drone.battery_capacity <= calculate_battery_depletion(drone):
-            drone.battery_capacity = 0
-            drone.save()
-        else:
-            print(drone.battery_capacity)
-            print(calculate_battery_depletion(drone))
-
-            drone.battery_capacity -= calculate_battery_depletion(drone)
-            drone.save()
-
-        DroneBatteryLogHistory.objects.create(
-            drone=drone,
-            battery_capacity=drone.battery_capacity,
-        )
+def log_drone_battery_levels(chunk_size=None, shard_size=None, incremental=None):
+    """
+    Fan the battery sweep out as a chord: one task per shard of drone ids, then
+    a task recording the totals once every shard is applied.
+    """
+    sweep, shards = start_sweep(shard_size, incremental)
+    if not shards:
+        return finish_sweep(sweep.id)
+
+    chord(
+        sweep_battery_shard.s(sweep.id, first_id, last_id, chunk_size)
+        for first_id, last_id in shards
+    )(finish_battery_sweep.si(sweep.id))
+    return {'sweep': sweep.id, 'shards': len(shards)}
+
+
+# late acks put the shard back on the queue if its worker dies, the shard's
+# idempotency key makes the redelivery (or a retry) a no-op once it is applied
+@shared_task(acks_late=True, autoretry_for=(OperationalError,), retry_backoff=True, max_retries=5)
+def sweep_battery_shard(sweep_id, first_id, last_id, chunk_size=None):
+    return sweep_shard(sweep_id, first_id, last_id, chunk_size)
+
+
+@shared_task
+def finish_battery_sweep(sweep_id):
+    return finish_sweep(sweep_id)
+
+
+@shared_task
+def compact_drone_battery_history():
+    return compact_battery_history()
+
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=5)
+def process_medication_image(medication_id):
+    return images.process_medication_image(medication_id)
+
+
+@receiver(image_uploaded)
+def _queue_image_processing(sender, medication_id, **kwargs):
+    process_medication_image.delay(medication_id)
@@ -1,15 +1,61 @@
-from datetime import timedelta
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock
+from zoneinfo import ZoneInfo
 from decimal import Decimal
+from django.apps import apps
+from django.contrib.auth.models import User
 from django.utils import timezone
 
-from src.drone.enums import DroneState
-from src.drone.api.views import calculate_battery_depletion
-
-from .models import Drone, Medication
+from src.drone.enums import BatteryRollupPeriod, DroneModel, DroneState
+from src.drone.battery import battery_depletion
+from src.drone import benchmarks
+from src.drone import cache as drone_cache
+from src.drone import profiling
+from src.drone import images
+from src.drone.media import serve_media
+from src.drone import registration
+from src.drone import seeding
+from src.drone.battery import projected_battery_expression
+from src.drone.history import battery_history, compact_battery_history
+from src.drone.transitions import TransitionError, transition_drone
+from src.drone.api import renderers as drone_renderers
+from src.drone.api.renderers import FastJSONParser, FastJSONRenderer
+from src.drone.api.serialiazers import (
+    DroneSerializer, FastDroneSerializer, FastMedicationSerializer, MedicationSerializer,
+)
+from src.drone.sweep import start_sweep, sweep_drone_battery_levels, sweep_shard
+from src.drone.tasks import compact_drone_battery_history, log_drone_battery_levels
+
+from .models import (
+    Drone, DroneBatteryLogHistory, DroneBatteryLogRollup, DroneBatterySweep, DroneBatterySweepShard, Medication,
+)
 from rest_framework.test import APITestCase, APIClient
+from django_celery_beat.models import PeriodicTask
+from PIL import Image
+from asgiref.sync import sync_to_async
+from celery import current_app
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.http import Http404
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.urls import reverse
 from django.urls import get_resolver
 from rest_framework import status
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from django.utils.translation import gettext_lazy
 
 
 # def print_urls():
@@ -85,12 +131,22 @@ class TestDroneAPIAndCalculateBatteryDepletion(APITestCase):
         self.med2.drone = self.drone_1
         self.med2.save()
 
-        result = calculate_battery_depletion(self.drone_1)
+        result = battery_depletion(self.drone_1.loaded_weight, self.drone_1.last_time_updated)
 
         expected_result = Decimal(1.56)
 
         self.assertAlmostEqual(result, expected_result)
     
+    def test_check_available_drone_api_excludes_projected_low_battery(self):
+        self.drone_2.battery_capacity = 26
+        self.drone_2.last_time_updated = timezone.now() - timedelta(hours=12)
+        self.drone_2.save()
+
+        url = reverse('drones-check-available-drones')
+        response = self.client.get(url, format='json')
+
+        self.assertEqual([drone['id'] for drone in response.data['available_drones']], [self.drone_1.id])
+
     def test_can_not_load_medication_that_exceed_drone_weight_limit(self):
 
         url = reverse('drones-load-medications', kwargs={'pk': self.drone_4.pk})
@@ -154,12 +210,135 @@ class TestDroneAPIAndCalculateBatteryDepletion(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['drone']['state'], DroneState.LOADED.value)
 
+    def test_load_medication_api_rejects_missing_ids_without_partial_load(self):
+        url = reverse('drones-load-medications', kwargs={'pk': self.drone_1.pk})
+
+        self.drone_1.state = DroneState.LOADING
+        self.drone_1.save()
+
+        data = {
+            'medication_ids': [self.med1.id, 9998, 9999]
+        }
+
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(str(response.data['medication_ids'][0]), 'Medications not found: 9998, 9999')
+        self.med1.refresh_from_db()
+        self.assertIsNone(self.med1.drone_id)
+
+    def test_load_medication_api_query_count_does_not_grow_with_medications(self):
+        meds = [
+            Medication.objects.create(name=f'Bulk{i}', weight=1, code=f'codexBulk{i}')
+            for i in range(50)
+        ]
+        url = reverse('drones-load-medications', kwargs={'pk': self.drone_1.pk})
+
+        self.drone_1.state = DroneState.LOADING
+        self.drone_1.save()
+
+        # savepoint, drone lock, medications lock, attach, drone update, release, loaded medications
+        with self.assertNumQueries(7):
+            response = self.client.post(url, {'medication_ids': [med.id for med in meds]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['medications']), 50)
+        self.drone_1.refresh_from_db()
+        self.assertEqual((self.drone_1.loaded_weight, self.drone_1.loaded_count), (Decimal('50.0'), 50))
+
+    def test_bulk_load_medication_api(self):
+        url = reverse('drones-bulk-load-medications')
+
+        self.drone_1.state = DroneState.LOADING
+        self.drone_1.save()
+
+        data = {
+            'loads': [
+                {'drone_id': self.drone_1.id, 'medication_ids': [self.med1.id]},
+                {'drone_id': self.drone_2.id, 'medication_ids': [self.med2.id]},
+                {'drone_id': 9999, 'medication_ids': []},
+            ]
+        }
+
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertTrue(results[0]['loaded'])
+        self.assertEqual(results[0]['state'], DroneState.LOADED.value)
+        self.assertFalse(results[1]['loaded'])
+        self.assertEqual(str(results[1]['errors']['non_field_errors'][0]), 'Not valid state to load medication.')
+        self.assertFalse(results[2]['loaded'])
+        self.assertEqual(results[2]['errors'], {'drone_id': ['Drone not found.']})
+
+        self.med1.refresh_from_db()
+        self.med2.refresh_from_db()
+        self.assertEqual(self.med1.drone_id, self.drone_1.id)
+        self.assertIsNone(self.med2.drone_id)
+
+    def test_bulk_load_medication_api_rejects_medication_on_two_drones(self):
+        url = reverse('drones-bulk-load-medications')
+
+        data = {
+            'loads': [
+                {'drone_id': self.drone_1.id, 'medication_ids': [self.med1.id]},
+                {'drone_id': self.drone_2.id, 'medication_ids': [self.med1.id]},
+            ]
+        }
+
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_check_available_drone_api(self):
         url = reverse('drones-check-available-drones')
         response = self.client.get(url, format='json')
         expected_result = 2
         self.assertEqual(len(response.data['available_drones']), expected_result)
 
+    def test_check_available_drone_api_cursor_pagination(self):
+        url = reverse('drones-check-available-drones')
+
+        response = self.client.get(url, {'limit': 1})
+        self.assertEqual([drone['id'] for drone in response.data['available_drones']], [self.drone_1.id])
+        self.assertEqual(response.data['next_cursor'], self.drone_1.id)
+
+        response = self.client.get(url, {'limit': 1, 'cursor': response.data['next_cursor']})
+        self.assertEqual([drone['id'] for drone in response.data['available_drones']], [self.drone_2.id])
+
+        response = self.client.get(url, {'limit': 1, 'cursor': response.data['next_cursor']})
+        self.assertEqual(response.data['available_drones'], [])
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_check_available_drone_api_filters(self):
+        self.drone_2.drone_model = DroneModel.HEAVYWEIGHT
+        self.drone_2.weight_limit = 100
+        self.drone_2.save()
+        url = reverse('drones-check-available-drones')
+
+        response = self.client.get(url, {'drone_model': DroneModel.HEAVYWEIGHT.value})
+        self.assertEqual([drone['id'] for drone in response.data['available_drones']], [self.drone_2.id])
+
+        response = self.client.get(url, {'min_weight_limit': 200})
+        self.assertEqual([drone['id'] for drone in response.data['available_drones']], [self.drone_1.id])
+
+        response = self.client.get(url, {'drone_model': 'Featherweight'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_check_available_drone_api_streaming(self):
+        url = reverse('drones-check-available-drones')
+
+        response = self.client.get(url, {'stream': 'true'})
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        drones = [json.loads(line) for line in lines]
+        self.assertEqual([drone['id'] for drone in drones], [self.drone_1.id, self.drone_2.id])
+        self.assertEqual(drones[0]['battery_capacity'], '100.0')
+
+        response = self.client.get(url, {'stream': 'true', 'limit': 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_check_loaded_medications_api(self):
         # Load medications to drone
         self.med1.drone = self.drone_1
@@ -304,3 +483,1303 @@ class TestDroneAPIAndCalculateBatteryDepletion(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['message'], 'Drone set to returning')
         self.assertEqual(response.data['drone']['state'], DroneState.RETURNING.value)
+
+
+class TestBatterySweep(TestCase):
+    def setUp(self):
+        self.drones = [
+            Drone.objects.create(serial_number=f'sweep{i}', weight_limit=500.0, battery_capacity=100)
+            for i in range(5)
+        ]
+        self.empty_drone = Drone.objects.create(serial_number='sweep_empty', weight_limit=500.0, battery_capacity=1)
+
+        Medication.objects.create(name='Med1', weight=100, code='sweepMed1', drone=self.drones[0])
+        Medication.objects.create(name='Med2', weight=200, code='sweepMed2', drone=self.drones[0])
+
+    def test_sweep_logs_projected_battery_of_every_drone(self):
+        """
+        # drone with 300g loaded: 100 - 300 * 0.005 = 98.5
+        # drones without medications and no last update keep their battery
+        """
+        stats = sweep_drone_battery_levels(chunk_size=2)
+
+        self.assertEqual(stats['drones'], 6)
+        self.assertEqual(stats['history_rows'], 6)
+        self.assertEqual(DroneBatteryLogHistory.objects.get(drone=self.drones[0]).battery_capacity, Decimal('98.5'))
+        self.assertEqual(DroneBatteryLogHistory.objects.get(drone=self.drones[1]).battery_capacity, Decimal('100.0'))
+        # nothing is decremented, reads project from the stored battery
+        self.drones[0].refresh_from_db()
+        self.assertEqual(self.drones[0].battery_capacity, Decimal('100.0'))
+
+    def test_sweep_does_not_go_below_zero(self):
+        Medication.objects.create(name='Med3', weight=400, code='sweepMed3', drone=self.empty_drone)
+
+        sweep_drone_battery_levels()
+
+        self.assertEqual(DroneBatteryLogHistory.objects.get(drone=self.empty_drone).battery_capacity, 0)
+
+    def test_sweep_query_count_does_not_grow_with_fleet(self):
+        # sweep start and finish: 2 + 3, shard key and counts: 7,
+        # per chunk: one read and one log insert, plus the final empty read
+        with self.assertNumQueries(2 + 3 + 7 + 3 * 2 + 1):
+            sweep_drone_battery_levels(chunk_size=2)
+
+    def test_shards_cover_the_fleet_and_record_totals(self):
+        stats = sweep_drone_battery_levels(shard_size=4)
+
+        self.assertEqual(stats['shards'], 2)
+        self.assertEqual(stats['drones'], 6)
+        sweep = DroneBatterySweep.objects.get(pk=stats['sweep'])
+        self.assertEqual(sweep.history_rows, 6)
+        self.assertIsNotNone(sweep.finished_at)
+
+    def test_retried_shard_is_not_applied_twice(self):
+        sweep, shards = start_sweep()
+        first_id, last_id = shards[0]
+
+        self.assertFalse(sweep_shard(sweep.id, first_id, last_id)['skipped'])
+        self.assertTrue(sweep_shard(sweep.id, first_id, last_id)['skipped'])
+
+        self.assertEqual(DroneBatteryLogHistory.objects.count(), 6)
+
+    def test_task_fans_out_shards_as_a_chord(self):
+        # run the chord in-process instead of on workers
+        current_app.conf.task_always_eager = True
+        self.addCleanup(setattr, current_app.conf, 'task_always_eager', False)
+
+        log_drone_battery_levels(shard_size=2)
+
+        sweep = DroneBatterySweep.objects.get()
+        self.assertEqual(sweep.shard_count, 3)
+        self.assertEqual(sweep.shards.count(), 3)
+        self.assertEqual(sweep.drones, 6)
+
+
+class TestIncrementalBatterySweep(TestCase):
+    def setUp(self):
+        self.idle = [
+            Drone.objects.create(serial_number=f'incremental{i}', weight_limit=500.0, battery_capacity=100)
+            for i in range(4)
+        ]
+        self.loaded = Drone.objects.create(serial_number='incremental_loaded', weight_limit=500.0, battery_capacity=100)
+        Drone.objects.filter(pk=self.loaded.pk).update(last_time_updated=timezone.now() - timedelta(minutes=250))
+        Medication.objects.create(name='Med1', weight=300, code='incrementalMed1', drone=self.loaded)
+
+    def test_first_sweep_logs_every_drone(self):
+        """
+        # 250 minutes since the last update with 300g loaded: 100 - 250 * 0.002 - 300 * 0.005 = 98
+        """
+        stats = sweep_drone_battery_levels(incremental=True)
+
+        self.assertEqual((stats['drones'], stats['history_rows']), (5, 5))
+        self.assertEqual(DroneBatteryLogHistory.objects.get(drone=self.loaded).battery_capacity, Decimal('98.0'))
+
+    def test_unchanged_levels_are_not_logged_again(self):
+        first = sweep_drone_battery_levels(incremental=True)
+        second = sweep_drone_battery_levels(incremental=True)
+
+        self.assertEqual(first['history_rows'], 5)
+        self.assertEqual((second['drones'], second['history_rows']), (5, 0))
+
+    def test_level_is_logged_once_it_moves_by_the_delta(self):
+        drone = self.idle[0]
+        DroneBatteryLogHistory.objects.create(drone=drone, battery_capacity=100)
+        # 250 minutes idle: 100 - 250 * 0.002 = 99.5
+        Drone.objects.filter(pk=drone.pk).update(last_time_updated=timezone.now() - timedelta(minutes=250))
+
+        sweep_drone_battery_levels(incremental=True)
+        self.assertEqual(DroneBatteryLogHistory.objects.filter(drone=drone).count(), 1)
+
+        with self.settings(DRONE_BATTERY_LOG_DELTA=Decimal('0.5')):
+            sweep_drone_battery_levels(incremental=True)
+        self.assertEqual(DroneBatteryLogHistory.objects.filter(drone=drone).latest('id').battery_capacity, Decimal('99.5'))
+        # the stored battery is left for reads to project from
+        drone.refresh_from_db()
+        self.assertEqual(drone.battery_capacity, 100)
+
+
+
+class TestBatteryProjection(APITestCase):
+    def setUp(self):
+        self.drone = Drone.objects.create(
+            serial_number='projection1', weight_limit=500.0, battery_capacity=100,
+            last_time_updated=timezone.now() - timedelta(minutes=250),
+        )
+        self.med = Medication.objects.create(name='Med1', weight=300, code='projectionMed1', drone=self.drone)
+        self.drone.refresh_from_db()
+
+    def test_database_projection_matches_python(self):
+        at = timezone.now()
+
+        projected = (
+            Drone.objects
+            .annotate(projected_battery=projected_battery_expression(at))
+            .values_list('projected_battery', flat=True)
+            .get(pk=self.drone.pk)
+        )
+
+        self.assertEqual(projected, self.drone.projected_battery(at))
+        self.assertEqual(projected, Decimal('98.0'))
+
+    def test_half_tenths_round_up_like_the_database(self):
+        drone = Drone.objects.create(
+            serial_number='projection2', weight_limit=500.0, battery_capacity=Decimal('50.5'), loaded_weight=50,
+        )
+
+        projected = (
+            Drone.objects
+            .annotate(projected_battery=projected_battery_expression())
+            .values_list('projected_battery', flat=True)
+            .get(pk=drone.pk)
+        )
+
+        # 50.5 - 50g * 0.005 = 50.25
+        self.assertEqual(drone.projected_battery(), Decimal('50.3'))
+        self.assertEqual(projected, drone.projected_battery())
+
+    def test_unloading_keeps_the_charge_of_the_carried_weight(self):
+        at = timezone.now()
+        before = self.drone.projected_battery(at)
+        Drone.objects.filter(pk=self.drone.pk).update(state=DroneState.DELIVERING)
+
+        transition_drone(self.drone.pk, DroneState.DELIVERED)
+
+        self.drone.refresh_from_db()
+        self.assertEqual(self.drone.loaded_weight, 0)
+        self.assertEqual(self.drone.projected_battery(at), before)
+
+    def test_loading_rebases_without_charging_the_load_twice(self):
+        other = Medication.objects.create(name='Med2', weight=100, code='projectionMed2')
+        Drone.objects.filter(pk=self.drone.pk).update(state=DroneState.LOADING)
+        url = reverse('drones-load-medications', kwargs={'pk': self.drone.pk})
+
+        self.client.post(url, {'medication_ids': [self.med.id, other.id]}, format='json')
+
+        self.drone.refresh_from_db()
+        # 250 minutes folded into the stored battery, the 400g are charged by the projection
+        self.assertEqual(self.drone.battery_capacity, Decimal('99.5'))
+        self.assertEqual(self.drone.projected_battery(), Decimal('97.5'))
+
+    def test_loading_state_needs_projected_battery(self):
+        Drone.objects.filter(pk=self.drone.pk).update(battery_capacity=26)
+
+        with self.assertRaisesMessage(TransitionError, 'Can not load medication, battery capacity is low.'):
+            transition_drone(self.drone.pk, DroneState.LOADING)
+
+
+class TestDroneLoadCounters(TestCase):
+    def setUp(self):
+        self.drone = Drone.objects.create(serial_number='counter1', weight_limit=500.0, battery_capacity=100)
+        self.other_drone = Drone.objects.create(serial_number='counter2', weight_limit=500.0, battery_capacity=100)
+        self.med1 = Medication.objects.create(name='Med1', weight=100, code='counterMed1')
+        self.med2 = Medication.objects.create(name='Med2', weight=50.5, code='counterMed2')
+
+    def test_counters_follow_medication_attach_move_and_detach(self):
+        self.med1.drone = self.drone
+        self.med1.save()
+        self.med2.drone = self.drone
+        self.med2.save()
+        self.assertEqual((self.drone.loaded_weight, self.drone.loaded_count), (Decimal('150.5'), 2))
+
+        med2 = Medication.objects.get(pk=self.med2.pk)
+        med2.drone = self.other_drone
+        med2.save()
+        self.med1.delete()
+
+        self.drone.refresh_from_db()
+        self.other_drone.refresh_from_db()
+        self.assertEqual((self.drone.loaded_weight, self.drone.loaded_count), (0, 0))
+        self.assertEqual((self.other_drone.loaded_weight, self.other_drone.loaded_count), (Decimal('50.5'), 1))
+
+    def test_reweigh_on_the_same_drone_adjusts_the_weight_only(self):
+        self.med1.drone = self.drone
+        self.med1.save()
+
+        self.med1.weight = 80
+        self.med1.save()
+
+        self.drone.refresh_from_db()
+        self.assertEqual((self.drone.loaded_weight, self.drone.loaded_count), (Decimal('80.0'), 1))
+        # nothing was taken off, so nothing is charged to the stored battery
+        self.assertEqual(self.drone.battery_capacity, Decimal('100.0'))
+
+    def test_deferred_fields_are_read_before_adjusting_counters(self):
+        self.med1.drone = self.drone
+        self.med1.save()
+
+        renamed = Medication.objects.only('id', 'name').get(pk=self.med1.pk)
+        renamed.name = 'Renamed'
+        renamed.save()
+        self.drone.refresh_from_db()
+        self.assertEqual((self.drone.loaded_weight, self.drone.loaded_count), (Decimal('100.0'), 1))
+
+        moved = Medication.objects.defer('weight').get(pk=self.med1.pk)
+        moved.drone = self.other_drone
+        moved.save()
+        self.drone.refresh_from_db()
+        self.other_drone.refresh_from_db()
+        self.assertEqual((self.drone.loaded_weight, self.drone.loaded_count), (0, 0))
+        self.assertEqual((self.other_drone.loaded_weight, self.other_drone.loaded_count), (Decimal('100.0'), 1))
+
+        Medication.objects.only('id').get(pk=self.med1.pk).delete()
+        self.other_drone.refresh_from_db()
+        self.assertEqual((self.other_drone.loaded_weight, self.other_drone.loaded_count), (0, 0))
+
+    def test_rebuild_drone_load_counters_command(self):
+        self.med1.drone = self.drone
+        self.med1.save()
+        Drone.objects.filter(pk=self.drone.pk).update(loaded_weight=0, loaded_count=0)
+
+        drone_cache.clear()
+        self.assertEqual(drone_cache.get_drone(self.drone.pk).loaded_count, 0)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_drone_load_counters', '--check', stdout=StringIO())
+
+        call_command('rebuild_drone_load_counters', stdout=StringIO())
+        call_command('rebuild_drone_load_counters', '--check', stdout=StringIO())
+
+        self.drone.refresh_from_db()
+        self.assertEqual((self.drone.loaded_weight, self.drone.loaded_count), (Decimal('100.0'), 1))
+        self.assertEqual(drone_cache.get_drone(self.drone.pk).loaded_count, 1)
+
+
+class TestBatteryHistoryCompaction(TestCase):
+    def setUp(self):
+        self.drone = Drone.objects.create(serial_number='history1', weight_limit=500.0, battery_capacity=100)
+        self.now = timezone.localtime().replace(minute=30, second=0, microsecond=0)
+
+    def _log(self, battery_capacity, at):
+        log = DroneBatteryLogHistory.objects.create(drone=self.drone, battery_capacity=battery_capacity)
+        DroneBatteryLogHistory.objects.filter(pk=log.pk).update(created_at=at)
+
+    def test_old_samples_are_rolled_up_and_purged(self):
+        ten_days_ago = self.now - timedelta(days=10)
+        self._log(90, ten_days_ago)
+        self._log(80, ten_days_ago + timedelta(minutes=10))
+        self._log(70, ten_days_ago + timedelta(hours=1))
+        self._log(60, self.now - timedelta(hours=2))
+
+        stats = compact_battery_history(at=self.now)
+
+        self.assertEqual(stats['raw_purged'], 3)
+        self.assertEqual(DroneBatteryLogHistory.objects.count(), 1)
+
+        hourly = DroneBatteryLogRollup.objects.filter(period=BatteryRollupPeriod.HOUR).order_by('bucket_start')
+        self.assertEqual(
+            [(rollup.min_battery, rollup.avg_battery, rollup.max_battery, rollup.sample_count) for rollup in hourly],
+            [(80, 85, 90, 2), (70, 70, 70, 1), (60, 60, 60, 1)],
+        )
+        daily = DroneBatteryLogRollup.objects.get(
+            period=BatteryRollupPeriod.DAY, bucket_start=ten_days_ago.replace(hour=0, minute=0),
+        )
+        self.assertEqual((daily.min_battery, daily.avg_battery, daily.max_battery, daily.sample_count), (70, 80, 90, 3))
+
+    def test_compaction_is_idempotent(self):
+        self._log(90, self.now - timedelta(days=10))
+
+        compact_battery_history(at=self.now)
+        stats = compact_battery_history(at=self.now)
+
+        self.assertEqual(stats['raw_purged'], 0)
+        self.assertEqual(DroneBatteryLogRollup.objects.filter(period=BatteryRollupPeriod.HOUR).count(), 1)
+
+    def test_battery_history_reads_rollups_for_long_ranges(self):
+        self._log(90, self.now - timedelta(days=10))
+        self._log(60, self.now - timedelta(hours=2))
+        compact_battery_history(at=self.now)
+
+        recent = battery_history([self.drone.id], self.now - timedelta(hours=3), self.now)
+        self.assertEqual([row[2] for row in recent], [60])
+
+        month = battery_history([self.drone.id], self.now - timedelta(days=30), self.now)
+        self.assertEqual([row[3] for row in month], [90, 60])
+
+    def test_long_ranges_read_the_raw_log_after_the_last_compaction(self):
+        self._log(90, self.now - timedelta(days=10))
+        compact_battery_history(at=self.now - timedelta(hours=3))
+        self._log(60, self.now - timedelta(hours=2))
+        self._log(50, self.now - timedelta(minutes=10))
+
+        month = battery_history([self.drone.id], self.now - timedelta(days=30), self.now)
+
+        self.assertEqual([row[3] for row in month], [90, 60, 50])
+
+    def test_compaction_is_scheduled_hourly(self):
+        task = PeriodicTask.objects.get(task='src.drone.tasks.compact_drone_battery_history')
+
+        self.assertEqual((task.interval.every, task.interval.period), (1, 'hours'))
+
+
+class TestBatteryHistoryAPI(APITestCase):
+    def setUp(self):
+        self.drone_1 = Drone.objects.create(serial_number='history1', weight_limit=500.0, battery_capacity=100)
+        self.drone_2 = Drone.objects.create(serial_number='history2', weight_limit=500.0, battery_capacity=100)
+        self.end = timezone.now().replace(microsecond=0)
+        self.start = self.end - timedelta(hours=10)
+
+        # one sample per drone per minute for 10 hours, draining 0.1% per sample
+        logs = DroneBatteryLogHistory.objects.bulk_create([
+            DroneBatteryLogHistory(drone=drone, battery_capacity=Decimal(100) - Decimal('0.1') * i)
+            for i in range(600)
+            for drone in (self.drone_1, self.drone_2)
+        ])
+        # created_at is auto_now, bulk_update bypasses it
+        for i, log in enumerate(logs):
+            log.created_at = self.start + timedelta(minutes=i // 2)
+        DroneBatteryLogHistory.objects.bulk_update(logs, ['created_at'])
+
+    def test_drone_battery_history_is_downsampled(self):
+        url = reverse('drones-drone-battery-history', kwargs={'pk': self.drone_1.pk})
+
+        response = self.client.get(url, {'start': self.start.isoformat(), 'end': self.end.isoformat(), 'points': 10})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        points = response.data['points']
+        self.assertEqual(len(points), 10)
+        self.assertEqual([point['samples'] for point in points], [60] * 10)
+        self.assertEqual((points[0]['max'], points[0]['min'], points[0]['avg']), (100.0, 94.1, 97.0))
+
+    def test_fleet_battery_history(self):
+        url = reverse('drones-fleet-battery-history')
+
+        response = self.client.get(url, {'start': self.start.isoformat(), 'end': self.end.isoformat(), 'points': 5})
+        self.assertEqual([point['samples'] for point in response.data['points']], [240] * 5)
+
+        response = self.client.get(url, {
+            'start': self.start.isoformat(), 'end': self.end.isoformat(), 'points': 5, 'drone_ids': str(self.drone_2.id),
+        })
+        self.assertEqual([point['samples'] for point in response.data['points']], [120] * 5)
+
+    def test_rollup_averages_are_weighted_by_their_samples(self):
+        start = self.end - timedelta(days=5)
+        DroneBatteryLogRollup.objects.bulk_create([
+            DroneBatteryLogRollup(
+                drone=self.drone_1, period=BatteryRollupPeriod.HOUR, bucket_start=start + timedelta(hours=hour),
+                min_battery=battery, avg_battery=battery, max_battery=battery, sample_count=samples,
+            )
+            for hour, battery, samples in ((1, 90, 1), (2, 60, 3))
+        ])
+        url = reverse('drones-drone-battery-history', kwargs={'pk': self.drone_1.pk})
+
+        # ends before the raw samples, which are logged after these rollups
+        end = start + timedelta(days=3)
+
+        response = self.client.get(url, {'start': start.isoformat(), 'end': end.isoformat(), 'points': 1})
+
+        point = response.data['points'][0]
+        self.assertEqual((point['min'], point['avg'], point['max'], point['samples']), (60.0, 67.5, 90.0, 4))
+
+    def test_long_ranges_include_the_samples_after_the_last_compaction(self):
+        compact_battery_history(at=self.end - timedelta(hours=5))
+        url = reverse('drones-drone-battery-history', kwargs={'pk': self.drone_1.pk})
+
+        response = self.client.get(url, {
+            'start': (self.end - timedelta(days=3)).isoformat(), 'end': self.end.isoformat(), 'points': 3,
+        })
+
+        # the newest day holds every sample, half of them only in the raw log
+        point = response.data['points'][-1]
+        self.assertEqual((point['samples'], point['min'], point['max']), (600, 40.1, 100.0))
+
+    def test_battery_history_rejects_invalid_range(self):
+        url = reverse('drones-fleet-battery-history')
+
+        response = self.client.get(url, {'start': self.end.isoformat(), 'end': self.start.isoformat()})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestDroneCache(APITestCase):
+    def setUp(self):
+        drone_cache.clear()
+        self.drone = Drone.objects.create(serial_number='cache1', weight_limit=500.0, battery_capacity=100)
+        self.med = Medication.objects.create(name='Med1', weight=100, code='cacheMed1')
+
+    def test_repeat_reads_skip_the_database(self):
+        url = reverse('drones-check-loaded-medictions', kwargs={'pk': self.drone.pk})
+        self.client.get(url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+
+        self.assertEqual(response.data['drone']['serial_number'], 'cache1')
+        stats = self.client.get(reverse('drones-cache-stats')).data
+        self.assertEqual((stats['drone_hits'], stats['drone_misses']), (1, 1))
+        self.assertEqual((stats['medications_hits'], stats['medications_misses']), (1, 1))
+
+    def test_medication_attach_and_detach_invalidate(self):
+        url = reverse('drones-check-loaded-medictions', kwargs={'pk': self.drone.pk})
+        self.assertEqual(len(self.client.get(url).data['loaded_medications']), 0)
+
+        self.med.drone = self.drone
+        self.med.save()
+        self.assertEqual(len(self.client.get(url).data['loaded_medications']), 1)
+
+        self.drone.state = DroneState.DELIVERING
+        self.drone.save()
+        self.client.put(reverse('drones-set-drone-as-delivered', kwargs={'pk': self.drone.pk}))
+        self.assertEqual(len(self.client.get(url).data['loaded_medications']), 0)
+
+    def test_battery_level_follows_load_changes(self):
+        url = reverse('drones-check-battery-level', kwargs={'pk': self.drone.pk})
+        self.assertEqual(self.client.get(url).data['drone']['battery_capacity'], 100)
+
+        # 400g loaded: 100 - 400 * 0.005 = 98
+        self.med.drone = self.drone
+        self.med.save()
+        Medication.objects.create(name='Med2', weight=300, code='cacheMed2', drone=self.drone)
+
+        self.assertEqual(self.client.get(url).data['drone']['battery_capacity'], 98)
+
+    def test_unknown_drone_is_not_found(self):
+        url = reverse('drones-check-battery-level', kwargs={'pk': 9999})
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestFastSerializers(TestCase):
+    def setUp(self):
+        Drone.objects.create(serial_number='fast1', weight_limit=500.0, battery_capacity=100)
+        Drone.objects.create(
+            serial_number='fast2', drone_model=DroneModel.HEAVYWEIGHT, weight_limit=0.5, battery_capacity=24.9,
+            state=DroneState.DELIVERING,
+        )
+        Medication.objects.create(
+            name='Med1', weight=12.5, code='FAST_1', image='med_images/fast.png',
+            image_variants={'thumbnail': 'med_images/fast-thumbnail.jpg'},
+        )
+        Medication.objects.create(name='Med2', weight=0, code='FAST_2')
+
+    def assertSameJSON(self, fast, drf):
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(fast), renderer.render(drf))
+
+    def test_drones_match_the_model_serializer(self):
+        drones = Drone.objects.order_by('id')
+
+        self.assertSameJSON(FastDroneSerializer(drones).data, DroneSerializer(drones, many=True).data)
+
+    def test_medications_match_the_model_serializer(self):
+        medications = Medication.objects.order_by('id')
+
+        self.assertSameJSON(FastMedicationSerializer(medications).data, MedicationSerializer(medications, many=True).data)
+
+    def test_datetimes_follow_the_active_time_zone(self):
+        drones = Drone.objects.order_by('id')
+
+        with timezone.override('UTC'):
+            data = FastDroneSerializer(drones).data
+            self.assertSameJSON(data, DroneSerializer(drones, many=True).data)
+        self.assertTrue(data[0]['created_at'].endswith('Z'))
+
+
+class TestFastJSONRenderer(APITestCase):
+    """
+    The orjson renderer and parser must be interchangeable with DRF's stdlib json ones.
+    """
+
+    def setUp(self):
+        drone_cache.clear()
+        self.drone = Drone.objects.create(serial_number='json1', weight_limit=500.0, battery_capacity=100)
+        Drone.objects.create(serial_number='json2   é漢', weight_limit=123.4, battery_capacity=55.5)
+        Medication.objects.create(name='Med1', weight=100, code='JSON_1', drone=self.drone, image='med_images/a.png')
+
+    def assertSameRendering(self, data):
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_values_render_like_the_stdlib_renderer(self):
+        self.assertSameRendering({
+            'decimal': Decimal('98.0'),
+            'decimals': [Decimal('0.1'), Decimal('12345.6')],
+            'utc': datetime(2024, 1, 2, 3, 4, 5, 6000, tzinfo=dt_timezone.utc),
+            'local': datetime(2024, 1, 2, 3, 4, 5, tzinfo=ZoneInfo('Africa/Johannesburg')),
+            'zero_offset': datetime(2024, 1, 2, tzinfo=ZoneInfo('Europe/London')),
+            'naive': datetime(2024, 1, 2, 3, 4, 5),
+            'date': date(2024, 1, 2),
+            'duration': timedelta(minutes=90),
+            'lazy': gettext_lazy('Not found.'),
+            'error': ErrorDetail('Invalid', code='invalid'),
+            'text': 'quote " backslash \\ control \x01 \t\n line \u2028 paragraph \u2029',
+            'numbers': [0, -1, 2 ** 63 - 1, 0.5, 98.7, True, None],
+            'floats': [1e20, -1.5e-7, 0.00001, 1e16, 0.0001, 1e15],
+            1: 'int key',
+        })
+        self.assertSameRendering(1e20)
+
+    def test_non_finite_values_raise_like_the_stdlib_renderer(self):
+        for value in (float('nan'), float('inf'), Decimal('NaN')):
+            for renderer in (FastJSONRenderer(), JSONRenderer()):
+                with self.subTest(value=value, renderer=type(renderer).__name__):
+                    with self.assertRaises(ValueError):
+                        renderer.render({'values': [None, value]})
+
+    def test_huge_integers_fall_back_to_the_stdlib_renderer(self):
+        self.assertSameRendering({'big': 2 ** 70})
+
+    def test_enums_render_as_their_value(self):
+        data = {'state': DroneState.DELIVERING, 'model': DroneModel.HEAVYWEIGHT}
+
+        self.assertEqual(FastJSONRenderer().render(data), b'{"state":"Delivering","model":"Heavyweight"}')
+        # the stdlib fallback
+        self.assertEqual(
+            json.dumps(data, cls=drone_renderers.JSONEncoder, separators=(',', ':')),
+            '{"state":"Delivering","model":"Heavyweight"}',
+        )
+
+    def test_api_responses_match_the_stdlib_renderer(self):
+        DroneBatteryLogHistory.objects.create(drone=self.drone, battery_capacity=Decimal('88.8'))
+        requests = [
+            (reverse('drones-check-available-drones'), {}),
+            (reverse('drones-check-available-drones'), {'limit': 1}),
+            (reverse('drones-check-available-drones'), {'limit': 0}),
+            (reverse('drones-check-battery-level', kwargs={'pk': self.drone.pk}), {}),
+            (reverse('drones-check-battery-level', kwargs={'pk': 9999}), {}),
+            (reverse('drones-check-loaded-medictions', kwargs={'pk': self.drone.pk}), {}),
+            (reverse('drones-drone-battery-history', kwargs={'pk': self.drone.pk}), {}),
+            (reverse('drones-fleet-battery-history'), {'end': (timezone.now() - timedelta(days=3)).isoformat()}),
+            (reverse('drones-cache-stats'), {}),
+        ]
+        for url, params in requests:
+            with self.subTest(url=url, params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+        response = self.client.post(reverse('drones-dispatch-plan'), {}, format='json')
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    def test_parser_matches_the_stdlib_parser(self):
+        body = '{"medication_ids": [1, 2], "name": "é漢", "weight": 12.5, "apply": true, "none": null}'
+
+        self.assertEqual(
+            FastJSONParser().parse(BytesIO(body.encode())),
+            JSONParser().parse(BytesIO(body.encode())),
+        )
+
+    def test_invalid_json_is_a_bad_request(self):
+        response = self.client.post(
+            reverse('drones-dispatch-plan'), data='{"apply": tru', content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(response.data['detail'].startswith('JSON parse error'))
+
+
+class TestAsyncDroneAPI(TestCase):
+    def setUp(self):
+        drone_cache.clear()
+        self.drone = Drone.objects.create(serial_number='async1', weight_limit=500.0, battery_capacity=80)
+        Drone.objects.create(serial_number='async2', weight_limit=500.0, battery_capacity=90)
+        Medication.objects.create(name='Med1', weight=100, code='asyncMed1', drone=self.drone)
+
+    async def assertSameResponse(self, sync_name, async_name, kwargs=None, data=None):
+        sync_response = await sync_to_async(self.client.get)(reverse(sync_name, kwargs=kwargs), data)
+        async_response = await self.async_client.get(reverse(async_name, kwargs=kwargs), data)
+
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.content, sync_response.content)
+
+    async def test_responses_match_the_sync_endpoints(self):
+        detail = {'pk': self.drone.pk}
+        await self.assertSameResponse('drones-check-battery-level', 'async-drones-check-battery-level', detail)
+        await self.assertSameResponse(
+            'drones-check-loaded-medictions', 'async-drones-check-loaded-medictions', detail,
+        )
+        await self.assertSameResponse('drones-check-available-drones', 'async-drones-check-available-drones')
+        await self.assertSameResponse(
+            'drones-check-available-drones', 'async-drones-check-available-drones', data={'limit': 1},
+        )
+        await self.assertSameResponse(
+            'drones-check-available-drones', 'async-drones-check-available-drones',
+            data={'stream': 'true', 'limit': 1},
+        )
+
+    async def test_unknown_drone_is_not_found(self):
+        await self.assertSameResponse(
+            'drones-check-loaded-medictions', 'async-drones-check-loaded-medictions', {'pk': 9999},
+        )
+
+    async def test_available_drones_stream(self):
+        response = await self.async_client.get(reverse('async-drones-check-available-drones'), {'stream': 'true'})
+
+        lines = b''.join([chunk async for chunk in response.streaming_content]).splitlines()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[1])['serial_number'], 'async2')
+
+        response = await self.async_client.get(
+            reverse('async-drones-check-available-drones'), {'stream': 'true', 'limit': 1},
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class TestDroneTransitions(TestCase):
+    def setUp(self):
+        self.drone = Drone.objects.create(
+            serial_number='transition1', weight_limit=500.0, battery_capacity=100, state=DroneState.LOADED,
+        )
+
+    def test_transition_is_a_single_conditional_update(self):
+        # savepoint, conditional update, release
+        with self.assertNumQueries(3):
+            result = transition_drone(self.drone.pk, DroneState.DELIVERING)
+
+        self.assertEqual(result, {'id': self.drone.pk, 'state': DroneState.DELIVERING})
+        self.drone.refresh_from_db()
+        self.assertEqual(self.drone.state, DroneState.DELIVERING)
+
+    def test_transition_from_a_stale_state_is_refused(self):
+        transition_drone(self.drone.pk, DroneState.DELIVERING)
+
+        with self.assertRaisesMessage(TransitionError, 'Drone needs to be loaded before starting deliveries'):
+            transition_drone(self.drone.pk, DroneState.DELIVERING)
+
+    def test_delivered_detaches_medications(self):
+        Medication.objects.create(name='Med1', weight=100, code='transitionMed1', drone=self.drone)
+        transition_drone(self.drone.pk, DroneState.DELIVERING)
+
+        transition_drone(self.drone.pk, DroneState.DELIVERED)
+
+        self.drone.refresh_from_db()
+        self.assertEqual((self.drone.loaded_weight, self.drone.loaded_count), (0, 0))
+        self.assertFalse(self.drone.medications.exists())
+
+    def test_unknown_drone_is_not_found(self):
+        with self.assertRaises(Http404):
+            transition_drone(9999, DroneState.DELIVERING)
+
+
+class TestBulkRegistrationAPI(APITestCase):
+    def setUp(self):
+        Drone.objects.create(serial_number='DEPOT_TAKEN', weight_limit=500.0, battery_capacity=100)
+        self.url = reverse('drones-bulk-register-drones')
+
+    def post(self, body, content_type):
+        return self.client.post(self.url, data=body, content_type=content_type)
+
+    def test_json_array_registers_valid_rows_and_reports_the_rest(self):
+        rows = [
+            {'serial_number': 'DEPOT_1', 'weight_limit': 250, 'battery_capacity': 80},
+            {'serial_number': 'DEPOT_2', 'weight_limit': 250, 'battery_capacity': 150},
+            {'serial_number': 'DEPOT_TAKEN', 'weight_limit': 250, 'battery_capacity': 80},
+            {'serial_number': 'DEPOT_1', 'weight_limit': 250, 'battery_capacity': 80},
+            {'serial_number': 'DEPOT_3', 'drone_model': 'Heavyweight', 'weight_limit': 500, 'battery_capacity': 99.5},
+            ['not', 'an', 'object'],
+        ]
+
+        response = self.post(json.dumps(rows), 'application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 4))
+        errors = {error['row']: error['errors'] for error in response.data['errors']}
+        self.assertEqual(sorted(errors), [2, 3, 4, 6])
+        self.assertIn('battery_capacity', errors[2])
+        taken = self.client.post(
+            reverse('drones-register-drone'), {'serial_number': 'DEPOT_TAKEN', 'weight_limit': 250}, format='json',
+        )
+        self.assertEqual(errors[3]['serial_number'], taken.data['serial_number'])
+        self.assertEqual(errors[4]['serial_number'], taken.data['serial_number'])
+        self.assertEqual(Drone.objects.get(serial_number='DEPOT_3').drone_model, DroneModel.HEAVYWEIGHT)
+
+    def test_ndjson_malformed_line_is_reported_on_its_own(self):
+        body = '{"serial_number": "DEPOT_1", "weight_limit": 100}\n{"serial_number": \n\n{"serial_number": "DEPOT_2"}\n'
+
+        response = self.post(body, 'application/x-ndjson')
+
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [2])
+
+    def test_csv_upload_uses_defaults_for_empty_cells(self):
+        upload = SimpleUploadedFile(
+            'depot.csv', b'serial_number,drone_model,weight_limit,battery_capacity\nDEPOT_1,,120.5,\nDEPOT_2,Middleweight,500,90\n',
+        )
+
+        response = self.client.post(self.url, {'file': upload}, format='multipart')
+
+        self.assertEqual(response.data['created'], 2)
+        drone = Drone.objects.get(serial_number='DEPOT_1')
+        self.assertEqual((drone.drone_model, drone.weight_limit), (DroneModel.LIGHTWEIGHT, Decimal('120.5')))
+
+    def test_malformed_json_array_keeps_the_rows_before_it(self):
+        response = self.post('[{"serial_number": "DEPOT_1"}, {"serial_number": "DEPOT_2"} {"x": 1}]', 'application/json')
+
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [3])
+
+    def test_json_array_is_read_incrementally(self):
+        rows = [{'serial_number': f'DEPOT_{i}', 'weight_limit': 1.5 * i, 'name': 'é漢 ]},'} for i in range(50)]
+
+        with mock.patch.object(registration, 'READ_SIZE', 7):
+            parsed = list(registration.json_array_rows(BytesIO(json.dumps(rows).encode())))
+
+        self.assertEqual(parsed, rows)
+
+    def test_rows_are_inserted_in_chunks(self):
+        rows = [{'serial_number': f'DEPOT_{i}', 'weight_limit': 100} for i in range(50)]
+
+        # serial number prefetch, then per chunk of 20: savepoint, insert, release
+        with self.assertNumQueries(1 + 3 * 3):
+            result = registration.register_drones(rows, chunk_size=20)
+
+        self.assertEqual(result, {'created': 50, 'failed': 0, 'errors': []})
+
+    def test_unsupported_content_type_is_rejected(self):
+        response = self.post('<drones/>', 'application/xml')
+
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+
+class TestSeedDroneData(TestCase):
+    def fixture(self, rows):
+        return BytesIO(json.dumps(rows).encode())
+
+    def test_fixture_is_filtered_and_loaded_in_dependency_order(self):
+        drone = Drone.objects.create(serial_number='OLD_SERIAL', weight_limit=500.0, battery_capacity=100)
+        rows = [
+            # the medication comes first in the file but references the drone
+            {'model': 'drone.medication', 'pk': 7, 'fields': {'drone': drone.pk + 1, 'name': 'Insulin', 'weight': '20.0', 'code': 'IN_7'}},
+            {'model': 'admin.logentry', 'pk': 1, 'fields': {'action_time': '2025-01-28T18:01:27Z', 'action_flag': 1}},
+            {'model': 'drone.drone', 'pk': drone.pk, 'fields': {'serial_number': 'SN001', 'weight_limit': '300.0', 'battery_capacity': '90.0'}},
+            {'model': 'drone.drone', 'pk': drone.pk + 1, 'fields': {'serial_number': 'SN002', 'weight_limit': '400.0', 'battery_capacity': '80.0'}},
+        ]
+
+        counts = seeding.load_fixture(self.fixture(rows), seeding.model_filter(exclude=['admin']), batch_size=1)
+
+        self.assertEqual(counts, {'drone.drone': 2, 'drone.medication': 1})
+        drone.refresh_from_db()
+        self.assertEqual(drone.serial_number, 'SN001')
+        loaded = Drone.objects.get(pk=drone.pk + 1)
+        self.assertEqual((loaded.loaded_weight, loaded.loaded_count), (Decimal('20.0'), 1))
+        self.assertEqual(Medication.objects.get(pk=7).drone_id, loaded.pk)
+
+    def test_drones_a_fixture_moves_medications_off_are_rebuilt(self):
+        first = Drone.objects.create(serial_number='SEED_FIRST', weight_limit=500.0, battery_capacity=100)
+        second = Drone.objects.create(serial_number='SEED_SECOND', weight_limit=500.0, battery_capacity=100)
+        medication = Medication.objects.create(name='Insulin', weight=20, code='IN_MOVED', drone=first)
+        rows = [
+            {'model': 'drone.medication', 'pk': medication.pk, 'fields': {'drone': second.pk, 'name': 'Insulin', 'weight': '20.0', 'code': 'IN_MOVED'}},
+        ]
+
+        seeding.load_fixture(self.fixture(rows))
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.loaded_weight, first.loaded_count), (Decimal('0'), 0))
+        self.assertEqual((second.loaded_weight, second.loaded_count), (Decimal('20.0'), 1))
+
+    def test_model_filter(self):
+        selected = seeding.model_filter(models=['drone', 'auth.user'], exclude=['drone.medication'])
+
+        self.assertTrue(selected('drone.drone'))
+        self.assertTrue(selected('auth.user'))
+        self.assertFalse(selected('drone.medication'))
+        self.assertFalse(selected('admin.logentry'))
+
+    def test_command_generates_a_fleet_once(self):
+        out = StringIO()
+
+        call_command('seed_drone_data', '--drones', '25', '--medications', '10', '--batch-size', '7', stdout=out)
+        call_command('seed_drone_data', '--drones', '25', '--medications', '10', stdout=out)
+
+        self.assertIn('Generated 25 drones and 10 medications', out.getvalue())
+        self.assertIn('Generated 0 drones and 0 medications', out.getvalue())
+        self.assertEqual(Drone.objects.filter(serial_number__startswith='SEED', state=DroneState.IDLE).count(), 25)
+        self.assertEqual(Medication.objects.filter(code__startswith='SEED_', drone=None).count(), 10)
+        self.assertTrue(all(0 <= drone.battery_capacity <= 100 for drone in Drone.objects.all()))
+
+    def test_command_reports_a_malformed_fixture(self):
+        with tempfile.NamedTemporaryFile(suffix='.json') as fixture:
+            fixture.write(b'[{"model": "drone.drone", "pk": 1, "fields": {}}')
+            fixture.flush()
+
+            with self.assertRaisesMessage(CommandError, 'Could not load'):
+                call_command('seed_drone_data', fixture.name, stdout=StringIO())
+        self.assertFalse(Drone.objects.exists())
+
+
+class TestMedicationImages(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        current_app.conf.task_always_eager = True
+        self.addCleanup(setattr, current_app.conf, 'task_always_eager', False)
+
+    def upload(self, size=(1200, 800), mode='RGB'):
+        image = Image.new(mode, size, 'red')
+        exif = Image.Exif()
+        exif[0x0110] = 'Secret Camera'
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG' if mode == 'RGB' else 'PNG', exif=exif)
+        return SimpleUploadedFile('upload.jpg', buffer.getvalue())
+
+    def create(self, code, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Medication.objects.create(name='Insulin', weight=20, code=code, image=upload)
+
+    def test_upload_is_stripped_and_resized_after_commit(self):
+        medication = self.create('IMG_1', self.upload())
+        upload_name = medication.image.name
+
+        medication.refresh_from_db()
+        storage = medication.image.storage
+        self.assertNotEqual(medication.image.name, upload_name)
+        self.assertFalse(storage.exists(upload_name))
+        self.assertRegex(medication.image.name, r'^med_images/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(set(medication.image_variants), {'thumbnail', 'medium'})
+        with Image.open(storage.open(medication.image.name)) as original:
+            self.assertEqual(original.size, (1200, 800))
+            self.assertEqual(dict(original.getexif()), {})
+        with Image.open(storage.open(medication.image_variants['thumbnail'])) as thumbnail:
+            self.assertEqual(thumbnail.size, (160, 107))
+
+        data = MedicationSerializer(medication).data
+        self.assertEqual(data['thumbnail'], storage.url(medication.image_variants['thumbnail']))
+        self.assertEqual(set(data['images']), {'thumbnail', 'medium'})
+
+    def test_identical_images_are_stored_once(self):
+        first = self.create('IMG_1', self.upload(mode='RGBA'))
+        second = self.create('IMG_2', self.upload(mode='RGBA'))
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertTrue(first.image.name.endswith('.png'))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image_variants, second.image_variants)
+
+    def test_unchanged_image_is_not_processed_again(self):
+        medication = self.create('IMG_1', self.upload())
+        medication.refresh_from_db()
+
+        with mock.patch.object(images, 'process_image') as process_image:
+            with self.captureOnCommitCallbacks(execute=True):
+                medication.weight = 30
+                medication.save()
+        process_image.assert_not_called()
+
+    def test_file_that_is_not_an_image_is_left_alone(self):
+        with self.assertLogs('src.drone.images', 'WARNING'):
+            medication = self.create('IMG_1', SimpleUploadedFile('notes.jpg', b'not an image'))
+
+        medication.refresh_from_db()
+        self.assertEqual(medication.image_variants, {})
+        self.assertTrue(medication.image.storage.exists(medication.image.name))
+
+
+class TestMediaServing(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.content = bytes(range(256)) * 4
+        os.makedirs(os.path.join(media_root.name, 'med_images'))
+        for name in ('insulin.jpg', 'a' * 64 + '.jpg'):
+            with open(os.path.join(media_root.name, 'med_images', name), 'wb') as file:
+                file.write(self.content)
+        self.url = reverse('media', kwargs={'path': 'med_images/insulin.jpg'})
+
+    def get(self, url=None, **headers):
+        response = self.client.get(url or self.url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_file_is_sent_with_validators(self):
+        response, body = self.get()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], '1024')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_repeat_fetch_is_not_modified(self):
+        response, _ = self.get()
+
+        not_modified, body = self.get(**{'If-None-Match': response['ETag']})
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(body, b'')
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(self.get(**{'If-Modified-Since': response['Last-Modified']})[0].status_code, 304)
+        self.assertEqual(self.get(**{'If-None-Match': '"stale"'})[0].status_code, 200)
+
+    def test_byte_ranges(self):
+        response, body = self.get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(body, self.content[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(response['Content-Length'], '10')
+
+        self.assertEqual(self.get(Range='bytes=-5')[1], self.content[-5:])
+        self.assertEqual(self.get(Range='bytes=1000-')[1], self.content[1000:])
+        self.assertEqual(self.get(Range='bytes=0-1,5-6')[0].status_code, status.HTTP_200_OK)
+        unsatisfiable, _ = self.get(Range='bytes=2048-')
+        self.assertEqual(unsatisfiable.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(unsatisfiable['Content-Range'], 'bytes */1024')
+
+    def test_range_is_ignored_when_if_range_does_not_match(self):
+        etag = self.get()[0]['ETag']
+
+        self.assertEqual(self.get(Range='bytes=0-9', **{'If-Range': etag})[0].status_code, 206)
+        self.assertEqual(self.get(Range='bytes=0-9', **{'If-Range': '"stale"'})[1], self.content)
+
+    def test_range_keeps_the_file_for_sendfile(self):
+        request = RequestFactory().get(self.url, headers={'Range': 'bytes=100-199'})
+        response = serve_media(request, 'med_images/insulin.jpg')
+        self.addCleanup(response.close)
+
+        fileno = response.file_to_stream.fileno()
+        self.assertEqual(os.lseek(fileno, 0, os.SEEK_CUR), 100)
+
+    def test_content_hashed_files_are_immutable(self):
+        response, _ = self.get(reverse('media', kwargs={'path': 'med_images/' + 'a' * 64 + '.jpg'}))
+
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+    def test_missing_files_and_paths_outside_media_root(self):
+        for path in ('med_images/missing.jpg', 'med_images', '../settings.py'):
+            self.assertEqual(self.client.get(reverse('media', kwargs={'path': path})).status_code, 404)
+        self.assertEqual(self.client.post(self.url).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    @override_settings(DRONE_MEDIA_ACCEL_REDIRECT='/protected-media/')
+    def test_transfer_is_offloaded_to_nginx(self):
+        response, body = self.get()
+
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/med_images/insulin.jpg')
+        self.assertEqual(body, b'')
+
+
+class TestSQLiteConcurrency(SimpleTestCase):
+    """
+    The battery sweep and the API sharing a SQLite file, with the configured database options.
+    """
+    # the threads connect to their own file, not to the test database
+    databases = {'default'}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_dict = {**connections['default'].settings_dict, 'NAME': os.path.join(directory.name, 'db.sqlite3')}
+        self.executor = ThreadPoolExecutor(max_workers=3)
+        self.addCleanup(self.executor.shutdown)
+        drone_cache.clear()
+        self.drone_ids = self.in_thread(self.create_fleet).result()
+
+    def in_thread(self, function, *args):
+        """
+        Run `function` on another thread, connected to the SQLite file.
+        """
+        def run():
+            connections['default'] = connections['default'].__class__(self.settings_dict, 'default')
+            try:
+                return function(*args)
+            finally:
+                connections['default'].close()
+        return self.executor.submit(run)
+
+    def create_fleet(self):
+        with connection.schema_editor() as editor:
+            for model in (Drone, Medication, DroneBatterySweep, DroneBatterySweepShard, DroneBatteryLogHistory):
+                editor.create_model(model)
+        # what migrating the file would do
+        with connection.schema_editor(atomic=False) as editor:
+            import_module('src.drone.migrations.0010_sqlite_wal_journal').set_journal_mode('WAL')(apps, editor)
+        drones = [
+            Drone.objects.create(serial_number=f'wal{i}', weight_limit=500.0, battery_capacity=100)
+            for i in range(5)
+        ]
+        Drone.objects.filter(pk=drones[0].pk).update(state=DroneState.LOADING)
+        Medication.objects.create(name='Insulin', weight=20, code='WAL_1')
+        return [drone.id for drone in drones]
+
+    def sweep(self):
+        sweep, shards = start_sweep()
+        return sweep_shard(sweep.id, shards[0][0], shards[-1][1])
+
+    def get_status(self, url):
+        return APIClient().get(url).status_code
+
+    def load_status(self, drone_id):
+        # reads the drone and the medications, then writes them in one transaction
+        return APIClient().post(
+            reverse('drones-load-medications', kwargs={'pk': drone_id}),
+            {'medication_ids': list(Medication.objects.values_list('id', flat=True))},
+            format='json',
+        ).status_code
+
+    def test_migrated_database_stays_in_wal_mode(self):
+        # a new connection, the mode is kept in the file
+        def journal_mode():
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                return cursor.fetchone()[0]
+
+        self.assertEqual(self.in_thread(journal_mode).result(), 'wal')
+
+    def test_api_reads_and_writes_while_a_sweep_shard_is_open(self):
+        writing, release = threading.Event(), threading.Event()
+        bulk_create = DroneBatteryLogHistory.objects.bulk_create
+
+        def paused_bulk_create(*args, **kwargs):
+            created = bulk_create(*args, **kwargs)
+            writing.set()
+            release.wait(5)
+            return created
+
+        with mock.patch.object(DroneBatteryLogHistory.objects, 'bulk_create', paused_bulk_create):
+            sweep = self.in_thread(self.sweep)
+            self.assertTrue(writing.wait(5))
+
+            # reads are not blocked by the shard's uncommitted write transaction
+            started = time.perf_counter()
+            url = reverse('drones-check-battery-level', kwargs={'pk': self.drone_ids[0]})
+            self.assertEqual(self.in_thread(self.get_status, url).result(timeout=5), status.HTTP_200_OK)
+            self.assertLess(time.perf_counter() - started, 1)
+
+            # a read-then-write transaction queues behind the shard instead of failing with "database is locked"
+            write = self.in_thread(self.load_status, self.drone_ids[0])
+            time.sleep(0.2)
+            self.assertFalse(write.done())
+            release.set()
+            self.assertEqual(write.result(timeout=10), status.HTTP_200_OK)
+            self.assertEqual(sweep.result(timeout=10)['history_rows'], 5)
+
+
+class TestBulkTransitionAPI(APITestCase):
+    def setUp(self):
+        self.loaded = [
+            Drone.objects.create(serial_number=f'wave{i}', weight_limit=500.0, battery_capacity=100, state=DroneState.LOADED)
+            for i in range(3)
+        ]
+        self.idle = Drone.objects.create(serial_number='wave_idle', weight_limit=500.0, battery_capacity=100)
+
+    def test_wave_is_moved_with_per_drone_results(self):
+        url = reverse('drones-bulk-transition')
+        drone_ids = [drone.id for drone in self.loaded] + [self.idle.id, 9999]
+
+        response = self.client.post(url, {'drone_ids': drone_ids, 'state': DroneState.DELIVERING.value}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = {result['drone_id']: result for result in response.data['results']}
+        for drone in self.loaded:
+            self.assertTrue(results[drone.id]['success'])
+        self.assertEqual(results[self.idle.id]['error'], 'Drone needs to be loaded before starting deliveries')
+        self.assertEqual(results[9999]['error'], 'Drone not found.')
+        self.assertEqual(Drone.objects.filter(state=DroneState.DELIVERING).count(), 3)
+
+    def test_query_count_does_not_grow_with_wave_size(self):
+        url = reverse('drones-bulk-transition')
+        drone_ids = [drone.id for drone in self.loaded]
+
+        # savepoint, select, update, release
+        with self.assertNumQueries(4):
+            self.client.post(url, {'drone_ids': drone_ids, 'state': DroneState.DELIVERING.value}, format='json')
+
+    def test_state_without_transition_is_rejected(self):
+        url = reverse('drones-bulk-transition')
+
+        response = self.client.post(url, {'drone_ids': [self.idle.id], 'state': DroneState.IDLE.value}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestDispatchPlanAPI(APITestCase):
+    def setUp(self):
+        self.drones = [
+            Drone.objects.create(serial_number=f'dispatch{i}', weight_limit=500.0, battery_capacity=100)
+            for i in range(4)
+        ]
+        Drone.objects.create(serial_number='dispatch_low', weight_limit=500.0, battery_capacity=20)
+        self.medications = [
+            Medication.objects.create(name=f'Dispatch{i}', weight=weight, code=f'DISPATCH_{i}')
+            for i, weight in enumerate([300, 250, 200, 150, 50, 50])
+        ]
+        self.url = reverse('drones-dispatch-plan')
+
+    def test_dry_run_uses_fewest_drones_and_writes_nothing(self):
+        response = self.client.post(self.url, {}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['applied'])
+        # 1000g over 500g drones
+        self.assertEqual(response.data['drones_used'], 2)
+        self.assertEqual(response.data['unassigned_medication_ids'], [])
+        self.assertEqual(response.data['projected_drain'], Decimal('5.0'))
+        for assignment in response.data['assignments']:
+            self.assertLessEqual(assignment['load_weight'], 500)
+        self.assertFalse(Medication.objects.filter(drone__isnull=False).exists())
+        self.assertFalse(Drone.objects.exclude(state=DroneState.IDLE).exists())
+
+    def test_medication_heavier_than_every_drone_is_unassigned(self):
+        heavy = Medication.objects.create(name='Heavy', weight=600, code='DISPATCH_HEAVY')
+
+        response = self.client.post(self.url, {}, format='json')
+
+        self.assertEqual(response.data['unassigned_medication_ids'], [heavy.id])
+
+    def test_apply_loads_the_planned_drones(self):
+        response = self.client.post(self.url, {'apply': True}, format='json')
+
+        self.assertTrue(response.data['applied'])
+        for assignment in response.data['assignments']:
+            drone = Drone.objects.get(pk=assignment['drone_id'])
+            self.assertEqual(drone.state, DroneState.LOADED)
+            self.assertEqual(drone.loaded_weight, assignment['load_weight'])
+            self.assertEqual(drone.loaded_count, len(assignment['medication_ids']))
+            self.assertEqual(drone.projected_battery(), assignment['projected_battery'])
+            self.assertCountEqual(
+                drone.medications.values_list('id', flat=True), assignment['medication_ids'],
+            )
+        self.assertFalse(Medication.objects.filter(drone__isnull=True).exists())
+
+
+@override_settings(DRONE_PROFILING_SAMPLE_RATE=1)
+class TestProfiling(APITestCase):
+    def setUp(self):
+        drone_cache.clear()
+        profiling.reset_metrics()
+        Drone.objects.create(serial_number='profile1', weight_limit=500.0, battery_capacity=100)
+
+    def profiles(self, logs):
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    def test_request_profile_is_logged_and_counted(self):
+        with self.assertLogs('src.drone.profiling', 'INFO') as logs:
+            self.client.get(reverse('drones-check-available-drones'))
+
+        [profile] = self.profiles(logs)
+        self.assertEqual(profile['name'], 'drones-check-available-drones')
+        self.assertEqual((profile['kind'], profile['method'], profile['status']), ('request', 'GET', 200))
+        self.assertEqual(profile['queries'], 1)
+        self.assertIn('drone_drone', profile['slowest_queries'][0]['sql'])
+
+        metrics = profiling.prometheus_metrics()
+        labels = 'kind="request",name="drones-check-available-drones"'
+        self.assertIn(f'drone_profile_queries_total{{{labels}}} 1\n', metrics)
+        self.assertIn(f'drone_profile_wall_seconds_count{{{labels}}} 1\n', metrics)
+
+    @override_settings(DRONE_PROFILING_TOP_QUERIES=2)
+    def test_only_the_slowest_queries_are_kept(self):
+        drone = Drone.objects.get()
+        drone.state = DroneState.LOADING
+        drone.save()
+        medication_ids = [
+            Medication.objects.create(name=f'Med{i}', weight=10, code=f'PROFILE_{i}').id for i in range(3)
+        ]
+
+        with self.assertLogs('src.drone.profiling', 'INFO') as logs:
+            self.client.post(
+                reverse('drones-load-medications', kwargs={'pk': drone.pk}),
+                {'medication_ids': medication_ids}, format='json',
+            )
+
+        [profile] = self.profiles(logs)
+        self.assertGreater(profile['queries'], 2)
+        self.assertEqual(len(profile['slowest_queries']), 2)
+        durations = [query['ms'] for query in profile['slowest_queries']]
+        self.assertEqual(durations, sorted(durations, reverse=True))
+
+    async def test_async_request_queries_are_attributed(self):
+        drone = await Drone.objects.aget(serial_number='profile1')
+
+        with self.assertLogs('src.drone.profiling', 'INFO') as logs:
+            await self.async_client.get(reverse('async-drones-check-battery-level', kwargs={'pk': drone.pk}))
+
+        [profile] = self.profiles(logs)
+        self.assertEqual(profile['name'], 'async-drones-check-battery-level')
+        self.assertEqual(profile['queries'], 1)
+
+    def test_celery_tasks_are_profiled(self):
+        with self.assertLogs('src.drone.profiling', 'INFO') as logs:
+            compact_drone_battery_history.apply()
+
+        [profile] = self.profiles(logs)
+        self.assertEqual((profile['kind'], profile['name']), ('task', compact_drone_battery_history.name))
+        self.assertEqual(profile['state'], 'SUCCESS')
+
+    def test_slow_requests_leave_a_cprofile_dump(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(DRONE_PROFILING_CPROFILE_DIR=directory, DRONE_PROFILING_CPROFILE_THRESHOLD_MS=0):
+                with self.assertLogs('src.drone.profiling', 'INFO') as logs:
+                    self.client.get(reverse('drones-check-available-drones'))
+
+            [profile] = self.profiles(logs)
+            self.assertTrue(pstats.Stats(profile['cprofile']).total_calls)
+
+    @override_settings(DRONE_PROFILING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_profiled(self):
+        with self.assertNoLogs('src.drone.profiling'):
+            self.client.get(reverse('drones-check-available-drones'))
+
+        self.assertNotIn('drone_profile_queries_total{', self.client.get(reverse('metrics')).content.decode())
+
+
+class TestMetricsAccess(APITestCase):
+    def test_allowed_addresses_can_scrape(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1')
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_other_addresses_are_forbidden(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.7')
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_staff_users_can_read_from_anywhere(self):
+        user = User.objects.create_user('ops', password='secret', is_staff=True)
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.7')
+
+        self.assertEqual(response.status_code, 200)
+
+
+class TestExplainHotQueries(TestCase):
+    def test_battery_history_lookup_uses_composite_index(self):
+        out = StringIO()
+
+        call_command('explain_hot_queries', stdout=out)
+
+        self.assertIn('battery_log_drone_created_idx', out.getvalue())
+
+
+class TestQueryCountRegressions(TestCase):
+    """
+    Checks every benchmark scenario against the stored query count baselines,
+    latency and memory are only checked by the benchmark_drone_api command.
+    """
+
+    def test_query_counts_do_not_regress(self):
+        baseline = benchmarks.load_baselines()['10']
+        benchmarks.seed_fleet(10)
+        ctx = benchmarks.BenchmarkContext()
+
+        for name in benchmarks.SCENARIOS:
+            with self.subTest(scenario=name):
+                result = benchmarks.run_scenario(ctx, name, repeat=1)
+                self.assertLessEqual(result['queries'], baseline[name]['queries'])
+
+    def test_find_regressions(self):
+        baseline = {'battery-level': {'queries': 1, 'p95_ms': 2.0, 'peak_memory_kb': 20.0}}
+        results = {'battery-level': {'queries': 2, 'p95_ms': 5.0, 'peak_memory_kb': 20.0}}
+
+        regressions = benchmarks.find_regressions(results, baseline, tolerance=2.0)
+
+        self.assertEqual(len(regressions), 2)
+
+    def test_missing_baseline_is_a_regression(self):
+        results = {'battery-level': {'queries': 1, 'p95_ms': 2.0, 'peak_memory_kb': 20.0}}
+
+        self.assertEqual(benchmarks.find_regressions(results, {}), ['battery-level: no baseline'])
+
+    def test_every_scenario_has_a_baseline_for_every_fleet_size(self):
+        baselines = benchmarks.load_baselines()
+
+        for size in benchmarks.DEFAULT_FLEET_SIZES:
+            with self.subTest(size=size):
+                self.assertEqual(set(baselines.get(str(size), {})), set(benchmarks.SCENARIOS))
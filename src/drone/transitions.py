@@ -0,0 +1,176 @@
+"""
+Drone state machine.
+
+Every transition is a single conditional UPDATE ... WHERE state=<source>, so
+concurrent requests can not both move the same drone and only the changed
+columns are written. Conditions can use the drone's `projected_battery`. The
+drone is only read again to explain a refused transition.
+"""
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Q
+from django.http import Http404
+
+from src.drone import cache as drone_cache
+from src.drone.battery import projected_battery_expression, unloaded_battery_expression
+from src.drone.enums import DroneState
+from src.drone.models import Drone, Medication
+
+
+@dataclass(frozen=True)
+class Transition:
+    source: DroneState
+    target: DroneState
+    message: str
+    error: str
+    # extra requirement on the drone row, and the error when it is not met
+    condition: Q = field(default_factory=Q)
+    condition_error: str = ''
+    # delivered drones drop their medications
+    detach_medications: bool = False
+
+
+TRANSITIONS = {
+    transition.target: transition
+    for transition in (
+        Transition(
+            source=DroneState.IDLE,
+            target=DroneState.LOADING,
+            message='Drone is loading',
+            error='Drone unable to be set to loading, needs to be set to Idle state.',
+            condition=Q(projected_battery__gte=25),
+            condition_error='Can not load medication, battery capacity is low.',
+        ),
+        Transition(
+            source=DroneState.LOADED,
+            target=DroneState.DELIVERING,
+            message='Drone set to delivering',
+            error='Drone needs to be loaded before starting deliveries',
+        ),
+        Transition(
+            source=DroneState.DELIVERING,
+            target=DroneState.DELIVERED,
+            message='Drone delivered medication',
+            error='Drone is not delivering any medications',
+            detach_medications=True,
+        ),
+        Transition(
+            source=DroneState.DELIVERED,
+            target=DroneState.RETURNING,
+            message='Drone set to returning',
+            error='Drone has not delivered any medications yet',
+        ),
+    )
+}
+
+
+class TransitionError(Exception):
+    """
+    The drone is not in a state (or condition) that allows the transition.
+    """
+
+
+def _drone_id(drone_id):
+    try:
+        return Drone._meta.pk.to_python(drone_id)
+    except ValidationError:
+        raise Http404('No Drone matches the given query.')
+
+
+def _refusal_reason(state, transition):
+    """
+    Why a drone in `state` did not match the transition's conditional update.
+    """
+    if state == transition.source and transition.condition_error:
+        return transition.condition_error
+    return transition.error
+
+
+def _refusal(drone_id, transition):
+    """
+    Read the drone to explain why the conditional update matched no row.
+    """
+    drone = Drone.objects.filter(pk=drone_id).values('state').first()
+    if drone is None:
+        raise Http404('No Drone matches the given query.')
+    return TransitionError(_refusal_reason(drone['state'], transition))
+
+
+def transition_updates(transition):
+    """
+    The columns written by a transition.
+    """
+    updates = {'state': transition.target}
+    if transition.detach_medications:
+        updates.update(loaded_weight=0, loaded_count=0)
+    return updates
+
+
+def _drones():
+    return Drone.objects.alias(projected_battery=projected_battery_expression())
+
+
+def _update(drones, transition):
+    """
+    Apply the transition's columns to the drones. Delivered drones keep the
+    charge of the weight they carried, see `src.drone.battery`.
+    """
+    updates = transition_updates(transition)
+    if transition.detach_medications:
+        updates['battery_capacity'] = unloaded_battery_expression(F('loaded_weight'))
+    return drones.update(**updates)
+
+
+def transition_drone(drone_id, target):
+    """
+    Move a drone to `target` and return its changed columns, raising
+    TransitionError when the drone is not in the transition's source state.
+    """
+    transition = TRANSITIONS[target]
+    drone_id = _drone_id(drone_id)
+    updates = transition_updates(transition)
+
+    with transaction.atomic():
+        updated = _update(_drones().filter(transition.condition, pk=drone_id, state=transition.source), transition)
+        if not updated:
+            raise _refusal(drone_id, transition)
+        if transition.detach_medications:
+            Medication.objects.filter(drone_id=drone_id).update(drone=None)
+
+    drone_cache.invalidate_drone(drone_id)
+    return {'id': drone_id, **updates}
+
+
+def transition_drones(drone_ids, target):
+    """
+    Move every drone that can make the transition to `target` with one
+    set-based update and return a {drone_id: error or None} mapping.
+    """
+    transition = TRANSITIONS[target]
+    drone_ids = set(drone_ids)
+
+    with transaction.atomic():
+        moved = set(
+            _drones()
+            .select_for_update()
+            .filter(transition.condition, pk__in=drone_ids, state=transition.source)
+            .values_list('id', flat=True)
+        )
+        if moved:
+            _update(Drone.objects.filter(pk__in=moved), transition)
+            if transition.detach_medications:
+                Medication.objects.filter(drone_id__in=moved).update(drone=None)
+
+    results = {drone_id: None for drone_id in moved}
+    refused = drone_ids - moved
+    if refused:
+        states = dict(Drone.objects.filter(pk__in=refused).values_list('id', 'state'))
+        for drone_id in refused:
+            results[drone_id] = (
+                _refusal_reason(states[drone_id], transition) if drone_id in states else 'Drone not found.'
+            )
+
+    drone_cache.invalidate_drones(moved)
+    return results
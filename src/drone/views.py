@@ -1,3 +1,15 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 
-# Create your views here.
+from src.drone.profiling import prometheus_metrics
+
+
+def metrics(request):
+    """
+    Profiling totals of this process for Prometheus, see src.drone.profiling.
+
+    Only served to the addresses of DRONE_METRICS_ALLOWED_IPS and to staff users.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.DRONE_METRICS_ALLOWED_IPS and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(prometheus_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
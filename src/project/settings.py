@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
+from decimal import Decimal
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'src.drone.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,12 +78,57 @@ WSGI_APPLICATION = 'src.project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgresql for production: the web, Celery worker and beat processes then write concurrently.
+# SQLite serializes every write on one file lock, the options below keep readers and writers from
+# failing on each other: WAL lets reads run during a write, writers queue for up to DB_SQLITE_TIMEOUT
+# seconds and IMMEDIATE transactions take the write lock upfront, so they can not fail to upgrade to it.
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'drone'),
+            'USER': os.getenv('DB_USER', 'drone'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', '127.0.0.1'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            # persistent connections, checked before a request reuses them
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    # psycopg's connection pool, shared by the threads of a process (ASGI, sync_to_async), replaces the
+    # persistent connections. Size it so that processes x DB_POOL_MAX_SIZE stays under max_connections
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 0))
+    if DB_POOL_MAX_SIZE:
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': DB_POOL_MAX_SIZE,
+            # seconds a query waits for a free connection
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'timeout': float(os.getenv('DB_SQLITE_TIMEOUT', 20)),
+                'transaction_mode': 'IMMEDIATE',
+                # the database is switched to WAL mode once, by migration drone 0010. synchronous=NORMAL
+                # is durable in WAL mode but for the last commits on a power loss
+                'init_command': (
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA temp_store=MEMORY;'
+                    f"PRAGMA cache_size=-{int(os.getenv('DB_SQLITE_CACHE_KB', 20000))};"
+                    f"PRAGMA mmap_size={int(os.getenv('DB_SQLITE_MMAP_BYTES', 128 * 1024 * 1024))}"
+                ),
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -122,6 +169,17 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Medication images are stripped of their metadata and resized by a Celery task after upload:
+# variant name -> largest width and height, the serializers return the 'thumbnail' one
+DRONE_IMAGE_VARIANTS = {
+    'thumbnail': int(os.getenv('DRONE_IMAGE_THUMBNAIL_SIZE', 160)),
+    'medium': int(os.getenv('DRONE_IMAGE_MEDIUM_SIZE', 640)),
+}
+DRONE_IMAGE_QUALITY = int(os.getenv('DRONE_IMAGE_QUALITY', 85))
+# internal nginx location of MEDIA_ROOT (e.g. '/protected-media/'): media responses then only carry an
+# X-Accel-Redirect and nginx sends the file, empty serves them from Django
+DRONE_MEDIA_ACCEL_REDIRECT = os.getenv('DRONE_MEDIA_ACCEL_REDIRECT', '')
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -131,5 +189,95 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://127.0.0.1:6379/1')  # Redis URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+# chords (the sharded battery sweep) need a result backend
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', CELERY_BROKER_URL)
 
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
+
+# Cache of drones read by the polled endpoints: 'locmem' keeps an in-process LRU per worker,
+# 'redis' shares one cache between workers using the Celery broker's Redis.
+# A local cache only sees invalidations from its own process, writes made by other
+# processes (e.g. the Celery battery sweep) show up once the entry times out.
+DRONE_CACHE_BACKEND = os.getenv('DRONE_CACHE_BACKEND', 'locmem')
+DRONE_CACHE_TIMEOUT = int(os.getenv('DRONE_CACHE_TIMEOUT', 30))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'drones': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'drones',
+        'TIMEOUT': DRONE_CACHE_TIMEOUT,
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('DRONE_CACHE_MAX_ENTRIES', 10000))},
+    },
+}
+if DRONE_CACHE_BACKEND == 'redis':
+    CACHES['drones'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CELERY_BROKER_URL,
+        'KEY_PREFIX': 'drones',
+        'TIMEOUT': DRONE_CACHE_TIMEOUT,
+    }
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # one JSON line per sampled profile
+        'src.drone.profiling': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# Share of the requests and Celery tasks profiled (wall time, query count and time, slowest queries),
+# each profile is logged on the src.drone.profiling logger and counted on /metrics/. Cheap enough to
+# leave on in production at a low rate such as 0.01
+DRONE_PROFILING_SAMPLE_RATE = float(os.getenv('DRONE_PROFILING_SAMPLE_RATE', 0))
+DRONE_PROFILING_TOP_QUERIES = int(os.getenv('DRONE_PROFILING_TOP_QUERIES', 5))
+# when set, sampled profiles slower than the threshold also write a cProfile dump to this directory
+DRONE_PROFILING_CPROFILE_DIR = os.getenv('DRONE_PROFILING_CPROFILE_DIR')
+DRONE_PROFILING_CPROFILE_THRESHOLD_MS = float(os.getenv('DRONE_PROFILING_CPROFILE_THRESHOLD_MS', 500))
+# comma separated client addresses allowed to scrape /metrics/ (staff users always are)
+DRONE_METRICS_ALLOWED_IPS = os.getenv('DRONE_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+
+# Render and parse JSON with orjson (src.drone.api.renderers), 'false' keeps DRF's stdlib json classes
+DRONE_FAST_JSON = os.getenv('DRONE_FAST_JSON', 'true').lower() == 'true'
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'src.drone.api.renderers.FastJSONRenderer' if DRONE_FAST_JSON else 'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'src.drone.api.renderers.FastJSONParser' if DRONE_FAST_JSON else 'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Run the independent queries of the async endpoints on separate threads and database connections,
+# worth it on PostgreSQL (ideally with connection pooling) where it is on by default, not on SQLite
+# where they are serialized anyway
+DRONE_ASYNC_CONCURRENT_QUERIES = os.getenv(
+    'DRONE_ASYNC_CONCURRENT_QUERIES', 'true' if DB_ENGINE == 'postgresql' else 'false',
+).lower() == 'true'
+
+# Number of drones projected and logged per batch by the periodic battery sweep
+DRONE_BATTERY_SWEEP_CHUNK_SIZE = int(os.getenv('DRONE_BATTERY_SWEEP_CHUNK_SIZE', 1000))
+# Number of drone ids per shard of the battery sweep, each shard is a Celery task
+DRONE_BATTERY_SWEEP_SHARD_SIZE = int(os.getenv('DRONE_BATTERY_SWEEP_SHARD_SIZE', 10000))
+# Sweeps never write to the drones, they only log projected battery levels. A full sweep logs every
+# drone, an incremental one only logs a level that moved by at least DRONE_BATTERY_LOG_DELTA since
+# the drone's last logged level
+DRONE_BATTERY_SWEEP_INCREMENTAL = os.getenv('DRONE_BATTERY_SWEEP_INCREMENTAL', 'false').lower() == 'true'
+DRONE_BATTERY_LOG_DELTA = Decimal(os.getenv('DRONE_BATTERY_LOG_DELTA', '1.0'))
+
+# Battery log retention: raw samples are rolled up hourly and purged after the raw horizon,
+# hourly rollups are rolled up daily and purged after the hourly horizon, daily rollups are kept
+DRONE_BATTERY_HISTORY_RAW_RETENTION_DAYS = int(os.getenv('DRONE_BATTERY_HISTORY_RAW_RETENTION_DAYS', 7))
+DRONE_BATTERY_HISTORY_HOURLY_RETENTION_DAYS = int(os.getenv('DRONE_BATTERY_HISTORY_HOURLY_RETENTION_DAYS', 90))
+# rows written or deleted per statement by the compaction
+DRONE_BATTERY_HISTORY_BATCH_SIZE = int(os.getenv('DRONE_BATTERY_HISTORY_BATCH_SIZE', 5000))
@@ -14,16 +14,23 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+
+from src.drone.media import serve_media
+from src.drone.views import metrics
 
 urlpatterns = [
     path('', include('src.drone.api.urls')),
     path('admin/', admin.site.urls),
+    path('metrics/', metrics, name='metrics'),
 ]
 
-# this will serve image files during development
-# for production we will be using s3 bucket to serve files
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# media files with ETags and range requests, sent with sendfile() or offloaded to nginx, see src.drone.media
+if not re.match(r'^\w+://', settings.MEDIA_URL):
+    urlpatterns += [
+        re_path(rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<path>.*)$', serve_media, name='media'),
+    ]